@@ -1,30 +1,85 @@
+import time
+# read before the other imports, so the startup report covers them
+PROCESS_STARTED = time.perf_counter()
 import logging
 import os
-from typing import Any
+from typing import Any, BinaryIO, Dict, Optional
 from flask import (
     Flask,
     jsonify,
     make_response,
     request,
-    abort)
-from cloud_providers.platforms import FileUploadError, RequriedParameterMissing, FileDownloadError, AzureConnectionError,AWSConnectionError
-from cloud_providers.platforms import CloudProviderType
+    abort,
+    g,
+    Response,
+    send_file,
+    stream_with_context)
+from cloud_providers.platforms import FileUploadError, RequriedParameterMissing, FileDownloadError, AzureConnectionError,AWSConnectionError, ItemNotFound
+from cloud_providers.platforms import DeleteOperationError
+from cloud_providers.platforms import BlobStream, generate_blob_name, LIST_PAGE_SIZE
+from cloud_providers.platforms import CloudProviderType, ServiceProvider
+from cloud_providers.archive import stream_zip
+from cloud_providers.links import link_cache, LINK_BATCH_LIMIT
+from cloud_providers.codecs import codecs, get_codec, DEFAULT_UPLOAD_CODEC, NO_CODEC
+from cloud_providers.disk_cache import CachedBlob, download_cache, DOWNLOAD_CACHE_ACCEL_PREFIX
+from cloud_providers.registry import PRELOAD_PROVIDERS
 from cloud_providers.services import (
+    providers,
     get_storage_provider,
     get_service_provider_client,
+    invalidate_service_client,
     map_cloud_providers)
 from uuid import uuid4
 from werkzeug.security import (
     generate_password_hash,
     check_password_hash)
 from datetime import datetime, timedelta
-from database.db_handler import users
-from models.users import create_user,set_azure_cloud_details, set_aws_cloud_details
+from database.db_handler import ensure_indexes
+from models import blob_catalog, jobs, sync_pairs, upload_sessions
+from models.users import (
+    create_user,
+    get_user,
+    get_login_user,
+    user_exists,
+    set_azure_cloud_details,
+    set_aws_cloud_details,
+    set_upload_codec)
 from functools import wraps
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 import jwt
+import job_queue
+import metrics
+import tasks
+import tracing
 
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'this-really-needs-to-be-changed'
+ensure_indexes()
+blob_catalog.start_reconciler()
+# Shared by every bulk upload, bounds the upload threads of the process
+bulk_upload_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('BULK_UPLOAD_WORKERS', 8)),
+    thread_name_prefix='bulk-upload')
+if PRELOAD_PROVIDERS:
+    providers.preload()
+metrics.install()
+tracing.install()
+if job_queue.JOB_WORKERS_IN_APP:
+    job_queue.start_workers()
+logging.info('App ready in {:.2f}s, storage providers: {}'.format(
+    time.perf_counter() - PROCESS_STARTED,
+    providers.describe()))
+
+
+def user_from_token(token: str) -> Dict[str, Any]:
+    # decoding the payload to fetch the stored details,
+    # raises when the token is invalid or expired
+    with tracing.span('token_decode'):
+        data = jwt.decode(token, app.config['SECRET_KEY'], algorithms='HS256')
+    with tracing.span('user_lookup'):
+        return get_user(data.get('public_id'))
 
 
 def token_required(f):
@@ -39,33 +94,243 @@ def token_required(f):
             return jsonify({'message': 'Token is missing !!'}), 401
 
         try:
-            # decoding the payload to fetch the stored details
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms='HS256')
-            print(data)
-            current_user = users.find_one({
-                "public_id": data.get('public_id')
-            })
+            current_user = user_from_token(token)
         except Exception:
             return jsonify({
                 'message': 'Token is invalid !!'
             }), 401
+        if not current_user:
+            return jsonify({
+                'message': 'Token is invalid !!'
+            }), 401
+        # user document is resolved once and shared through the request context
+        g.current_user = current_user
         # returns the current logged in users contex to the routes
         return f(current_user, *args, **kwargs)
     return decorated
 
 
+@app.before_request
+def start_request_metrics():
+    if not metrics.METRICS_ENABLED:
+        return
+    g.request_started = time.perf_counter()
+    # the URL rule, not the path, so filenames in URLs do not add series
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUESTS_IN_FLIGHT.labels(g.metrics_route).inc()
+
+
+@app.after_request
+def record_request_metrics(response: Response):
+    if 'request_started' not in g:
+        return response
+    g.metrics_recorded = True
+    route, method, started = g.metrics_route, request.method, g.request_started
+    current_user = g.get('current_user')
+    # never request.form here: a rejected upload would be parsed just for a label
+    cloud_type = current_user.get('cloud_provider') if current_user else g.get('metrics_provider')
+    request_bytes = request.content_length
+    status = response.status_code
+    # streamed bodies without a length are counted on their way out
+    sent = {'bytes': response.content_length}
+    if sent['bytes'] is None and response.is_streamed:
+        body = response.response
+
+        def counted() -> Any:
+            try:
+                for chunk in body:
+                    sent['bytes'] = (sent['bytes'] or 0) + len(chunk)
+                    yield chunk
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+        response.response = counted()
+
+    def finish() -> None:
+        # runs once the body was sent, so streamed downloads are fully timed
+        metrics.REQUESTS_IN_FLIGHT.labels(route).dec()
+        metrics.observe_request(
+            route, method, cloud_type, status, time.perf_counter() - started, request_bytes, sent['bytes'])
+    response.call_on_close(finish)
+    return response
+
+
+@app.teardown_request
+def close_request_metrics(error: Optional[BaseException]):
+    # requests which failed before a response was made
+    if 'request_started' in g and not g.get('metrics_recorded'):
+        metrics.REQUESTS_IN_FLIGHT.labels(g.metrics_route).dec()
+        metrics.observe_request(
+            g.metrics_route,
+            request.method,
+            None,
+            500,
+            time.perf_counter() - g.request_started,
+            request.content_length,
+            None)
+
+
+@app.before_request
+def start_request_trace():
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.trace = tracing.start_trace('{} {}'.format(request.method, route), profile=True)
+
+
+@app.after_request
+def add_trace_headers(response: Response):
+    trace = g.get('trace')
+    if trace is None:
+        return response
+    g.trace_closing = True
+    # phases timed so far, a streamed body is still to come
+    for name, value in tracing.trace_headers(trace):
+        response.headers[name] = value
+    status = response.status_code
+    response.call_on_close(lambda: tracing.finish_trace(trace, status=status))
+    return response
+
+
+@app.teardown_request
+def end_request_trace(error: Optional[BaseException]):
+    if not g.get('trace_closing'):
+        tracing.finish_trace(g.get('trace'), error=type(error).__name__ if error else None)
+
+
+def cloud_provider_not_registered(current_user: Dict[str, Any]):
+    return make_response(
+        jsonify(
+            status=417,
+            message=f"User: {current_user.get('name')}, Cloud provider is not registered! please register first. ",
+            data=None
+        ), 417
+    )
+
+
+def user_service_provider(current_user: Dict[str, Any]) -> ServiceProvider:
+    # Connected storage client of the logged in user's cloud
+    storage_provider = get_storage_provider(
+        current_user.get('cloud_provider'),
+        current_user)
+    return get_service_provider_client(storage_provider)
+
+
+def choose_codec(requested: Optional[str], current_user: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    # Upload codec: the request's, else the user's, else the server default
+    user_codec = current_user.get('upload_codec') if current_user else None
+    return requested or user_codec or DEFAULT_UPLOAD_CODEC
+
+
+def request_codec(current_user: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    return choose_codec(request.form.get('codec'), current_user)
+
+
+def queue_upload(
+    current_user: Dict[str, Any],
+    stream: BinaryIO,
+    filename: Optional[str],
+    content_type: Optional[str],
+    codec: Optional[str],
+    dedup: bool) -> Dict[str, Any]:
+    # Spools the file to this host's disk and queues the job sending it to
+    # the cloud, which only the workers of this host claim.
+    # An unknown codec raises ValueError here instead of failing the job
+    # after its retries.
+    get_codec(codec)
+    return job_queue.submit(
+        'upload',
+        current_user.get('public_id'),
+        providers=[current_user.get('cloud_provider')],
+        params={
+            'spool_path': tasks.spool_upload(stream),
+            'filename': filename,
+            'content_type': content_type,
+            'codec': codec,
+            'dedup': dedup
+        },
+        host=job_queue.HOST)
+
+
+def stream_response(blob_stream: BlobStream, filename: str, partial: bool = False) -> Response:
+    # Sends the raw object bytes chunk by chunk instead of building them in memory
+    # Compressed objects are decoded on the fly: their length is unknown
+    # and a Range request gets the whole object, so none are offered
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Accept-Ranges': 'bytes' if blob_stream.content_length is not None else 'none'
+    }
+    status = 200
+    if blob_stream.content_length is not None:
+        headers['Content-Length'] = str(blob_stream.content_length)
+        if partial:
+            status = 206
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                blob_stream.offset,
+                blob_stream.offset + blob_stream.content_length - 1,
+                blob_stream.total_length)
+    return Response(
+        stream_with_context(iter(blob_stream)),
+        status=status,
+        mimetype=blob_stream.content_type,
+        headers=headers,
+        direct_passthrough=True)
+
+
+def ranged_stream_response(provider: Any, filename: str) -> Response:
+    # Honors a single "Range: bytes=..." request header with a 206 response
+    byte_range = request.range
+    if not byte_range or len(byte_range.ranges) != 1:
+        return stream_response(provider.open_stream(filename), filename)
+    try:
+        props = provider.get_blob_properties(filename)
+    except FileDownloadError as fe:
+        return make_response(jsonify(status=409, message=str(fe), data=None), 409)
+    if props.get('codec'):
+        # compressed objects are sent whole, decoded
+        return stream_response(provider.open_stream(filename), filename)
+    size = props.get('size')
+    resolved = byte_range.range_for_length(size)
+    if resolved is None:
+        return make_response('', 416, {'Content-Range': f'bytes */{size}'})
+    start, stop = resolved
+    return stream_response(
+        provider.open_stream(filename, offset=start, length=stop - start),
+        filename,
+        partial=True)
+
+
+def cached_file_response(cached: CachedBlob, filename: str) -> Response:
+    # Zero copy: nginx sends the file itself (X-Accel-Redirect),
+    # or send_file hands it to the server's sendfile. Both answer Range requests.
+    if DOWNLOAD_CACHE_ACCEL_PREFIX:
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = DOWNLOAD_CACHE_ACCEL_PREFIX + cached.relative_path
+        response.headers['Content-Type'] = cached.content_type or 'application/octet-stream'
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    return send_file(
+        cached.path,
+        mimetype=cached.content_type or 'application/octet-stream',
+        as_attachment=True,
+        download_name=filename,
+        etag=cached.etag.strip('"') if cached.etag else True,
+        last_modified=cached.last_modified,
+        conditional=True)
+
+
 @app.route('/upload-public', methods=['POST'])
 def upload_anonymously_data():
     # For this we assume that bucket is publically accessible
     if not request.method == 'POST':
         abort(405)
     provider: str = request.form['provider']
+    g.metrics_provider = provider
     file_data = request.files.get('file')
     form_data = request.form
     try:
         storage_provider = get_storage_provider(provider, form_data)
         service_provider = get_service_provider_client(storage_provider)
-        service_provider.provider.upload_blob_public(file_data)
+        info = service_provider.provider.upload_blob_public(file_data, request_codec())
+        blob_catalog.record_blob(service_provider.provider, info)
     except RequriedParameterMissing as pre:
         return make_response(
             str(pre),
@@ -91,6 +356,7 @@ def get_public_data_url():
         abort(405)
     filename: str = request.form['filename']
     provider: str = request.form['provider']
+    g.metrics_provider = provider
     form_data = request.form
     try:
         storage_provider = get_storage_provider(provider, form_data)
@@ -100,7 +366,31 @@ def get_public_data_url():
             str(ace),
             409
         ))
-    return jsonify(service_provider.provider.get_temp_blob_link(filename))
+    return jsonify(link_cache.get_or_create(service_provider.provider, filename))
+
+
+@app.route('/view-public-batch', methods=['POST'])
+def get_public_data_urls():
+    # Signed links of many files in one call, e.g. for a gallery page
+    filenames = [name for name in request.form.getlist('filenames') if name]
+    provider: str = request.form.get('provider')
+    g.metrics_provider = provider
+    if not filenames or not provider:
+        return make_response('Required parameter missing!', 400)
+    if len(filenames) > LINK_BATCH_LIMIT:
+        return make_response(
+            jsonify(status=413, message=f'At most {LINK_BATCH_LIMIT} filenames per call', data=None), 413)
+    try:
+        storage_provider = get_storage_provider(provider, request.form)
+        service_provider = get_service_provider_client(storage_provider)
+    except RequriedParameterMissing as rpe:
+        return make_response(str(rpe), 400)
+    except (AzureConnectionError,AWSConnectionError) as ace:
+        return make_response(jsonify(status=409, message=str(ace), data=None), 409)
+    return jsonify(
+        status=200,
+        message='Success',
+        data=link_cache.get_many(service_provider.provider, filenames))
 
 
 @app.route('/delete', methods=['POST'])
@@ -108,20 +398,13 @@ def get_public_data_url():
 def delete_blob(current_user):
     if not request.method == 'POST':
         abort(405)
-    cloud_providers_list = users.find_one(filter={'public_id':current_user.get('public_id')})
-    if not cloud_providers_list.get('cloud_provider'):
-        return make_response(
-            jsonify(
-                status=417,
-                message=f"User: {cloud_providers_list.get('name')}, Cloud provider is not registered! please register first. ",
-                data=None
-            ), 417
-        )
+    if not current_user.get('cloud_provider'):
+        return cloud_provider_not_registered(current_user)
     filename: str = request.form['filename']
     try:
         storage_provider = get_storage_provider(
-            cloud_providers_list.get('cloud_provider'),
-            cloud_providers_list)
+            current_user.get('cloud_provider'),
+            current_user)
         service_provider = get_service_provider_client(storage_provider)
     except (AzureConnectionError,AWSConnectionError) as ace:
         return jsonify(make_response(
@@ -131,31 +414,101 @@ def delete_blob(current_user):
     ret = service_provider.provider.delete_blob(filename)
     if not ret:
         return make_response(jsonify(status=400, message='Error while deleting the object! Maybe, file is missing or something went wrong.', data=None), 400)
+    blob_catalog.remove_blob(service_provider.provider, filename)
+    if download_cache:
+        download_cache.discard(service_provider.provider, filename)
     return make_response(jsonify(status=200, message='Success', data=ret), 200)
 
 
+@app.route('/delete-batch', methods=['POST'])
+@token_required
+def delete_blobs(current_user):
+    # Deletes many objects with batch calls instead of one request per file
+    if not current_user.get('cloud_provider'):
+        return cloud_provider_not_registered(current_user)
+    filenames = [name for name in request.form.getlist('filenames') if name]
+    if not filenames:
+        return make_response('Required parameter missing!', 400)
+    if request.form.get('async') == 'true':
+        # large deletes run as a job, polled on /jobs/<job_id>
+        job = job_queue.submit(
+            'delete_blobs',
+            current_user.get('public_id'),
+            providers=[current_user.get('cloud_provider')],
+            params={'filenames': filenames})
+        return make_response(jsonify(status=202, message='Delete queued.', data=jobs.job_summary(job)), 202)
+    try:
+        service_provider = user_service_provider(current_user)
+        results = service_provider.provider.delete_blobs(filenames)
+    except (AzureConnectionError,AWSConnectionError) as ace:
+        return make_response(jsonify(status=409, message=str(ace), data=None), 409)
+    deleted = [name for name, ok in results.items() if ok]
+    blob_catalog.remove_blobs(service_provider.provider, deleted)
+    if download_cache:
+        for name in deleted:
+            download_cache.discard(service_provider.provider, name)
+    return jsonify(
+        status=200,
+        message='Success',
+        data={
+            'deleted': deleted,
+            'failed': [name for name, ok in results.items() if not ok]
+        })
+
+
+def parse_modified_since(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'modified_since: {value} is not an ISO date!')
+
+
 @app.route('/all', methods=['POST'])
 @token_required
 def list_blobs(current_user):
     if not request.method == 'POST':
         abort(405)
-    cloud_providers_list = users.find_one(filter={'public_id':current_user.get('public_id')})
-    if not cloud_providers_list.get('cloud_provider'):
-        return make_response(
-            jsonify(
-                status=417,
-                message=f"User: {cloud_providers_list.get('name')}, Cloud provider is not registered! please register first. ",
-                data=None
-            ), 417
-        )
+    if not current_user.get('cloud_provider'):
+        return cloud_provider_not_registered(current_user)
     try:
         storage_provider = get_storage_provider(
-            cloud_providers_list.get('cloud_provider'),
-            cloud_providers_list)
+            current_user.get('cloud_provider'),
+            current_user)
         service_provider = get_service_provider_client(storage_provider)
-        data = service_provider.provider.list_blob()
-        print(data)
-        return jsonify(status=200, message='Success', data= data)
+        # One page per call, next_token is passed back as continuation_token
+        page_args = dict(
+            prefix=request.form.get('prefix') or None,
+            page_size=min(max(request.form.get('page_size', LIST_PAGE_SIZE, type=int), 1), LIST_PAGE_SIZE),
+            continuation_token=request.form.get('continuation_token') or None)
+        delimiter = request.form.get('delimiter') or None
+        try:
+            modified_since = parse_modified_since(request.form.get('modified_since'))
+        except ValueError as ve:
+            return make_response(jsonify(status=400, message=str(ve), data=None), 400)
+        continuation_token = page_args.get('continuation_token')
+        # The catalog answers once the bucket was reconciled, source=cloud forces a live listing
+        if (not delimiter
+                and request.form.get('source') != 'cloud'
+                and (not continuation_token or blob_catalog.is_catalog_token(continuation_token))
+                and blob_catalog.is_synced(service_provider.provider)):
+            try:
+                page = blob_catalog.list_page(
+                    service_provider.provider,
+                    modified_since=modified_since,
+                    **page_args)
+            except ValueError as ve:
+                # a malformed catalog continuation token
+                return make_response(jsonify(status=400, message=str(ve), data=None), 400)
+        else:
+            page = service_provider.provider.list_blob_page(delimiter=delimiter, **page_args)
+        return jsonify(
+            status=200,
+            message='Success',
+            data=page.get('items'),
+            prefixes=page.get('prefixes'),
+            next_token=page.get('next_token'))
     except RequriedParameterMissing as rpe:
         return jsonify(make_response(
             str(rpe),
@@ -168,27 +521,50 @@ def list_blobs(current_user):
         ))
 
 
-@app.route('/download', methods=['POST'])
+@app.route('/catalog-sync', methods=['POST'])
+@token_required
+def sync_catalog(current_user):
+    # Re-syncs the object catalog of the user's bucket from the provider listing
+    if not current_user.get('cloud_provider'):
+        return cloud_provider_not_registered(current_user)
+    try:
+        service_provider = user_service_provider(current_user)
+        count = blob_catalog.reconcile(service_provider.provider)
+    except (AzureConnectionError,AWSConnectionError) as ace:
+        return make_response(jsonify(status=409, message=str(ace), data=None), 409)
+    return jsonify(status=200, message='Success', data={'objects': count})
+
+
+@app.route('/download', methods=['GET', 'POST'])
 @token_required
 def download_data(current_user):
-    if not request.method == 'POST':
+    if request.method not in ('GET', 'POST'):
         abort(405)
-    filename: str = request.form['filename']
-    cloud_providers_list = users.find_one(filter={'public_id':current_user.get('public_id')})
-    if not cloud_providers_list.get('cloud_provider'):
-        return make_response(
-            jsonify(
-                status=417,
-                message=f"User: {cloud_providers_list.get('name')}, Cloud provider is not registered! please register first. ",
-                data=None
-            ), 417
-        )
+    filename: str = request.values['filename']
+    # mode=stream sends the raw bytes, the default keeps the JSON payload.
+    # A Range header or a GET request always gets the raw bytes.
+    mode: str = request.values.get('mode', 'json')
+    if request.method == 'GET' or 'Range' in request.headers:
+        mode = 'stream'
+    if not current_user.get('cloud_provider'):
+        return cloud_provider_not_registered(current_user)
     try:
         storage_provider = get_storage_provider(
-            cloud_providers_list.get('cloud_provider'),
-            cloud_providers_list)
+            current_user.get('cloud_provider'),
+            current_user)
         service_provider = get_service_provider_client(storage_provider)
+        if mode == 'stream':
+            cached = download_cache.fetch(service_provider.provider, filename) if download_cache else None
+            if cached:
+                try:
+                    return cached_file_response(cached, filename)
+                except FileNotFoundError:
+                    # evicted in between, fall back to the provider
+                    pass
+            return ranged_stream_response(service_provider.provider, filename)
         data = service_provider.provider.download_blob(filename)
+    except ItemNotFound as nfe:
+        return make_response(jsonify(status=404, message=str(nfe), data=None), 404)
     except FileDownloadError as fe:
         return jsonify(make_response(
             str(fe),
@@ -203,27 +579,69 @@ def download_data(current_user):
     return jsonify(status=200,message='Success', data= data)
 
 
+@app.route('/download-archive', methods=['POST'])
+@token_required
+def download_archive(current_user):
+    # Streams a ZIP of the listed files, or of every file under a prefix
+    filenames = [name for name in request.form.getlist('filenames') if name]
+    prefix = request.form.get('prefix')
+    if not filenames and prefix is None:
+        return make_response('Required parameter missing!', 400)
+    if not current_user.get('cloud_provider'):
+        return cloud_provider_not_registered(current_user)
+    try:
+        service_provider = user_service_provider(current_user)
+    except (RequriedParameterMissing, AzureConnectionError, AWSConnectionError) as e:
+        return make_response(jsonify(status=409, message=str(e), data=None), 409)
+    provider = service_provider.provider
+    names = filenames or (item.get('filename') for item in provider.iter_blobs(prefix=prefix or None))
+    compression = zipfile.ZIP_DEFLATED if request.form.get('compress') == 'true' else zipfile.ZIP_STORED
+    archive_name = request.form.get('archive_name') or 'archive.zip'
+    return Response(
+        stream_with_context(stream_zip(provider, names, compression=compression)),
+        status=200,
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{archive_name}"'},
+        direct_passthrough=True)
+
+
 @app.route('/upload', methods=['POST'])
 @token_required
 def upload_data(current_user):
     if not request.method == 'POST':
         abort(405)
     data: Any = request.files.get('file')
-    cloud_providers_list = users.find_one(filter={'public_id':current_user.get('public_id')})
-    if not cloud_providers_list.get('cloud_provider'):
-        return make_response(
-            jsonify(
-                status=417,
-                message=f"User: {cloud_providers_list.get('name')}, Cloud provider is not registered! please register first. ",
-                data=None
-            ), 417
-        )
+    if not current_user.get('cloud_provider'):
+        return cloud_provider_not_registered(current_user)
+    if request.form.get('async') == 'true' and data:
+        try:
+            job = queue_upload(
+                current_user,
+                data.stream,
+                data.filename,
+                data.mimetype or None,
+                request_codec(current_user),
+                request.form.get('dedup') == 'true')
+        except ValueError as ve:
+            return make_response(jsonify(status=400, message=str(ve), data=None), 400)
+        return make_response(jsonify(status=202, message='Upload queued.', data=jobs.job_summary(job)), 202)
     try:
         storage_provider = get_storage_provider(
-            cloud_providers_list.get('cloud_provider'),
-            cloud_providers_list)
+            current_user.get('cloud_provider'),
+            current_user)
         service_provider = get_service_provider_client(storage_provider)
-        service_provider.provider.upload_blob(data)
+        if request.form.get('dedup') == 'true':
+            info, deduplicated = blob_catalog.upload_deduplicated(
+                service_provider.provider,
+                data,
+                current_user.get('public_id'),
+                request_codec(current_user))
+            return jsonify(
+                status=200,
+                message='Upload Done!',
+                data={'filename': info.get('filename'), 'deduplicated': deduplicated})
+        info = service_provider.provider.upload_blob(data, request_codec(current_user))
+        blob_catalog.record_blob(service_provider.provider, info, current_user.get('public_id'))
     except Exception as e:
         logging.error(e)
         return make_response(
@@ -233,6 +651,361 @@ def upload_data(current_user):
     return jsonify(status=200,message='Upload Done!')
 
 
+@app.route('/upload-bulk', methods=['POST'])
+@token_required
+def upload_bulk_data(current_user):
+    # Uploads every file of the multipart request concurrently,
+    # one failing file does not fail the others
+    files = [file for file in request.files.getlist('files') if file]
+    if not files:
+        return make_response('Required parameter missing!', 400)
+    if not current_user.get('cloud_provider'):
+        return cloud_provider_not_registered(current_user)
+    try:
+        service_provider = user_service_provider(current_user)
+    except (RequriedParameterMissing, AzureConnectionError, AWSConnectionError) as e:
+        return make_response(jsonify(status=409, message=str(e), data=None), 409)
+    provider = service_provider.provider
+    public_id = current_user.get('public_id')
+    dedup = request.form.get('dedup') == 'true'
+    codec = request_codec(current_user)
+
+    def upload_one(file: Any) -> Dict[str, Any]:
+        try:
+            if dedup:
+                info, deduplicated = blob_catalog.upload_deduplicated(provider, file, public_id, codec)
+                return {
+                    'file': file.filename,
+                    'status': 200,
+                    'filename': info.get('filename'),
+                    'deduplicated': deduplicated
+                }
+            info = provider.upload_blob(file, codec)
+        except Exception as e:
+            logging.error(e)
+            return {'file': file.filename, 'status': 400, 'message': str(e)}
+        blob_catalog.record_blob(provider, info, public_id)
+        return {'file': file.filename, 'status': 200, 'filename': info.get('filename')}
+
+    results = list(bulk_upload_executor.map(upload_one, files))
+    failed = sum(1 for result in results if result.get('status') != 200)
+    status = 200 if not failed else 207
+    return make_response(
+        jsonify(
+            status=status,
+            message='Upload Done!' if not failed else f'{failed} of {len(results)} uploads failed!',
+            data=results),
+        status)
+
+
+@app.route('/upload-session', methods=['POST'])
+@token_required
+def init_upload_session(current_user):
+    # Starts a resumable upload, parts are then sent one by one
+    filename: str = request.form.get('filename')
+    if not filename:
+        return make_response('Required parameter missing!', 400)
+    if not current_user.get('cloud_provider'):
+        return cloud_provider_not_registered(current_user)
+    content_type = request.form.get('content_type')
+    blob_name = generate_blob_name(filename)
+    try:
+        service_provider = user_service_provider(current_user)
+        upload_id = service_provider.provider.create_multipart_upload(blob_name, content_type)
+    except (RequriedParameterMissing, FileUploadError) as e:
+        return make_response(jsonify(status=400, message=str(e), data=None), 400)
+    except (AzureConnectionError,AWSConnectionError) as ace:
+        return make_response(jsonify(status=409, message=str(ace), data=None), 409)
+    session = upload_sessions.create_session(
+        public_id=current_user.get('public_id'),
+        cloud_provider=current_user.get('cloud_provider'),
+        bucket_name=current_user.get('bucket_name'),
+        blob_name=blob_name,
+        upload_id=upload_id,
+        content_type=content_type)
+    return make_response(
+        jsonify(status=201, message='Upload session created.', data=upload_sessions.session_summary(session)),
+        201)
+
+
+def active_upload_session(current_user: Dict[str, Any], session_id: str):
+    # Returns (session, error response)
+    session = upload_sessions.get_session(session_id, current_user.get('public_id'))
+    if not session:
+        return None, make_response(jsonify(status=404, message='Upload session not found!', data=None), 404)
+    if session.get('status') != upload_sessions.ACTIVE:
+        return None, make_response(
+            jsonify(status=409, message=f"Upload session is {session.get('status')}!", data=None), 409)
+    if session.get('bucket_name') != current_user.get('bucket_name'):
+        return None, make_response(
+            jsonify(status=409, message='Cloud details changed since the upload session started!', data=None), 409)
+    return session, None
+
+
+@app.route('/upload-session/<session_id>/part/<int:part_number>', methods=['PUT'])
+@token_required
+def upload_session_part(current_user, session_id: str, part_number: int):
+    # Raw part bytes are sent as the request body, parts are numbered from 1
+    if not 1 <= part_number <= 10000:
+        return make_response(jsonify(status=400, message='Part number must be between 1 and 10000!', data=None), 400)
+    session, error = active_upload_session(current_user, session_id)
+    if error:
+        return error
+    data: bytes = request.get_data(cache=False)
+    if not data:
+        return make_response('Required parameter missing!', 400)
+    try:
+        service_provider = user_service_provider(current_user)
+        tag = service_provider.provider.upload_part(
+            session.get('blob_name'),
+            session.get('upload_id'),
+            part_number,
+            data)
+    except FileUploadError as fe:
+        return make_response(jsonify(status=400, message=str(fe), data=None), 400)
+    except (AzureConnectionError,AWSConnectionError) as ace:
+        return make_response(jsonify(status=409, message=str(ace), data=None), 409)
+    upload_sessions.record_part(session_id, part_number, tag, len(data))
+    return jsonify(status=200, message='Part uploaded.', data={'part_number': part_number, 'size': len(data)})
+
+
+@app.route('/upload-session/<session_id>', methods=['GET'])
+@token_required
+def upload_session_status(current_user, session_id: str):
+    # Lists the acknowledged parts, so a client can resume after the last one
+    session = upload_sessions.get_session(session_id, current_user.get('public_id'))
+    if not session:
+        return make_response(jsonify(status=404, message='Upload session not found!', data=None), 404)
+    return jsonify(status=200, message='Success', data=upload_sessions.session_summary(session))
+
+
+@app.route('/upload-session/<session_id>/complete', methods=['POST'])
+@token_required
+def complete_upload_session(current_user, session_id: str):
+    session, error = active_upload_session(current_user, session_id)
+    if error:
+        return error
+    parts = upload_sessions.session_parts(session)
+    if not parts:
+        return make_response(jsonify(status=400, message='No parts uploaded yet!', data=None), 400)
+    try:
+        service_provider = user_service_provider(current_user)
+        info = service_provider.provider.complete_multipart_upload(
+            session.get('blob_name'),
+            session.get('upload_id'),
+            parts,
+            session.get('content_type'))
+        info['size'] = upload_sessions.session_summary(session).get('uploaded_bytes')
+        blob_catalog.record_blob(service_provider.provider, info, current_user.get('public_id'))
+    except FileUploadError as fe:
+        return make_response(jsonify(status=400, message=str(fe), data=None), 400)
+    except (AzureConnectionError,AWSConnectionError) as ace:
+        return make_response(jsonify(status=409, message=str(ace), data=None), 409)
+    upload_sessions.set_session_status(session_id, upload_sessions.COMPLETED)
+    return jsonify(status=200, message='Upload Done!', data={'filename': session.get('blob_name')})
+
+
+@app.route('/upload-session/<session_id>', methods=['DELETE'])
+@token_required
+def abort_upload_session(current_user, session_id: str):
+    session, error = active_upload_session(current_user, session_id)
+    if error:
+        return error
+    try:
+        service_provider = user_service_provider(current_user)
+        service_provider.provider.abort_multipart_upload(
+            session.get('blob_name'),
+            session.get('upload_id'))
+    except DeleteOperationError as de:
+        return make_response(jsonify(status=400, message=str(de), data=None), 400)
+    except (AzureConnectionError,AWSConnectionError) as ace:
+        return make_response(jsonify(status=409, message=str(ace), data=None), 409)
+    upload_sessions.set_session_status(session_id, upload_sessions.ABORTED)
+    return jsonify(status=200, message='Upload aborted.', data={'filename': session.get('blob_name')})
+
+
+@app.route('/upload-link', methods=['POST'])
+@token_required
+def create_upload_link(current_user):
+    # Signs a short lived link, the client uploads straight to the bucket
+    # and then calls /upload-link/complete
+    filename: str = request.form.get('filename')
+    if not filename:
+        return make_response('Required parameter missing!', 400)
+    if not current_user.get('cloud_provider'):
+        return cloud_provider_not_registered(current_user)
+    blob_name = generate_blob_name(filename)
+    try:
+        service_provider = user_service_provider(current_user)
+        link = service_provider.provider.get_upload_link(
+            blob_name,
+            content_type=request.form.get('content_type'),
+            max_size=request.form.get('max_size', type=int))
+    except (AzureConnectionError,AWSConnectionError) as ace:
+        return make_response(jsonify(status=409, message=str(ace), data=None), 409)
+    link['filename'] = blob_name
+    link['expires_in'] = service_provider.provider.link_expiry
+    return make_response(jsonify(status=201, message='Upload link created.', data=link), 201)
+
+
+@app.route('/upload-link/complete', methods=['POST'])
+@token_required
+def complete_upload_link(current_user):
+    # Records an object the client uploaded through an upload link
+    filename: str = request.form.get('filename')
+    if not filename:
+        return make_response('Required parameter missing!', 400)
+    if not current_user.get('cloud_provider'):
+        return cloud_provider_not_registered(current_user)
+    try:
+        service_provider = user_service_provider(current_user)
+        info = service_provider.provider.get_blob_properties(filename)
+    except ItemNotFound as nfe:
+        return make_response(jsonify(status=404, message=str(nfe), data=None), 404)
+    except FileDownloadError as fe:
+        return make_response(jsonify(status=409, message=str(fe), data=None), 409)
+    except (AzureConnectionError,AWSConnectionError) as ace:
+        return make_response(jsonify(status=409, message=str(ace), data=None), 409)
+    blob_catalog.record_blob(service_provider.provider, info, current_user.get('public_id'))
+    return jsonify(status=200, message='Upload Done!', data=info)
+
+
+@app.route('/upload-codec', methods=['POST'])
+@token_required
+def set_user_upload_codec(current_user):
+    # Default codec of the user's uploads, `none` stores them raw
+    codec: str = request.form.get('codec')
+    if codec and codec != NO_CODEC and codec not in codecs:
+        return make_response(
+            jsonify(status=400, message=f'Unsupported codec: {codec}, available: {", ".join(codecs)}', data=None), 400)
+    set_upload_codec(current_user.get('public_id'), codec)
+    return jsonify(status=200, message='Upload codec updated.', data={'codec': codec or DEFAULT_UPLOAD_CODEC})
+
+
+def transfer_endpoints(current_user: Dict[str, Any], target_prefix: str):
+    # Returns (source, destination, error response) of /copy and /sync:
+    # the user's bucket and the one given like for /upload-public
+    if not current_user.get('cloud_provider'):
+        return None, None, cloud_provider_not_registered(current_user)
+    try:
+        source = user_service_provider(current_user).provider
+        destination = get_service_provider_client(
+            get_storage_provider(request.form.get('provider'), request.form)).provider
+    except (RequriedParameterMissing, AzureConnectionError, AWSConnectionError) as e:
+        return None, None, make_response(jsonify(status=409, message=str(e), data=None), 409)
+    if (not target_prefix
+            and source.credentials_key() == destination.credentials_key()
+            and source.storage_location() == destination.storage_location()):
+        return None, None, make_response(
+            jsonify(status=400, message='Source and destination are the same, set a target_prefix!', data=None), 400)
+    return source, destination, None
+
+
+@app.route('/copy', methods=['POST'])
+@token_required
+def start_copy_job(current_user):
+    # Copies blobs of the user's bucket to another bucket/container, given like
+    # /upload-public: provider, its credentials and bucket_name. The blobs are
+    # the repeated filenames field, or every blob under prefix.
+    filenames = [name for name in request.form.getlist('filenames') if name]
+    prefix = request.form.get('prefix')
+    target_prefix = request.form.get('target_prefix') or ''
+    if not (filenames or prefix is not None) or not request.form.get('provider'):
+        return make_response('Required parameter missing!', 400)
+    source, destination, error = transfer_endpoints(current_user, target_prefix)
+    if error:
+        return error
+    job = job_queue.submit(
+        'copy',
+        current_user.get('public_id'),
+        providers=[source.cloud_type, destination.cloud_type],
+        params={
+            'source': {'cloud_provider': source.cloud_type, 'bucket_name': source.storage_location()},
+            'destination': {'cloud_provider': destination.cloud_type, 'bucket_name': destination.storage_location()},
+            'filenames': filenames,
+            'prefix': prefix,
+            'target_prefix': target_prefix
+        },
+        secrets={'destination': tasks.destination_details(request.form)})
+    return make_response(
+        jsonify(status=202, message='Copy queued.', data=jobs.job_summary(job)),
+        202)
+
+
+@app.route('/sync', methods=['POST'])
+@token_required
+def start_sync(current_user):
+    # Mirrors the user's bucket (under prefix) to another bucket/container,
+    # given like for /copy. Only new and changed blobs are copied, delete=true
+    # also removes blobs missing from the source. An interrupted sync of the
+    # same pair resumes after its checkpoint, also when its job is retried.
+    if not request.form.get('provider'):
+        return make_response('Required parameter missing!', 400)
+    prefix = request.form.get('prefix') or ''
+    target_prefix = request.form.get('target_prefix') or ''
+    delete_extras = request.form.get('delete') == 'true'
+    source, destination, error = transfer_endpoints(current_user, target_prefix)
+    if error:
+        return error
+    if (source.credentials_key() == destination.credentials_key()
+            and source.storage_location() == destination.storage_location()):
+        # the mirrored blobs would be listed as sources again on the next run
+        return make_response(
+            jsonify(status=400, message='Sync needs another bucket or container!', data=None), 400)
+    public_id = current_user.get('public_id')
+    definition = {
+        'source': {'cloud_provider': source.cloud_type, 'bucket_name': source.storage_location()},
+        'destination': {'cloud_provider': destination.cloud_type, 'bucket_name': destination.storage_location()},
+        'prefix': prefix,
+        'target_prefix': target_prefix,
+        'delete_extras': delete_extras
+    }
+    pair_id = sync_pairs.make_pair_id(
+        public_id, definition['source'], definition['destination'], prefix, target_prefix)
+    if sync_pairs.is_running(sync_pairs.get_pair(pair_id, public_id)):
+        return make_response(jsonify(status=409, message='This sync is already running!', data=None), 409)
+    job = job_queue.submit(
+        'sync',
+        public_id,
+        providers=[source.cloud_type, destination.cloud_type],
+        params={'pair_id': pair_id, 'definition': definition},
+        secrets={'destination': tasks.destination_details(request.form)})
+    return make_response(
+        jsonify(status=202, message='Sync queued.', data={**jobs.job_summary(job), 'pair_id': pair_id}),
+        202)
+
+
+@app.route('/sync/<pair_id>', methods=['GET'])
+@token_required
+def sync_status(current_user, pair_id: str):
+    # State of the last sync of a pair and its progress
+    pair = sync_pairs.get_pair(pair_id, current_user.get('public_id'))
+    if not pair:
+        return make_response(jsonify(status=404, message='Sync not found!', data=None), 404)
+    return jsonify(status=200, message='Success', data=sync_pairs.pair_summary(pair))
+
+
+@app.route('/jobs', methods=['GET'])
+@token_required
+def list_user_jobs(current_user):
+    # The user's latest jobs, newest first, optionally only those with ?status=
+    found = jobs.list_jobs(
+        current_user.get('public_id'),
+        status=request.args.get('status') or None,
+        limit=min(max(request.args.get('limit', 50, type=int), 1), 200))
+    return jsonify(status=200, message='Success', data=[jobs.job_summary(job) for job in found])
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@token_required
+def job_status(current_user, job_id: str):
+    # Status, progress and result of a queued job
+    job = jobs.get_job(job_id, current_user.get('public_id'))
+    if not job:
+        return make_response(jsonify(status=404, message='Job not found!', data=None), 404)
+    return jsonify(status=200, message='Success', data=jobs.job_summary(job))
+
+
 @app.route('/add', methods=['POST'])
 @token_required
 def add_cloud_cred(current_user):
@@ -251,6 +1024,10 @@ def add_cloud_cred(current_user):
                 data=None
             ), 409
         )
+    # Credentials are about to change, so the pooled client for the old ones is dropped
+    old_storage_provider = get_storage_provider(cloud_provider, current_user)
+    if old_storage_provider:
+        invalidate_service_client(old_storage_provider)
     try:
         if cloud_provider == CloudProviderType.AWS.value:
             access_key_id = form.get('access_key')
@@ -313,10 +1090,7 @@ def login():
             401,
             {'WWW-Authenticate': 'Basic realm ="Login Required!"'}
         )
-    user = users.find_one({
-        "email": auth.get('email'),
-        "cloud_provider": auth.get('provider')
-    })
+    user = get_login_user(auth.get('email'), auth.get('provider'))
     if not user:
         return make_response(
             "Could not verify, maybe user doesn't exist with the cloud provider!",
@@ -350,8 +1124,7 @@ def signup():
     password = data.get('password')
     provider = data.get('provider')
     # checking for existing user
-    ext_user = users.find_one({"email": email, "cloud_provider": provider})
-    if not ext_user:
+    if not user_exists(email, provider):
         # database ORM object
         new_user = create_user(
             str(uuid4()),
@@ -360,10 +1133,18 @@ def signup():
             generate_password_hash(password),
             provider
         )
-        return make_response(f'UserId:{new_user} Successfully registered.', 201)
-    else:
-        # returns 202 if user already exists
-        return make_response('User already exists with that cloud provider! Please Log in.', 202)
+        if new_user:
+            return make_response(f'UserId:{new_user} Successfully registered.', 201)
+    # returns 202 if user already exists
+    return make_response('User already exists with that cloud provider! Please Log in.', 202)
+
+
+@app.route('/metrics', methods=['GET'])
+def scrape_metrics():
+    if not metrics.METRICS_ENABLED:
+        abort(404)
+    payload, content_type = metrics.render()
+    return Response(payload, status=200, content_type=content_type)
 
 
 @app.route('/', methods=['GET'])
@@ -0,0 +1,370 @@
+"""
+ASGI serving mode:
+The storage hot paths (/all, /download, /upload, /delete, /view-public)
+run natively on asyncio with the async providers, so a single process keeps
+many cloud transfers in flight. Every other route is served by the Flask app.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import json
+import logging
+import time
+from datetime import datetime
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import http_date, parse_range_header
+import metrics
+import tracing
+from app import app as flask_app, choose_codec, parse_modified_since, queue_upload, user_from_token
+from cloud_providers.aio_platforms import AsyncBlobStream, AsyncStorageAction
+from cloud_providers.aio_services import (
+    async_client_pool,
+    get_async_storage_provider,
+    get_async_service_client)
+from cloud_providers.links import link_cache
+from cloud_providers.platforms import (
+    AzureConnectionError,
+    AWSConnectionError,
+    FileDownloadError,
+    ItemNotFound,
+    RequriedParameterMissing,
+    LIST_PAGE_SIZE,
+    content_digest)
+from models import blob_catalog, jobs
+
+
+class JSONDateResponse(JSONResponse):
+    """JSONResponse rendering datetimes the way Flask's jsonify does"""
+    def render(self, content: Any) -> bytes:
+        return json.dumps(
+            content,
+            default=lambda value: http_date(value) if isinstance(value, datetime) else str(value)
+        ).encode('utf-8')
+
+
+def json_response(status: int, message: str, data: Any = None, **extra: Any) -> Response:
+    return JSONDateResponse(dict(status=status, message=message, data=data, **extra), status_code=status)
+
+
+class MetricsMiddleware:
+    """Request metrics of the native routes, the Flask app records its own"""
+    def __init__(self, app: Callable, routes: Iterable[str]) -> None:
+        self.app = app
+        self.routes = set(routes)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope['type'] != 'http' or scope['path'] not in self.routes or not metrics.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        route = scope['path']
+        started = time.perf_counter()
+        response = {'status': 500, 'bytes': 0}
+
+        async def counting_send(message: Dict[str, Any]) -> None:
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['bytes'] += len(message.get('body', b''))
+            await send(message)
+        metrics.REQUESTS_IN_FLIGHT.labels(route).inc()
+        try:
+            await self.app(scope, receive, counting_send)
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.labels(route).dec()
+            content_length = dict(scope['headers']).get(b'content-length')
+            metrics.observe_request(
+                route,
+                scope['method'],
+                # set by the endpoints through request.state
+                scope.get('state', {}).get('provider'),
+                response['status'],
+                time.perf_counter() - started,
+                int(content_length) if content_length and content_length.isdigit() else None,
+                response['bytes'])
+
+
+class TracingMiddleware:
+    """Traces the native routes and adds Server-Timing, the Flask app traces its own"""
+    def __init__(self, app: Callable, routes: Iterable[str]) -> None:
+        self.app = app
+        self.routes = set(routes)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope['type'] != 'http' or scope['path'] not in self.routes:
+            await self.app(scope, receive, send)
+            return
+        # the event loop thread serves many requests, so these are never profiled
+        trace = tracing.start_trace('{} {}'.format(scope['method'], scope['path']))
+        status = {}
+
+        async def timed_send(message: Dict[str, Any]) -> None:
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                message['headers'] = [
+                    *message.get('headers', []),
+                    *((name.lower().encode('latin-1'), value.encode('latin-1'))
+                      for name, value in tracing.trace_headers(trace))
+                ]
+            await send(message)
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            tracing.finish_trace(trace, status=status.get('code'))
+
+
+def token_required(endpoint):
+    # Resolves the user and a connected async provider for the route
+    @wraps(endpoint)
+    async def decorated(request: Request) -> Response:
+        token = request.headers.get('x-access-token')
+        if not token:
+            return JSONResponse({'message': 'Token is missing !!'}, status_code=401)
+        try:
+            # user documents are cached, MongoDB is only hit on a miss.
+            # The thread pool runs a copy of the context, so its spans join the trace.
+            current_user = await run_in_threadpool(user_from_token, token)
+        except Exception:
+            current_user = None
+        if not current_user:
+            return JSONResponse({'message': 'Token is invalid !!'}, status_code=401)
+        request.state.provider = current_user.get('cloud_provider')
+        if not current_user.get('cloud_provider'):
+            return json_response(
+                417,
+                f"User: {current_user.get('name')}, Cloud provider is not registered! please register first. ")
+        try:
+            provider = await get_async_service_client(
+                get_async_storage_provider(current_user.get('cloud_provider'), current_user))
+        except RequriedParameterMissing as rpe:
+            return json_response(412, str(rpe))
+        except (AzureConnectionError, AWSConnectionError) as ace:
+            return json_response(409, str(ace))
+        return await endpoint(request, current_user, provider)
+    return decorated
+
+
+async def list_blobs(request: Request, current_user: Dict[str, Any], provider: AsyncStorageAction) -> Response:
+    form = await request.form()
+    try:
+        page_size = int(form.get('page_size') or LIST_PAGE_SIZE)
+    except ValueError:
+        # like Flask's type=int, an unparsable value falls back to the default
+        page_size = LIST_PAGE_SIZE
+    page_args = dict(
+        prefix=form.get('prefix') or None,
+        page_size=min(max(page_size, 1), LIST_PAGE_SIZE),
+        continuation_token=form.get('continuation_token') or None)
+    delimiter = form.get('delimiter') or None
+    try:
+        modified_since = parse_modified_since(form.get('modified_since'))
+    except ValueError as ve:
+        return json_response(400, str(ve))
+    continuation_token = page_args.get('continuation_token')
+    if (not delimiter
+            and form.get('source') != 'cloud'
+            and (not continuation_token or blob_catalog.is_catalog_token(continuation_token))
+            and await run_in_threadpool(blob_catalog.is_synced, provider)):
+        try:
+            page = await run_in_threadpool(
+                blob_catalog.list_page,
+                provider,
+                modified_since=modified_since,
+                **page_args)
+        except ValueError as ve:
+            # a malformed catalog continuation token
+            return json_response(400, str(ve))
+    else:
+        page = await provider.list_blob_page(delimiter=delimiter, **page_args)
+    return json_response(
+        200,
+        'Success',
+        page.get('items'),
+        prefixes=page.get('prefixes'),
+        next_token=page.get('next_token'))
+
+
+def stream_response(blob_stream: AsyncBlobStream, filename: str, partial: bool = False) -> Response:
+    # Compressed objects are decoded on the fly: their length is unknown
+    # and a Range request gets the whole object, so none are offered
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Accept-Ranges': 'bytes' if blob_stream.content_length is not None else 'none'
+    }
+    status = 200
+    if blob_stream.content_length is not None:
+        headers['Content-Length'] = str(blob_stream.content_length)
+        if partial:
+            status = 206
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                blob_stream.offset,
+                blob_stream.offset + blob_stream.content_length - 1,
+                blob_stream.total_length)
+    return StreamingResponse(
+        blob_stream,
+        status_code=status,
+        media_type=blob_stream.content_type,
+        headers=headers)
+
+
+async def download_data(request: Request, current_user: Dict[str, Any], provider: AsyncStorageAction) -> Response:
+    values = dict(request.query_params)
+    if request.method == 'POST':
+        values.update(await request.form())
+    filename = values.get('filename')
+    if not filename:
+        return Response('Required parameter missing!', status_code=400)
+    mode = values.get('mode', 'json')
+    range_header = request.headers.get('Range')
+    if request.method == 'GET' or range_header:
+        mode = 'stream'
+    try:
+        if mode != 'stream':
+            blob_stream = await provider.open_stream(filename)
+            data = b''.join([chunk async for chunk in blob_stream])
+            return json_response(200, 'Success', str(data))
+        byte_range = parse_range_header(range_header) if range_header else None
+        if not byte_range or len(byte_range.ranges) != 1:
+            return stream_response(await provider.open_stream(filename), filename)
+        props = await provider.get_blob_properties(filename)
+        if props.get('codec'):
+            # compressed objects are sent whole, decoded
+            return stream_response(await provider.open_stream(filename), filename)
+        size = props.get('size')
+        resolved = byte_range.range_for_length(size)
+        if resolved is None:
+            return Response('', status_code=416, headers={'Content-Range': f'bytes */{size}'})
+        start, stop = resolved
+        return stream_response(
+            await provider.open_stream(filename, offset=start, length=stop - start),
+            filename,
+            partial=True)
+    except ItemNotFound as nfe:
+        return json_response(404, str(nfe))
+    except FileDownloadError as fe:
+        return json_response(409, str(fe))
+
+
+async def upload_deduplicated(
+    provider: AsyncStorageAction,
+    file: Any,
+    public_id: Optional[str],
+    codec: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+    # blob_catalog.upload_deduplicated for the async providers, the spooled
+    # upload file is hashed in a worker thread. Returns (object info, deduplicated)
+    digest = await run_in_threadpool(content_digest, file.file)
+    if digest:
+        existing = await run_in_threadpool(blob_catalog.find_by_digest, provider, digest)
+        if existing:
+            try:
+                # the catalog may be behind a delete done outside of the app
+                await provider.get_blob_properties(existing.get('filename'))
+                return existing, True
+            except ItemNotFound:
+                await run_in_threadpool(blob_catalog.remove_blob, provider, existing.get('filename'))
+    info = await provider.upload_blob(file, codec)
+    if info and digest:
+        info['sha256'] = digest
+    await run_in_threadpool(blob_catalog.record_blob, provider, info, public_id)
+    return info, False
+
+
+async def upload_data(request: Request, current_user: Dict[str, Any], provider: AsyncStorageAction) -> Response:
+    form = await request.form()
+    file = form.get('file')
+    if not file or isinstance(file, str):
+        return Response('Required parameter missing!', status_code=400)
+    codec = choose_codec(form.get('codec'), current_user)
+    if form.get('async') == 'true':
+        # spooled and queued as in the Flask route
+        try:
+            job = await run_in_threadpool(
+                queue_upload,
+                current_user,
+                file.file,
+                file.filename,
+                file.content_type or None,
+                codec,
+                form.get('dedup') == 'true')
+        except ValueError as ve:
+            return json_response(400, str(ve))
+        finally:
+            await file.close()
+        return json_response(202, 'Upload queued.', jobs.job_summary(job))
+    try:
+        if form.get('dedup') == 'true':
+            info, deduplicated = await upload_deduplicated(provider, file, current_user.get('public_id'), codec)
+            return json_response(
+                200,
+                'Upload Done!',
+                {'filename': info.get('filename'), 'deduplicated': deduplicated})
+        info = await provider.upload_blob(file, codec)
+    except Exception as e:
+        # same mapping as the Flask route: any provider or codec error is a 400
+        logging.error(e)
+        return Response(str(e), status_code=400)
+    finally:
+        await file.close()
+    await run_in_threadpool(blob_catalog.record_blob, provider, info, current_user.get('public_id'))
+    return JSONResponse({'status': 200, 'message': 'Upload Done!'})
+
+
+async def delete_blob(request: Request, current_user: Dict[str, Any], provider: AsyncStorageAction) -> Response:
+    form = await request.form()
+    filename = form.get('filename')
+    if not filename:
+        return Response('Required parameter missing!', status_code=400)
+    if not await provider.delete_blob(filename):
+        return json_response(400, 'Error while deleting the object! Maybe, file is missing or something went wrong.')
+    await run_in_threadpool(blob_catalog.remove_blob, provider, filename)
+    return json_response(200, 'Success', True)
+
+
+async def get_public_data_url(request: Request) -> Response:
+    # For this we assume that bucket is publically accessible
+    form = await request.form()
+    request.state.provider = form.get('provider')
+    provider = get_async_storage_provider(form.get('provider'), form)
+    if not provider or not form.get('filename'):
+        return Response('Required parameter missing!', status_code=400)
+    try:
+        await get_async_service_client(provider)
+    except RequriedParameterMissing as rpe:
+        return Response(str(rpe), status_code=400)
+    except (AzureConnectionError, AWSConnectionError) as ace:
+        return json_response(409, str(ace))
+    filename = form.get('filename')
+    url = link_cache.get(provider, filename)
+    if url is None:
+        signed_at = time.monotonic()
+        url = await provider.get_temp_blob_link(filename)
+        link_cache.put(provider, filename, url, signed_at)
+    return JSONResponse(url)
+
+
+native_routes = [
+    Route('/all', token_required(list_blobs), methods=['POST']),
+    Route('/download', token_required(download_data), methods=['GET', 'POST']),
+    Route('/upload', token_required(upload_data), methods=['POST']),
+    Route('/delete', token_required(delete_blob), methods=['POST']),
+    Route('/view-public', get_public_data_url, methods=['POST']),
+]
+
+app = Starlette(
+    routes=[
+        *native_routes,
+        # everything else keeps running on the Flask app
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[
+        Middleware(MetricsMiddleware, routes=[route.path for route in native_routes]),
+        Middleware(TracingMiddleware, routes=[route.path for route in native_routes])
+    ],
+    on_shutdown=[async_client_pool.close]
+)
@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import os
+from contextlib import AsyncExitStack
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from botocore.exceptions import ClientError
+from .platforms import (
+    CloudProviderType,
+    FileDownloadError,
+    FileUploadError,
+    ItemNotFound,
+    RequriedParameterMissing,
+    LIST_PAGE_SIZE,
+    STREAM_CHUNK_SIZE,
+    AWS_LINK_EXPIRY,
+    AWS_ENDPOINT_URL,
+    encode_stream,
+    generate_blob_name,
+    stored_codec)
+from .aio_platforms import AsyncBlobStream, AsyncStorageAction
+from .codecs import CODEC_METADATA_KEY, decode_async_chunks
+from .pool import hash_credentials
+from .transfer import UploadConfig, AWS_MIN_PART_SIZE
+
+
+def threaded_reader(stream: Any) -> Callable[[int], Awaitable[bytes]]:
+    # Reads a blocking stream off the event loop, compressing is CPU bound
+    async def read(size: int) -> bytes:
+        return await asyncio.get_running_loop().run_in_executor(None, stream.read, size)
+    return read
+
+
+class AsyncAWSStorageServiceProvider(AsyncStorageAction):
+    """AWS Storage Service Provider on an aiobotocore S3 client"""
+    access_key: str
+    secret_key: str
+    bucket_name: str
+    upload_config: UploadConfig
+    clt: Any
+    link_expiry: int = AWS_LINK_EXPIRY
+    cloud_type: str = CloudProviderType.AWS.value
+
+    def __init__(
+        self,
+        access_key: str,
+        secret_key: str,
+        bucket_name: str,
+        upload_config: Optional[UploadConfig] = None
+    ) -> None:
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.bucket_name = bucket_name
+        self.upload_config = upload_config or UploadConfig.from_env('AWS')
+        self._exit_stack = AsyncExitStack()
+
+    async def create_service_client(self) -> None:
+        if not (self.access_key and self.secret_key):
+            raise RequriedParameterMissing('Required Secret key or access key is Missing!')
+        self.clt = await self._exit_stack.enter_async_context(
+            get_session().create_client(
+                's3',
+                aws_access_key_id=self.access_key,
+                aws_secret_access_key=self.secret_key,
+                endpoint_url=AWS_ENDPOINT_URL,
+                config=AioConfig(
+                    max_pool_connections=int(os.getenv('AWS_MAX_POOL_CONNECTIONS', 50)),
+                    # local S3 servers do not resolve bucket subdomains
+                    s3={'addressing_style': 'path'} if AWS_ENDPOINT_URL else None,
+                    retries={
+                        'max_attempts': self.upload_config.max_attempts,
+                        'mode': 'standard'
+                    }
+                )
+            )
+        )
+
+    async def close(self) -> None:
+        await self._exit_stack.aclose()
+
+    def credentials_key(self) -> Tuple[str, str]:
+        return (CloudProviderType.AWS.value, hash_credentials(self.access_key, self.secret_key))
+
+    def storage_location(self) -> str:
+        return self.bucket_name
+
+    async def open_stream(
+        self,
+        name: str,
+        offset: int = 0,
+        length: Optional[int] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncBlobStream:
+        params = {'Bucket': self.bucket_name, 'Key': name}
+        if offset or length is not None:
+            end = '' if length is None else str(offset + length - 1)
+            params['Range'] = f'bytes={offset}-{end}'
+        try:
+            resp = await self.clt.get_object(**params)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                raise ItemNotFound(f'Item: {name} does not found!')
+            logging.error(e)
+            raise FileDownloadError('Something went wrong while downloading!')
+        body = resp['Body']
+        codec = None if 'Range' in params else stored_codec(resp.get('Metadata'))
+        if codec:
+            return AsyncBlobStream(
+                decode_async_chunks(body.iter_chunks(chunk_size), codec),
+                content_type=resp.get('ContentType'),
+                close=body.close
+            )
+        total_length = resp.get('ContentLength')
+        if resp.get('ContentRange'):
+            total_length = int(resp['ContentRange'].split('/')[-1])
+        return AsyncBlobStream(
+            body.iter_chunks(chunk_size),
+            content_length=resp.get('ContentLength'),
+            content_type=resp.get('ContentType'),
+            close=body.close,
+            offset=offset,
+            total_length=total_length
+        )
+
+    async def get_blob_properties(self, name: str) -> Dict[str, Any]:
+        try:
+            resp = await self.clt.head_object(Bucket=self.bucket_name, Key=name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                raise ItemNotFound(f'Item: {name} does not found!')
+            logging.error(e)
+            raise FileDownloadError('Something went wrong while reading the properties!')
+        return {
+            'filename': name,
+            'bucket_name': self.bucket_name,
+            'size': resp.get('ContentLength'),
+            'etag': resp.get('ETag'),
+            'content_type': resp.get('ContentType'),
+            'last_modified': resp.get('LastModified'),
+            'codec': (resp.get('Metadata') or {}).get(CODEC_METADATA_KEY)
+        }
+
+    async def list_blob_page(
+        self,
+        prefix: Optional[str] = None,
+        delimiter: Optional[str] = None,
+        page_size: int = LIST_PAGE_SIZE,
+        continuation_token: Optional[str] = None) -> Dict[str, Any]:
+        params = {'Bucket': self.bucket_name, 'MaxKeys': page_size}
+        if prefix:
+            params['Prefix'] = prefix
+        if delimiter:
+            params['Delimiter'] = delimiter
+        if continuation_token:
+            params['ContinuationToken'] = continuation_token
+        resp = await self.clt.list_objects_v2(**params)
+        return {
+            'items': [
+                {
+                    'filename': item.get('Key'),
+                    'bucket_name': resp.get('Name'),
+                    'size': item.get('Size'),
+                    'etag': item.get('ETag'),
+                    'last_modified': item.get('LastModified')
+                } for item in resp.get('Contents', [])
+            ],
+            'prefixes': [item.get('Prefix') for item in resp.get('CommonPrefixes', [])],
+            'next_token': resp.get('NextContinuationToken')
+        }
+
+    async def delete_blob(self, name: str) -> bool:
+        try:
+            await self.clt.head_object(Bucket=self.bucket_name, Key=name)
+            await self.clt.delete_object(Bucket=self.bucket_name, Key=name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                logging.error(e)
+            return False
+        return True
+
+    async def _upload_parts(
+        self,
+        read: Callable[[int], Awaitable[bytes]],
+        filename: str,
+        first_parts: List[bytes],
+        part_size: int,
+        extra_args: Dict[str, Any]) -> Tuple[str, int]:
+        # Multipart upload, at most `concurrency` parts are in flight
+        upload_id = (await self.clt.create_multipart_upload(
+            Bucket=self.bucket_name, Key=filename, **extra_args))['UploadId']
+        slots = asyncio.Semaphore(self.upload_config.concurrency)
+        tasks = []
+
+        async def send(part_number: int, data: bytes) -> Dict[str, Any]:
+            try:
+                resp = await self.clt.upload_part(
+                    Bucket=self.bucket_name,
+                    Key=filename,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=data)
+                return {'PartNumber': part_number, 'ETag': resp['ETag']}
+            finally:
+                slots.release()
+
+        size = 0
+        try:
+            part_number = 1
+            while True:
+                data = first_parts.pop(0) if first_parts else await read(part_size)
+                if not data:
+                    break
+                size += len(data)
+                await slots.acquire()
+                tasks.append(asyncio.ensure_future(send(part_number, data)))
+                part_number += 1
+            parts = await asyncio.gather(*tasks)
+            resp = await self.clt.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=filename,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': list(parts)})
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            await self.clt.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=filename, UploadId=upload_id)
+            raise
+        return resp.get('ETag'), size
+
+    async def upload_blob(self, file_path: Any, codec: Optional[str] = None) -> Dict[str, Any]:
+        filename = generate_blob_name(file_path.filename)
+        content_type = getattr(file_path, 'content_type', None) or None
+        part_size = max(self.upload_config.part_size, AWS_MIN_PART_SIZE)
+        extra_args: Dict[str, Any] = {'ContentType': content_type} if content_type else {}
+        stream, encoder = encode_stream(getattr(file_path, 'file', file_path), content_type, codec)
+        read = file_path.read
+        if encoder:
+            # Content-Encoding lets browsers decode signed links transparently
+            extra_args['ContentEncoding'] = encoder.name
+            extra_args['Metadata'] = {CODEC_METADATA_KEY: encoder.name}
+            read = threaded_reader(stream)
+        try:
+            first = await read(part_size)
+            second = await read(part_size)
+            if not second:
+                # fits in one part, a single PutObject is enough
+                resp = await self.clt.put_object(
+                    Bucket=self.bucket_name, Key=filename, Body=first, **extra_args)
+                etag, size = resp.get('ETag'), len(first)
+            else:
+                etag, size = await self._upload_parts(read, filename, [first, second], part_size, extra_args)
+        except ClientError as e:
+            logging.error(e)
+            raise FileUploadError(
+                f'Something went wrong while file uploading to S3 Bucket: {self.bucket_name}')
+        logging.info('File: {} upload success'.format(filename))
+        return {
+            'filename': filename,
+            'bucket_name': self.bucket_name,
+            'size': size,
+            'etag': etag,
+            'content_type': content_type,
+            'last_modified': datetime.utcnow()
+        }
+
+    async def get_temp_blob_link(self, filename: str) -> str:
+        return await self.clt.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.bucket_name,
+                'Key': filename
+            },
+            HttpMethod="GET",
+            ExpiresIn=self.link_expiry)
+
+
+def create_provider(user_cloud: Dict[str,Any]) -> AsyncStorageAction:
+    access_key_id = user_cloud.get('access_key')
+    secret_access_key = user_cloud.get('secret_access_key')
+    bucket_name = user_cloud.get('bucket_name')
+    return AsyncAWSStorageServiceProvider(
+        access_key_id,
+        secret_access_key,
+        bucket_name)
@@ -0,0 +1,219 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+from azure.core.exceptions import AzureError, ResourceNotFoundError
+from azure.storage.blob import (
+    BlobPrefix,
+    ContentSettings,
+    ResourceTypes,
+    AccountSasPermissions,
+    generate_account_sas)
+from azure.storage.blob.aio import BlobServiceClient
+from .platforms import (
+    CloudProviderType,
+    FileDownloadError,
+    FileUploadError,
+    ItemNotFound,
+    RequriedParameterMissing,
+    LIST_PAGE_SIZE,
+    STREAM_CHUNK_SIZE,
+    AZ_LINK_EXPIRY,
+    encode_stream,
+    generate_blob_name,
+    range_total_length,
+    stored_codec,
+    stream_size)
+from .aio_platforms import AsyncBlobStream, AsyncStorageAction
+from .codecs import CODEC_METADATA_KEY, decode_async_chunks
+from .pool import hash_credentials
+from .transfer import UploadConfig, AZ_MAX_BLOCK_SIZE
+
+
+class AsyncAzureStorageServiceProvider(AsyncStorageAction):
+    """Azure Blob Storage Service Provider on the azure.storage.blob.aio client"""
+    conn: str
+    container_name: str
+    upload_config: UploadConfig
+    clt: Any
+    link_expiry: int = AZ_LINK_EXPIRY
+    cloud_type: str = CloudProviderType.AZ.value
+
+    def __init__(
+        self,
+        connection_string: str,
+        container_name: str,
+        upload_config: Optional[UploadConfig] = None
+    ) -> None:
+        self.conn = connection_string
+        self.container_name = container_name
+        self.upload_config = upload_config or UploadConfig.from_env('AZ')
+
+    async def create_service_client(self) -> None:
+        if not self.conn:
+            raise RequriedParameterMissing('Required Connection String Is Missing!')
+        block_size = min(self.upload_config.part_size, AZ_MAX_BLOCK_SIZE)
+        self.clt = BlobServiceClient.from_connection_string(
+            self.conn,
+            max_single_get_size=STREAM_CHUNK_SIZE,
+            max_chunk_get_size=STREAM_CHUNK_SIZE,
+            max_single_put_size=block_size,
+            max_block_size=block_size,
+            # retry_total counts the retries after the first attempt
+            retry_total=self.upload_config.max_attempts - 1
+        )
+
+    async def close(self) -> None:
+        await self.clt.close()
+
+    def credentials_key(self) -> Tuple[str, str]:
+        return (CloudProviderType.AZ.value, hash_credentials(self.conn))
+
+    def storage_location(self) -> str:
+        return f'{self.clt.account_name}/{self.container_name}'
+
+    def _blob_client(self, name: str) -> Any:
+        return self.clt.get_blob_client(container=self.container_name, blob=name)
+
+    async def open_stream(
+        self,
+        name: str,
+        offset: int = 0,
+        length: Optional[int] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncBlobStream:
+        range_kwargs: Dict[str, Any] = {}
+        if offset or length is not None:
+            range_kwargs = {'offset': offset, 'length': length}
+        try:
+            downloader = await self._blob_client(name).download_blob(**range_kwargs)
+        except ResourceNotFoundError:
+            raise ItemNotFound(f'Item: {name} does not found!')
+        except AzureError as e:
+            logging.error(e)
+            raise FileDownloadError('Something went wrong while downloading!')
+        # A compressed object is decoded when read whole, ranges address the stored bytes
+        codec = None if range_kwargs else stored_codec(downloader.properties.metadata)
+        if codec:
+            return AsyncBlobStream(
+                decode_async_chunks(downloader.chunks(), codec),
+                content_type=downloader.properties.content_settings.content_type
+            )
+        return AsyncBlobStream(
+            downloader.chunks(),
+            content_length=downloader.size,
+            content_type=downloader.properties.content_settings.content_type,
+            offset=offset,
+            # properties.size is the size of the range read
+            total_length=range_total_length(downloader.properties.content_range, downloader.properties.size)
+        )
+
+    async def get_blob_properties(self, name: str) -> Dict[str, Any]:
+        try:
+            props = await self._blob_client(name).get_blob_properties()
+        except ResourceNotFoundError:
+            raise ItemNotFound(f'Item: {name} does not found!')
+        except AzureError as e:
+            logging.error(e)
+            raise FileDownloadError('Something went wrong while reading the properties!')
+        return {
+            'filename': name,
+            'bucket_name': self.container_name,
+            'size': props.size,
+            'etag': props.etag,
+            'content_type': props.content_settings.content_type,
+            'last_modified': props.last_modified,
+            'codec': (props.metadata or {}).get(CODEC_METADATA_KEY)
+        }
+
+    async def list_blob_page(
+        self,
+        prefix: Optional[str] = None,
+        delimiter: Optional[str] = None,
+        page_size: int = LIST_PAGE_SIZE,
+        continuation_token: Optional[str] = None) -> Dict[str, Any]:
+        container_client = self.clt.get_container_client(self.container_name)
+        if delimiter:
+            paged = container_client.walk_blobs(
+                name_starts_with=prefix,
+                delimiter=delimiter,
+                results_per_page=page_size)
+        else:
+            paged = container_client.list_blobs(
+                name_starts_with=prefix,
+                results_per_page=page_size)
+        pages = paged.by_page(continuation_token=continuation_token)
+        items, prefixes = [], []
+        try:
+            page = await pages.__anext__()
+        except StopAsyncIteration:
+            page = None
+        if page is not None:
+            async for blob in page:
+                if isinstance(blob, BlobPrefix):
+                    prefixes.append(blob.name)
+                else:
+                    items.append({
+                        "filename": blob.name,
+                        "bucket_name": blob.container,
+                        "size": blob.size,
+                        "etag": blob.etag,
+                        "last_modified": blob.last_modified
+                    })
+        return {
+            'items': items,
+            'prefixes': prefixes,
+            'next_token': pages.continuation_token or None
+        }
+
+    async def delete_blob(self, name: str) -> bool:
+        try:
+            await self._blob_client(name).delete_blob()
+        except ResourceNotFoundError:
+            return False
+        return True
+
+    async def upload_blob(self, file_path: Any, codec: Optional[str] = None) -> Dict[str, Any]:
+        filename = generate_blob_name(file_path.filename)
+        content_type = getattr(file_path, 'content_type', None) or None
+        # the spooled upload file is handed over, so the SDK knows its length
+        stream = getattr(file_path, 'file', file_path)
+        size = stream_size(stream)
+        stream, encoder = encode_stream(stream, content_type, codec)
+        try:
+            resp = await self._blob_client(filename).upload_blob(
+                stream,
+                max_concurrency=self.upload_config.concurrency,
+                # no Content-Encoding here, the SDK transport could then decode it on download
+                metadata={CODEC_METADATA_KEY: encoder.name} if encoder else None,
+                content_settings=ContentSettings(content_type=content_type)
+            )
+        except AzureError as e:
+            logging.error(e)
+            raise FileUploadError('Something went wrong while file upload!')
+        if encoder:
+            size = stream.bytes_out
+        logging.info('File: {} upload success'.format(filename))
+        return {
+            'filename': filename,
+            'bucket_name': self.container_name,
+            'size': size,
+            'etag': resp.get('etag'),
+            'content_type': content_type,
+            'last_modified': resp.get('last_modified')
+        }
+
+    async def get_temp_blob_link(self, filename: str) -> str:
+        sas_token = generate_account_sas(
+            self.clt.account_name,
+            account_key=self.clt.credential.account_key,
+            blob_name=filename,
+            resource_types=ResourceTypes(object=True),
+            permission=AccountSasPermissions(read=True),
+            expiry=datetime.utcnow() + timedelta(seconds=self.link_expiry)
+        )
+        return f'https://{self.clt.account_name}.blob.core.windows.net/{self.container_name}/{filename}?{sas_token}'
+
+
+def create_provider(user_cloud: Dict[str,Any]) -> AsyncStorageAction:
+    connection_string = user_cloud.get('connection_string')
+    container_name = user_cloud.get('bucket_name')
+    return AsyncAzureStorageServiceProvider(connection_string, container_name)
@@ -0,0 +1,107 @@
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+from .hooks import instrument_class
+from .platforms import LIST_PAGE_SIZE, STREAM_CHUNK_SIZE
+
+# Provider methods reported to the call hooks, see hooks.call_hooks
+ASYNC_INSTRUMENTED_METHODS = (
+    'create_service_client',
+    'open_stream',
+    'get_blob_properties',
+    'list_blob_page',
+    'delete_blob',
+    'upload_blob',
+    'get_temp_blob_link'
+)
+
+
+class AsyncBlobStream:
+    """Asyncio counterpart of BlobStream"""
+    content_length: Optional[int]
+    content_type: Optional[str]
+    offset: int
+    total_length: Optional[int]
+
+    def __init__(
+        self,
+        chunks: AsyncIterator[bytes],
+        content_length: Optional[int] = None,
+        content_type: Optional[str] = None,
+        close: Optional[Callable[[], Any]] = None,
+        offset: int = 0,
+        total_length: Optional[int] = None
+    ) -> None:
+        self._chunks = chunks
+        self.content_length = content_length
+        self.content_type = content_type or 'application/octet-stream'
+        self._close = close
+        self.offset = offset
+        self.total_length = total_length if total_length is not None else content_length
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self._chunks:
+                if chunk:
+                    yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._close:
+            self._close()
+            self._close = None
+
+
+class AsyncStorageAction(ABC):
+    """
+    Asyncio Storage Action interface:
+    Same actions as StorageAction for the request hot paths, every network
+    call is awaited so one event loop keeps many transfers in flight.
+    Upload files are expected to expose filename, content_type and an
+    awaitable read(size), like starlette's UploadFile.
+    """
+    cloud_type: str
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        instrument_class(cls, ASYNC_INSTRUMENTED_METHODS)
+
+    @abstractmethod
+    async def create_service_client(self) -> None: pass
+
+    @abstractmethod
+    async def close(self) -> None: pass
+
+    @abstractmethod
+    def credentials_key(self) -> Tuple[str, str]: pass
+
+    @abstractmethod
+    def storage_location(self) -> str: pass
+
+    @abstractmethod
+    async def open_stream(
+        self,
+        name: str,
+        offset: int = 0,
+        length: Optional[int] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncBlobStream: pass
+
+    @abstractmethod
+    async def get_blob_properties(self, name: str) -> Dict[str, Any]: pass
+
+    @abstractmethod
+    async def list_blob_page(
+        self,
+        prefix: Optional[str] = None,
+        delimiter: Optional[str] = None,
+        page_size: int = LIST_PAGE_SIZE,
+        continuation_token: Optional[str] = None) -> Dict[str, Any]: pass
+
+    @abstractmethod
+    async def delete_blob(self, name: str) -> bool: pass
+
+    @abstractmethod
+    async def upload_blob(self, file_path: Any, codec: Optional[str] = None) -> Dict[str, Any]: pass
+
+    @abstractmethod
+    async def get_temp_blob_link(self, filename: str) -> str: pass
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from .aio_platforms import AsyncStorageAction
+from .hooks import phase
+from .platforms import RequriedParameterMissing
+from .registry import ProviderRegistry
+
+# Evicted clients are closed after this many seconds, so requests still
+# holding them can finish
+CLOSE_GRACE_PERIOD = 60
+
+
+# Provider modules, imported on first use, see ENABLED_PROVIDERS
+providers = ProviderRegistry({
+    'aws': '.aio_aws_platform',
+    'az': '.aio_az_platform'
+})
+
+
+class AsyncClientPool:
+    """
+    Asyncio counterpart of ClientPool:
+    keeps one connected client per (provider, hash of credentials),
+    least recently used first eviction, ttl seconds expiry.
+    Must only be used from the serving event loop.
+    """
+    def __init__(self, maxsize: int = 128, ttl: float = 900) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._owners: 'OrderedDict[Tuple[str, str], Tuple[float, AsyncStorageAction]]' = OrderedDict()
+        self._lock: Optional[asyncio.Lock] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _retire(self, owner: AsyncStorageAction) -> None:
+        loop = asyncio.get_running_loop()
+        loop.call_later(CLOSE_GRACE_PERIOD, lambda: asyncio.ensure_future(owner.close()))
+
+    async def connect(self, storage_provider: AsyncStorageAction) -> None:
+        # Points storage_provider at a pooled client, creating it on a miss
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        key = storage_provider.credentials_key()
+        now = time.monotonic()
+        async with self._lock:
+            entry = self._owners.get(key)
+            if entry and now - entry[0] > self.ttl:
+                del self._owners[key]
+                self._retire(entry[1])
+                entry = None
+            if entry:
+                self._owners.move_to_end(key)
+                self.hits += 1
+                storage_provider.clt = entry[1].clt
+                return
+            self.misses += 1
+            await storage_provider.create_service_client()
+            self._owners[key] = (now, storage_provider)
+            while len(self._owners) > self.maxsize:
+                _, (_, owner) = self._owners.popitem(last=False)
+                self._retire(owner)
+
+    async def close(self) -> None:
+        owners = [owner for _, owner in self._owners.values()]
+        self._owners.clear()
+        for owner in owners:
+            await owner.close()
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+
+async_client_pool = AsyncClientPool(
+    maxsize=int(os.getenv('CLIENT_POOL_SIZE', 128)),
+    ttl=float(os.getenv('CLIENT_POOL_TTL', 900))
+)
+
+
+def get_async_storage_provider(
+    cloud_type: str,
+    user_cloud: Dict[str,Any]) -> Optional[AsyncStorageAction]:
+    factory = providers.get(cloud_type)
+    return factory(user_cloud) if factory else None
+
+
+async def get_async_service_client(storage_provider: AsyncStorageAction) -> AsyncStorageAction:
+    if storage_provider is None:
+        raise RequriedParameterMissing('Cloud provider is not supported or not enabled!')
+    with phase('service_client'):
+        await async_client_pool.connect(storage_provider)
+    return storage_provider
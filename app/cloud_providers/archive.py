@@ -0,0 +1,129 @@
+import logging
+import os
+import queue
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Deque, Iterable, Iterator, Tuple
+from .platforms import StorageAction
+
+# Blobs fetched ahead of the one being written, and chunks buffered per blob.
+# Memory is bounded by ARCHIVE_PREFETCH * ARCHIVE_PREFETCH_CHUNKS * STREAM_CHUNK_SIZE.
+ARCHIVE_PREFETCH = int(os.getenv('ARCHIVE_PREFETCH', 4))
+ARCHIVE_PREFETCH_CHUNKS = int(os.getenv('ARCHIVE_PREFETCH_CHUNKS', 4))
+_END = object()
+
+
+class _ZipSink:
+    """Write only file object, zipfile writes into it and the bytes are drained out"""
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _put(items: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    # Gives up once the download was abandoned, so no thread blocks forever
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _prefetch(
+    provider: StorageAction,
+    name: str,
+    items: queue.Queue,
+    stop: threading.Event) -> None:
+    # Queues the opened BlobStream, then its chunks, then _END
+    try:
+        blob_stream = provider.open_stream(name)
+    except Exception as e:
+        _put(items, e, stop)
+        return
+    try:
+        if not _put(items, blob_stream, stop):
+            return
+        for chunk in blob_stream:
+            if not _put(items, chunk, stop):
+                return
+        _put(items, _END, stop)
+    except Exception as e:
+        _put(items, e, stop)
+    finally:
+        blob_stream.close()
+
+
+def stream_zip(
+    provider: StorageAction,
+    names: Iterable[str],
+    compression: int = zipfile.ZIP_STORED,
+    prefetch: int = ARCHIVE_PREFETCH) -> Iterator[bytes]:
+    """
+    Yields a ZIP archive of the given blobs as it is built:
+    blobs are downloaded concurrently, a few ahead of the entry being
+    written, and nothing is kept on disk. Missing blobs are skipped.
+    """
+    sink = _ZipSink()
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max(1, prefetch), thread_name_prefix='zip-prefetch')
+    pending: Deque[Tuple[str, queue.Queue]] = deque()
+    names = iter(names)
+
+    def fetch_next() -> None:
+        name = next(names, None)
+        if name is None:
+            return
+        items: queue.Queue = queue.Queue(maxsize=ARCHIVE_PREFETCH_CHUNKS)
+        executor.submit(_prefetch, provider, name, items, stop)
+        pending.append((name, items))
+
+    try:
+        for _ in range(max(1, prefetch)):
+            fetch_next()
+        with zipfile.ZipFile(sink, mode='w', compression=compression) as archive:
+            while pending:
+                name, items = pending.popleft()
+                blob_stream = items.get()
+                if isinstance(blob_stream, Exception):
+                    logging.error('Skipping {} in archive: {}'.format(name, blob_stream))
+                    fetch_next()
+                    continue
+                entry = zipfile.ZipInfo(name.lstrip('/'), date_time=datetime.utcnow().timetuple()[:6])
+                entry.compress_type = compression
+                if blob_stream.content_length is not None:
+                    # a known size lets zipfile pick zip64 for large entries
+                    entry.file_size = blob_stream.content_length
+                with archive.open(entry, mode='w', force_zip64=blob_stream.content_length is None) as writer:
+                    while True:
+                        chunk = items.get()
+                        if chunk is _END:
+                            break
+                        if isinstance(chunk, Exception):
+                            raise chunk
+                        writer.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                fetch_next()
+                yield sink.drain()
+        # central directory, written when the archive is closed
+        yield sink.drain()
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
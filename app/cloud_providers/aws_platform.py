@@ -0,0 +1,498 @@
+import boto3
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from .codecs import CODEC_METADATA_KEY, decode_bytes, decode_chunks
+from .platforms import (
+    AWSConnectionError,
+    BlobStream,
+    CloudProviderType,
+    DeleteOperationError,
+    FileDownloadError,
+    FileUploadError,
+    ItemNotFound,
+    RequriedParameterMissing,
+    StorageAction,
+    LIST_PAGE_SIZE,
+    STREAM_CHUNK_SIZE,
+    AWS_DELETE_BATCH_SIZE,
+    AWS_LINK_EXPIRY,
+    AWS_ENDPOINT_URL,
+    encode_stream,
+    generate_blob_name,
+    stored_codec,
+    stream_size)
+from .pool import hash_credentials
+from .transfer import UploadConfig, AWS_MIN_PART_SIZE
+
+
+class AWSStorageServiceProvider(StorageAction):
+    """AWS Storage Service Provider"""
+    access_key_id: str
+    secret_access_key: str
+    bucket_name: str
+    _public_bucket_name: str = 'public_bucket'
+    upload_config: UploadConfig
+    clt: Any
+    link_expiry: int = AWS_LINK_EXPIRY
+    cloud_type: str = CloudProviderType.AWS.value
+
+    def __init__(
+        self,
+        access_key: str,
+        secret_key: str,
+        bucket_name: str,
+        upload_config: Optional[UploadConfig] = None
+    ) -> None:
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.bucket_name = bucket_name
+        self.upload_config = upload_config or UploadConfig.from_env('AWS')
+
+    def create_service_client(self):
+        if not (
+            self.access_key and self.secret_key
+            ):
+            raise RequriedParameterMissing(
+                'Required Secret key or access key is Missing!'
+            )
+        try:
+            # boto3.client() shares the default session, which is not
+            # thread safe, so every pooled client gets its own session
+            self.clt = boto3.session.Session().client(
+                's3',
+                aws_access_key_id=self.access_key,
+                aws_secret_access_key=self.secret_key,
+                endpoint_url=AWS_ENDPOINT_URL,
+                config=Config(
+                    max_pool_connections=int(os.getenv('AWS_MAX_POOL_CONNECTIONS', 50)),
+                    # local S3 servers do not resolve bucket subdomains
+                    s3={'addressing_style': 'path'} if AWS_ENDPOINT_URL else None,
+                    # every UploadPart request is retried on its own
+                    retries={
+                        'max_attempts': self.upload_config.max_attempts,
+                        'mode': 'standard'
+                    }
+                )
+            )
+        except AWSConnectionError as ace:
+            raise AWSConnectionError('Secrets not valid, please check again!')
+
+    def credentials_key(self) -> Tuple[str, str]:
+        return (CloudProviderType.AWS.value, hash_credentials(self.access_key, self.secret_key))
+
+    def storage_location(self) -> str:
+        # S3 bucket names are globally unique
+        return self.bucket_name
+
+    def download_blob(self, name: str) -> Any:
+        try:
+            resp = self.clt.get_object(Bucket=self.bucket_name, Key=name)
+            data = resp['Body'].read()
+            codec = stored_codec(resp.get('Metadata'))
+            return str(decode_bytes(data, codec) if codec else data)
+        except Exception as e:
+            logging.error(e)
+            raise FileDownloadError('Something went wrong while downloading!')
+
+    def open_stream(
+        self,
+        name: str,
+        offset: int = 0,
+        length: Optional[int] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE) -> BlobStream:
+        params = {'Bucket': self.bucket_name, 'Key': name}
+        if offset or length is not None:
+            end = '' if length is None else str(offset + length - 1)
+            params['Range'] = f'bytes={offset}-{end}'
+        try:
+            resp = self.clt.get_object(**params)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                raise ItemNotFound(f'Item: {name} does not found!')
+            logging.error(e)
+            raise FileDownloadError('Something went wrong while downloading!')
+        body = resp['Body']
+        # A compressed object is decoded when read whole, ranges address the stored bytes
+        codec = None if 'Range' in params else stored_codec(resp.get('Metadata'))
+        if codec:
+            return BlobStream(
+                decode_chunks(body.iter_chunks(chunk_size), codec),
+                content_type=resp.get('ContentType'),
+                close=body.close
+            )
+        total_length = resp.get('ContentLength')
+        if resp.get('ContentRange'):
+            # ContentRange looks like: bytes 0-99/1234
+            total_length = int(resp['ContentRange'].split('/')[-1])
+        return BlobStream(
+            body.iter_chunks(chunk_size),
+            content_length=resp.get('ContentLength'),
+            content_type=resp.get('ContentType'),
+            close=body.close,
+            offset=offset,
+            total_length=total_length
+        )
+
+    def get_blob_properties(self, name: str) -> Dict[str, Any]:
+        try:
+            resp = self.clt.head_object(Bucket=self.bucket_name, Key=name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                raise ItemNotFound(f'Item: {name} does not found!')
+            logging.error(e)
+            raise FileDownloadError('Something went wrong while reading the properties!')
+        return {
+            'filename': name,
+            'bucket_name': self.bucket_name,
+            'size': resp.get('ContentLength'),
+            'etag': resp.get('ETag'),
+            'content_type': resp.get('ContentType'),
+            'last_modified': resp.get('LastModified'),
+            'codec': (resp.get('Metadata') or {}).get(CODEC_METADATA_KEY)
+        }
+
+    def return_parsed_blob_list(self,blob_dict: Dict) -> List[Dict[str,Any]]:
+        # Contents is missing altogether when nothing matched
+        return [
+            {
+                'filename': item.get('Key'),
+                'bucket_name': blob_dict.get('Name'),
+                'size': item.get('Size'),
+                'etag': item.get('ETag'),
+                'last_modified': item.get('LastModified')
+            } for item in blob_dict.get('Contents', [])
+        ]
+
+    def list_blob(self) -> List[Dict[str,Any]]:
+        # Lists the existing buckets in AWS S3
+        return list(self.iter_blobs())
+
+    def list_blob_page(
+        self,
+        prefix: Optional[str] = None,
+        delimiter: Optional[str] = None,
+        page_size: int = LIST_PAGE_SIZE,
+        continuation_token: Optional[str] = None,
+        start_after: Optional[str] = None) -> Dict[str, Any]:
+        params = {'Bucket': self.bucket_name, 'MaxKeys': page_size}
+        if prefix:
+            params['Prefix'] = prefix
+        if delimiter:
+            params['Delimiter'] = delimiter
+        if continuation_token:
+            params['ContinuationToken'] = continuation_token
+        elif start_after:
+            # S3 starts the listing there, a continuation token already moved past it
+            params['StartAfter'] = start_after
+        resp = self.clt.list_objects_v2(**params)
+        return {
+            'items': self.return_parsed_blob_list(resp),
+            'prefixes': [item.get('Prefix') for item in resp.get('CommonPrefixes', [])],
+            'next_token': resp.get('NextContinuationToken')
+        }
+
+    def delete_blob(self, name: str) -> bool:
+        # S3 deletes of missing keys succeed, so a HEAD tells them apart
+        try:
+            self.clt.head_object(Bucket=self.bucket_name, Key=name)
+            self.clt.delete_object(Bucket=self.bucket_name, Key=name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                logging.error(e)
+            return False
+        return True
+
+    def delete_blobs(self, names: List[str]) -> Dict[str, bool]:
+        # One delete_objects call per AWS_DELETE_BATCH_SIZE keys.
+        # S3 reports missing keys as deleted as well.
+        results = {}
+        for start in range(0, len(names), AWS_DELETE_BATCH_SIZE):
+            chunk = names[start:start + AWS_DELETE_BATCH_SIZE]
+            try:
+                resp = self.clt.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={
+                        'Objects': [{'Key': name} for name in chunk],
+                        'Quiet': True
+                    })
+            except ClientError as e:
+                logging.error(e)
+                results.update({name: False for name in chunk})
+                continue
+            failed = {error.get('Key') for error in resp.get('Errors', [])}
+            results.update({name: name not in failed for name in chunk})
+        return results
+
+    def transfer_config(self) -> TransferConfig:
+        # Files above part_size go through a multipart upload whose parts
+        # are sent on a pool of `concurrency` threads, then completed
+        part_size = max(self.upload_config.part_size, AWS_MIN_PART_SIZE)
+        return TransferConfig(
+            multipart_threshold=part_size,
+            multipart_chunksize=part_size,
+            max_concurrency=self.upload_config.concurrency,
+            use_threads=self.upload_config.concurrency > 1
+        )
+
+    def _upload_file(self, file_path: Any, filename: str, codec: Optional[str] = None) -> Dict[str, Any]:
+        extra_args = {}
+        content_type = getattr(file_path, 'mimetype', None) or None
+        if content_type:
+            extra_args['ContentType'] = content_type
+        stream = getattr(file_path, 'stream', file_path)
+        size = stream_size(stream)
+        stream, encoder = encode_stream(stream, content_type, codec)
+        if encoder:
+            # Content-Encoding lets browsers decode signed links transparently
+            extra_args['ContentEncoding'] = encoder.name
+            extra_args['Metadata'] = {CODEC_METADATA_KEY: encoder.name}
+        try:
+            self.clt.upload_fileobj(
+                stream,
+                self.bucket_name,
+                filename,
+                ExtraArgs=extra_args,
+                Config=self.transfer_config())
+        except ClientError as e:
+            logging.error(e)
+            raise FileUploadError(
+                f'Something went wrong while file uploading to S3 Bucket: {self.bucket_name}'
+                )
+        if encoder:
+            size = stream.bytes_out
+        logging.info('File: {} upload success'.format(filename))
+        # upload_fileobj does not hand back the ETag, reconciliation fills it in
+        return {
+            'filename': filename,
+            'bucket_name': self.bucket_name,
+            'size': size,
+            'etag': None,
+            'content_type': content_type,
+            'last_modified': datetime.utcnow()
+        }
+
+    def upload_blob(self, file_path: Any, codec: Optional[str] = None) -> Dict[str, Any]:
+        if file_path:
+            return self._upload_file(file_path, generate_blob_name(file_path.filename), codec)
+
+    def upload_blob_public(self, file_path: Any, codec: Optional[str] = None) -> Dict[str, Any]:
+        if file_path:
+            return self._upload_file(file_path, generate_blob_name(file_path.filename), codec)
+
+    def get_temp_blob_link(self, filename: str) -> str:
+        if filename:
+            url = self.clt.generate_presigned_url(
+                'get_object',
+                Params = {
+                    'Bucket': self.bucket_name,
+                    'Key': filename
+                },
+                HttpMethod="GET",
+                ExpiresIn=self.link_expiry)
+            return url
+
+    def get_upload_link(
+        self,
+        name: str,
+        content_type: Optional[str] = None,
+        max_size: Optional[int] = None) -> Dict[str, Any]:
+        if max_size is not None:
+            # Only a presigned POST policy can bound the upload size
+            fields = {'Content-Type': content_type} if content_type else {}
+            conditions: List[Any] = [['content-length-range', 0, max_size]]
+            if content_type:
+                conditions.append({'Content-Type': content_type})
+            post = self.clt.generate_presigned_post(
+                self.bucket_name,
+                name,
+                Fields=fields,
+                Conditions=conditions,
+                ExpiresIn=self.link_expiry)
+            return {
+                'method': 'POST',
+                'url': post.get('url'),
+                'fields': post.get('fields'),
+                'headers': {}
+            }
+        params = {
+            'Bucket': self.bucket_name,
+            'Key': name
+        }
+        headers = {}
+        if content_type:
+            # the signature covers the content type, the client must send the same one
+            params['ContentType'] = content_type
+            headers['Content-Type'] = content_type
+        url = self.clt.generate_presigned_url(
+            'put_object',
+            Params=params,
+            HttpMethod='PUT',
+            ExpiresIn=self.link_expiry)
+        return {
+            'method': 'PUT',
+            'url': url,
+            'fields': {},
+            'headers': headers
+        }
+
+    def create_multipart_upload(
+        self,
+        name: str,
+        content_type: Optional[str] = None,
+        codec: Optional[str] = None) -> str:
+        # codec names the encoding the parts already have, it is only recorded
+        extra_args = self._object_args(content_type, codec)
+        try:
+            resp = self.clt.create_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=name,
+                **extra_args)
+        except ClientError as e:
+            logging.error(e)
+            raise FileUploadError(
+                f'Something went wrong while starting upload to S3 Bucket: {self.bucket_name}')
+        return resp['UploadId']
+
+    def upload_part(self, name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        try:
+            resp = self.clt.upload_part(
+                Bucket=self.bucket_name,
+                Key=name,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data)
+        except ClientError as e:
+            logging.error(e)
+            raise FileUploadError(f'Something went wrong while uploading part: {part_number}')
+        return resp['ETag']
+
+    def complete_multipart_upload(
+        self,
+        name: str,
+        upload_id: str,
+        parts: List[Tuple[int, str]],
+        content_type: Optional[str] = None,
+        codec: Optional[str] = None) -> Dict[str, Any]:
+        # content type and codec were already set by create_multipart_upload
+        if not parts:
+            # S3 can not complete an upload without parts, an empty object is put instead
+            self.abort_multipart_upload(name, upload_id)
+            return self._put_empty(name, content_type, codec)
+        try:
+            resp = self.clt.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=name,
+                UploadId=upload_id,
+                MultipartUpload={
+                    'Parts': [
+                        {'PartNumber': part_number, 'ETag': etag}
+                        for part_number, etag in sorted(parts)
+                    ]
+                })
+        except ClientError as e:
+            logging.error(e)
+            raise FileUploadError('Something went wrong while completing the upload!')
+        logging.info('File: {} upload success'.format(name))
+        return {
+            'filename': name,
+            'bucket_name': self.bucket_name,
+            'etag': resp.get('ETag'),
+            'content_type': content_type,
+            'last_modified': datetime.utcnow()
+        }
+
+    def abort_multipart_upload(self, name: str, upload_id: str) -> None:
+        try:
+            self.clt.abort_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=name,
+                UploadId=upload_id)
+        except ClientError as e:
+            logging.error(e)
+            raise DeleteOperationError('Something went wrong while aborting the upload!')
+
+    def _object_args(self, content_type: Optional[str], codec: Optional[str]) -> Dict[str, Any]:
+        # Content type and codec of an object written from already encoded bytes
+        args: Dict[str, Any] = {}
+        if content_type:
+            args['ContentType'] = content_type
+        if codec:
+            args['ContentEncoding'] = codec
+            args['Metadata'] = {CODEC_METADATA_KEY: codec}
+        return args
+
+    def _put_empty(self, name: str, content_type: Optional[str], codec: Optional[str]) -> Dict[str, Any]:
+        try:
+            resp = self.clt.put_object(
+                Bucket=self.bucket_name,
+                Key=name,
+                Body=b'',
+                **self._object_args(content_type, codec))
+        except ClientError as e:
+            logging.error(e)
+            raise FileUploadError(
+                f'Something went wrong while file uploading to S3 Bucket: {self.bucket_name}')
+        return {
+            'filename': name,
+            'bucket_name': self.bucket_name,
+            'size': 0,
+            'etag': resp.get('ETag'),
+            'content_type': content_type,
+            'last_modified': datetime.utcnow()
+        }
+
+    def copy_blob_from(
+        self,
+        source: StorageAction,
+        name: str,
+        target_name: str,
+        props: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # S3 copies between buckets when these keys can read the source one,
+        # objects above part_size are copied in parts (UploadPartCopy)
+        if source.cloud_type != self.cloud_type:
+            return None
+        extra_args = self._object_args(props.get('content_type'), props.get('codec'))
+        extra_args['MetadataDirective'] = 'REPLACE'
+        try:
+            self.clt.copy(
+                {'Bucket': source.bucket_name, 'Key': name},
+                self.bucket_name,
+                target_name,
+                ExtraArgs=extra_args,
+                SourceClient=source.clt,
+                Config=self.transfer_config())
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code in ('AccessDenied', '403'):
+                # other account's bucket, the bytes have to be streamed
+                logging.info('Server side copy of {} denied: {}'.format(name, e))
+                return None
+            if code in ('NoSuchKey', '404'):
+                raise ItemNotFound(f'Item: {name} does not found!')
+            logging.error(e)
+            raise FileUploadError(
+                f'Something went wrong while copying to S3 Bucket: {self.bucket_name}')
+        logging.info('File: {} copy success'.format(target_name))
+        return {
+            'filename': target_name,
+            'bucket_name': self.bucket_name,
+            'size': props.get('size'),
+            'etag': None,
+            'content_type': props.get('content_type'),
+            'last_modified': datetime.utcnow()
+        }
+
+
+def create_provider(user_cloud: Dict[str,Any]) -> StorageAction:
+    access_key_id = user_cloud.get('access_key')
+    secret_access_key = user_cloud.get('secret_access_key')
+    bucket_name = user_cloud.get('bucket_name')
+    return AWSStorageServiceProvider(
+        access_key_id,
+        secret_access_key,
+        bucket_name)
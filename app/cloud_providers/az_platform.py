@@ -0,0 +1,466 @@
+import base64
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+from azure.core.exceptions import AzureError, ResourceNotFoundError
+from azure.storage.blob import (
+    BlobBlock,
+    BlobPrefix,
+    BlobServiceClient,
+    ContentSettings,
+    ResourceTypes,
+    AccountSasPermissions,
+    BlobSasPermissions,
+    generate_account_sas,
+    generate_blob_sas)
+from .codecs import CODEC_METADATA_KEY, decode_bytes, decode_chunks
+from .platforms import (
+    AzureConnectionError,
+    BlobStream,
+    CloudProviderType,
+    FileDownloadError,
+    FileUploadError,
+    ItemNotFound,
+    RequriedParameterMissing,
+    StorageAction,
+    LIST_PAGE_SIZE,
+    STREAM_CHUNK_SIZE,
+    AZ_DELETE_BATCH_SIZE,
+    AZ_LINK_EXPIRY,
+    encode_stream,
+    generate_blob_name,
+    range_total_length,
+    stored_codec,
+    stream_size)
+from .pool import hash_credentials
+from .transfer import UploadConfig, AZ_MAX_BLOCK_SIZE, AZ_MAX_BLOCKS, part_size_for
+
+
+class AzureStorageServiceProvider(StorageAction):
+    """Azure Blob Storage Service Provider"""
+    conn: str
+    container_name: str
+    upload_config: UploadConfig
+    clt: Any
+    link_expiry: int = AZ_LINK_EXPIRY
+    cloud_type: str = CloudProviderType.AZ.value
+
+    def __init__(
+        self,
+        connection_string: str,
+        container_name: str,
+        upload_config: Optional[UploadConfig] = None
+    ) -> None:
+        self.conn = connection_string
+        self.container_name = container_name
+        self.upload_config = upload_config or UploadConfig.from_env('AZ')
+
+    def create_service_client(self) -> None:
+        if not self.conn:
+            raise RequriedParameterMissing('Required Connection \
+                String Is Missing!')
+        try:
+            # Bounded single/chunk get sizes keep streamed downloads at
+            # one chunk in memory instead of the 32MB first get default
+            # Uploads above max_single_put_size are split in blocks of
+            # max_block_size, each block request is retried on its own
+            block_size = min(self.upload_config.part_size, AZ_MAX_BLOCK_SIZE)
+            self.clt = BlobServiceClient.from_connection_string(
+                self.conn,
+                max_single_get_size=STREAM_CHUNK_SIZE,
+                max_chunk_get_size=STREAM_CHUNK_SIZE,
+                max_single_put_size=block_size,
+                max_block_size=block_size,
+                # retry_total counts the retries after the first attempt
+                retry_total=self.upload_config.max_attempts - 1
+            )
+        except AzureConnectionError as ace:
+            logging.error(ace)
+            raise AzureConnectionError('Connection string invalid, please check again')
+
+    def credentials_key(self) -> Tuple[str, str]:
+        return (CloudProviderType.AZ.value, hash_credentials(self.conn))
+
+    def storage_location(self) -> str:
+        # Container names are only unique inside a storage account
+        return f'{self.clt.account_name}/{self.container_name}'
+
+    def get_container_client(self):
+        # Checks for container
+        # if not exists
+        # creates one and returns container client
+        return self.clt.get_container_client(self.container_name) \
+            if self.clt.get_container_client(self.container_name)\
+            else self.clt.create_container(self.container_name)
+
+    def download_blob(self, name: str) -> Any:
+        # Download the blob from storage
+        blob_client = self.clt.get_blob_client(
+            container=self.container_name,
+            blob=name
+        )
+        if blob_client.exists():
+            try:
+                downloader = blob_client.download_blob()
+                data = downloader.readall()
+                codec = stored_codec(downloader.properties.metadata)
+                return str(decode_bytes(data, codec) if codec else data)
+            except Exception:
+                raise FileDownloadError(
+                    'Something went wrong while downloading!'
+                )
+        return f'Item: {name} does not found!'
+
+    def open_stream(
+        self,
+        name: str,
+        offset: int = 0,
+        length: Optional[int] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE) -> BlobStream:
+        # Azure chunk size is set on the client, see create_service_client
+        blob_client = self.clt.get_blob_client(
+            container=self.container_name,
+            blob=name
+        )
+        range_kwargs: Dict[str, Any] = {}
+        if offset or length is not None:
+            range_kwargs = {'offset': offset, 'length': length}
+        try:
+            downloader = blob_client.download_blob(**range_kwargs)
+        except ResourceNotFoundError:
+            raise ItemNotFound(f'Item: {name} does not found!')
+        except AzureError as e:
+            logging.error(e)
+            raise FileDownloadError('Something went wrong while downloading!')
+        # A compressed object is decoded when read whole, ranges address the stored bytes
+        codec = None if range_kwargs else stored_codec(downloader.properties.metadata)
+        if codec:
+            return BlobStream(
+                decode_chunks(downloader.chunks(), codec),
+                content_type=downloader.properties.content_settings.content_type
+            )
+        return BlobStream(
+            downloader.chunks(),
+            content_length=downloader.size,
+            content_type=downloader.properties.content_settings.content_type,
+            offset=offset,
+            # properties.size is the size of the range read
+            total_length=range_total_length(downloader.properties.content_range, downloader.properties.size)
+        )
+
+    def get_blob_properties(self, name: str) -> Dict[str, Any]:
+        blob_client = self.clt.get_blob_client(
+            container=self.container_name,
+            blob=name
+        )
+        try:
+            props = blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            raise ItemNotFound(f'Item: {name} does not found!')
+        except AzureError as e:
+            logging.error(e)
+            raise FileDownloadError('Something went wrong while reading the properties!')
+        return {
+            'filename': name,
+            'bucket_name': self.container_name,
+            'size': props.size,
+            'etag': props.etag,
+            'content_type': props.content_settings.content_type,
+            'last_modified': props.last_modified,
+            'codec': (props.metadata or {}).get(CODEC_METADATA_KEY)
+        }
+
+    def parse_blob_item(self, blob) -> Dict[str,Any]:
+        return {
+            "filename": blob.name,
+            "bucket_name": blob.container,
+            "size": blob.size,
+            "etag": blob.etag,
+            "last_modified": blob.last_modified
+        }
+
+    def list_blob(self) -> List[Dict[str,Any]]:
+        # returns the list of items in container
+        return list(self.iter_blobs())
+
+    def list_blob_page(
+        self,
+        prefix: Optional[str] = None,
+        delimiter: Optional[str] = None,
+        page_size: int = LIST_PAGE_SIZE,
+        continuation_token: Optional[str] = None,
+        start_after: Optional[str] = None) -> Dict[str, Any]:
+        # Azure can not start a listing at a name, the earlier ones are skipped here
+        container_client = self.clt.get_container_client(self.container_name)
+        if delimiter:
+            # walk_blobs returns virtual folders as BlobPrefix items
+            paged = container_client.walk_blobs(
+                name_starts_with=prefix,
+                delimiter=delimiter,
+                results_per_page=page_size)
+        else:
+            paged = container_client.list_blobs(
+                name_starts_with=prefix,
+                results_per_page=page_size)
+        pages = paged.by_page(continuation_token=continuation_token)
+        items, prefixes = [], []
+        for blob in next(pages, []):
+            if isinstance(blob, BlobPrefix):
+                prefixes.append(blob.name)
+            elif not (start_after and blob.name <= start_after):
+                items.append(self.parse_blob_item(blob))
+        return {
+            'items': items,
+            'prefixes': prefixes,
+            'next_token': pages.continuation_token or None
+        }
+
+    def delete_blob(self, name: str) -> bool:
+        # Deletes the item from blob, a missing blob is reported as False
+        blob_client = self.clt.get_blob_client(
+            container=self.container_name,
+            blob=name
+        )
+        try:
+            blob_client.delete_blob()
+        except ResourceNotFoundError:
+            return False
+        return True
+
+    def delete_blobs(self, names: List[str]) -> Dict[str, bool]:
+        # One blob batch request per AZ_DELETE_BATCH_SIZE names
+        container_client = self.clt.get_container_client(self.container_name)
+        results = {}
+        for start in range(0, len(names), AZ_DELETE_BATCH_SIZE):
+            chunk = names[start:start + AZ_DELETE_BATCH_SIZE]
+            try:
+                responses = container_client.delete_blobs(*chunk, raise_on_any_failure=False)
+            except AzureError as e:
+                logging.error(e)
+                results.update({name: False for name in chunk})
+                continue
+            for name, resp in zip(chunk, responses):
+                results[name] = resp.status_code == 202
+        return results
+
+    def _upload_file(self, file_path: Any, filename: str, codec: Optional[str] = None) -> Dict[str, Any]:
+        # Staged blocks are uploaded on max_concurrency threads and
+        # committed with a single block list at the end
+        blob_client = self.clt.get_blob_client(
+            container=self.container_name,
+            blob=filename
+        )
+        stream = getattr(file_path, 'stream', file_path)
+        content_type = getattr(file_path, 'mimetype', None) or None
+        size = stream_size(stream)
+        stream, encoder = encode_stream(stream, content_type, codec)
+        try:
+            resp = blob_client.upload_blob(
+                stream,
+                max_concurrency=self.upload_config.concurrency,
+                # no Content-Encoding here, the SDK transport could then decode it on download
+                metadata={CODEC_METADATA_KEY: encoder.name} if encoder else None,
+                content_settings=ContentSettings(content_type=content_type)
+            )
+        except AzureError as e:
+            logging.error(e)
+            raise FileUploadError('Something went wrong while file upload!')
+        if encoder:
+            size = stream.bytes_out
+        logging.info('File: {} upload success'.format(filename))
+        return {
+            'filename': filename,
+            'bucket_name': self.container_name,
+            'size': size,
+            'etag': resp.get('etag'),
+            'content_type': content_type,
+            'last_modified': resp.get('last_modified')
+        }
+
+    def upload_blob(self, file_path: Any, codec: Optional[str] = None) -> Dict[str, Any]:
+        # Uploads a file to blob storage
+        if file_path:
+            return self._upload_file(file_path, generate_blob_name(file_path.filename), codec)
+
+    def upload_blob_public(self, file_path: Any, codec: Optional[str] = None) -> Dict[str, Any]:
+        # Uploads a file to public blob storage
+        if file_path:
+            return self._upload_file(file_path, generate_blob_name(file_path.filename), codec)
+
+    def get_temp_blob_link(self, filename: str) -> str:
+        sas_token = generate_account_sas(
+            self.clt.account_name,
+            account_key=self.clt.credential.account_key,
+            blob_name=filename,
+            resource_types=ResourceTypes(object=True),
+            permission=AccountSasPermissions(read=True),
+            expiry=datetime.utcnow() + timedelta(seconds=self.link_expiry)
+        )
+        url = f'https://{self.clt.account_name}.blob.core.windows.net/{self.container_name}/{filename}?{sas_token}'
+        return url
+
+    def get_upload_link(
+        self,
+        name: str,
+        content_type: Optional[str] = None,
+        max_size: Optional[int] = None) -> Dict[str, Any]:
+        # SAS scoped to this one blob, only allowing to create or overwrite it.
+        # A SAS can not limit the upload size, max_size is not enforced here.
+        blob_client = self.clt.get_blob_client(
+            container=self.container_name,
+            blob=name
+        )
+        sas_token = generate_blob_sas(
+            self.clt.account_name,
+            self.container_name,
+            name,
+            account_key=self.clt.credential.account_key,
+            permission=BlobSasPermissions(create=True, write=True),
+            expiry=datetime.utcnow() + timedelta(seconds=self.link_expiry)
+        )
+        headers = {'x-ms-blob-type': 'BlockBlob'}
+        if content_type:
+            headers['Content-Type'] = content_type
+        return {
+            'method': 'PUT',
+            'url': f'{blob_client.url}?{sas_token}',
+            'fields': {},
+            'headers': headers
+        }
+
+    def create_multipart_upload(
+        self,
+        name: str,
+        content_type: Optional[str] = None,
+        codec: Optional[str] = None) -> str:
+        # Azure has no upload id, it only prefixes the staged block ids
+        return uuid4().hex
+
+    def _block_id(self, upload_id: str, part_number: int) -> str:
+        # Block ids of one blob must all have the same length
+        return base64.b64encode(f'{upload_id}:{part_number:05d}'.encode()).decode()
+
+    def upload_part(self, name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        blob_client = self.clt.get_blob_client(
+            container=self.container_name,
+            blob=name
+        )
+        block_id = self._block_id(upload_id, part_number)
+        try:
+            blob_client.stage_block(block_id, data, length=len(data))
+        except AzureError as e:
+            logging.error(e)
+            raise FileUploadError(f'Something went wrong while uploading part: {part_number}')
+        return block_id
+
+    def complete_multipart_upload(
+        self,
+        name: str,
+        upload_id: str,
+        parts: List[Tuple[int, str]],
+        content_type: Optional[str] = None,
+        codec: Optional[str] = None) -> Dict[str, Any]:
+        # codec names the encoding the blocks already have, it is only recorded
+        blob_client = self.clt.get_blob_client(
+            container=self.container_name,
+            blob=name
+        )
+        try:
+            resp = blob_client.commit_block_list(
+                [BlobBlock(block_id=block_id) for _, block_id in sorted(parts)],
+                content_settings=ContentSettings(content_type=content_type),
+                metadata={CODEC_METADATA_KEY: codec} if codec else None
+            )
+        except AzureError as e:
+            logging.error(e)
+            raise FileUploadError('Something went wrong while committing the upload!')
+        logging.info('File: {} upload success'.format(name))
+        return {
+            'filename': name,
+            'bucket_name': self.container_name,
+            'etag': resp.get('etag'),
+            'content_type': content_type,
+            'last_modified': resp.get('last_modified')
+        }
+
+    def abort_multipart_upload(self, name: str, upload_id: str) -> None:
+        # Uncommitted blocks are garbage collected by Azure after a week
+        pass
+
+    def _signed_read_url(self, name: str) -> str:
+        # SAS scoped to reading this one blob
+        blob_client = self.clt.get_blob_client(
+            container=self.container_name,
+            blob=name
+        )
+        sas_token = generate_blob_sas(
+            self.clt.account_name,
+            self.container_name,
+            name,
+            account_key=self.clt.credential.account_key,
+            permission=BlobSasPermissions(read=True),
+            expiry=datetime.utcnow() + timedelta(seconds=self.link_expiry)
+        )
+        return f'{blob_client.url}?{sas_token}'
+
+    def copy_blob_from(
+        self,
+        source: StorageAction,
+        name: str,
+        target_name: str,
+        props: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # Blocks are staged from a signed link of the source blob (Put Block
+        # From URL), Azure reads them itself, also across storage accounts
+        if source.cloud_type != self.cloud_type:
+            return None
+        size = props.get('size') or 0
+        part_size = part_size_for(size, min(self.upload_config.part_size, AZ_MAX_BLOCK_SIZE), AZ_MAX_BLOCKS)
+        upload_id = uuid4().hex
+        blob_client = self.clt.get_blob_client(
+            container=self.container_name,
+            blob=target_name
+        )
+
+        def stage(part_number: int) -> Tuple[int, str]:
+            offset = (part_number - 1) * part_size
+            block_id = self._block_id(upload_id, part_number)
+            # signed per block, a long copy outlives a single link
+            blob_client.stage_block_from_url(
+                block_id,
+                source._signed_read_url(name),
+                source_offset=offset,
+                source_length=min(part_size, size - offset))
+            return part_number, block_id
+
+        try:
+            with ThreadPoolExecutor(
+                    max_workers=self.upload_config.concurrency,
+                    thread_name_prefix='az-copy') as executor:
+                parts = list(executor.map(stage, range(1, -(-size // part_size) + 1)))
+            resp = blob_client.commit_block_list(
+                [BlobBlock(block_id=block_id) for _, block_id in parts],
+                content_settings=ContentSettings(content_type=props.get('content_type')),
+                metadata={CODEC_METADATA_KEY: props['codec']} if props.get('codec') else None
+            )
+        except ResourceNotFoundError:
+            raise ItemNotFound(f'Item: {name} does not found!')
+        except AzureError as e:
+            logging.error(e)
+            raise FileUploadError('Something went wrong while copying the blob!')
+        logging.info('File: {} copy success'.format(target_name))
+        return {
+            'filename': target_name,
+            'bucket_name': self.container_name,
+            'size': size,
+            'etag': resp.get('etag'),
+            'content_type': props.get('content_type'),
+            'last_modified': resp.get('last_modified')
+        }
+
+
+def create_provider(user_cloud: Dict[str,Any]) -> StorageAction:
+    connection_string = user_cloud.get('connection_string')
+    container_name = user_cloud.get('bucket_name')
+    return AzureStorageServiceProvider(connection_string, container_name)
@@ -0,0 +1,170 @@
+import logging
+import os
+import zlib
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Object metadata key holding the codec an object was stored with
+CODEC_METADATA_KEY = 'codec'
+# Codec used when neither the request nor the user picked one, unset stores raw
+DEFAULT_UPLOAD_CODEC = os.getenv('DEFAULT_UPLOAD_CODEC')
+# Request/user value explicitly turning compression off
+NO_CODEC = 'none'
+
+# Content types which are already compressed, they are always stored raw
+COMPRESSED_TYPE_PREFIXES = ('image/', 'video/', 'audio/', 'font/woff')
+COMPRESSED_TYPES = {
+    'application/gzip',
+    'application/x-gzip',
+    'application/zip',
+    'application/x-7z-compressed',
+    'application/x-bzip2',
+    'application/x-xz',
+    'application/x-rar-compressed',
+    'application/zstd',
+    'application/pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+}
+# Compressible types with an image/ prefix
+TEXT_IMAGE_TYPES = {'image/svg+xml', 'image/bmp', 'image/x-icon'}
+
+
+class Codec:
+    """Streaming compression codec, name doubles as the HTTP Content-Encoding"""
+    name: str
+
+    def compressor(self) -> Any: pass
+
+    def decompressor(self) -> Any: pass
+
+
+class GzipCodec(Codec):
+    name = 'gzip'
+
+    def __init__(self, level: int = 6) -> None:
+        self.level = level
+
+    def compressor(self) -> Any:
+        # wbits 31 writes the gzip header and trailer
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+    def decompressor(self) -> Any:
+        return zlib.decompressobj(31)
+
+
+class ZstdCodec(Codec):
+    name = 'zstd'
+
+    def __init__(self, level: int = 3) -> None:
+        self.level = level
+
+    def compressor(self) -> Any:
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def decompressor(self) -> Any:
+        return zstandard.ZstdDecompressor().decompressobj()
+
+
+codecs: Dict[str, Codec] = {'gzip': GzipCodec(int(os.getenv('GZIP_LEVEL', 6)))}
+if zstandard is not None:
+    codecs['zstd'] = ZstdCodec(int(os.getenv('ZSTD_LEVEL', 3)))
+else:
+    logging.info('zstandard is not installed, the zstd codec is disabled')
+
+
+def get_codec(name: Optional[str]) -> Optional[Codec]:
+    # None for no compression, raises ValueError for an unknown codec
+    if not name or name == NO_CODEC:
+        return None
+    if name not in codecs:
+        raise ValueError(f'Unsupported codec: {name}, available: {", ".join(codecs)}')
+    return codecs[name]
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in TEXT_IMAGE_TYPES:
+        return True
+    if content_type in COMPRESSED_TYPES or content_type.endswith('+zip'):
+        return False
+    return not content_type.startswith(COMPRESSED_TYPE_PREFIXES)
+
+
+def upload_codec(name: Optional[str], content_type: Optional[str]) -> Optional[Codec]:
+    # Codec an upload is stored with, already compressed content is skipped
+    codec = get_codec(name)
+    if codec and not is_compressible(content_type):
+        return None
+    return codec
+
+
+class CompressingReader:
+    """Read only file object compressing another one on the fly"""
+    def __init__(self, stream: Any, codec: Codec, chunk_size: int = 1024 * 1024) -> None:
+        self._stream = stream
+        self._compressor = codec.compressor()
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._eof = False
+        # compressed bytes handed out, the stored object size once read through
+        self.bytes_out = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def _fill(self, size: int) -> None:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            data = self._stream.read(self._chunk_size)
+            if not data:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+            else:
+                self._buffer += self._compressor.compress(data)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None:
+            size = -1
+        self._fill(size)
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.bytes_out += len(data)
+        return data
+
+
+def decode_chunks(chunks: Iterable[bytes], codec: Codec) -> Iterator[bytes]:
+    decompressor = codec.decompressor()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    # hands out whatever the decompressor still buffers
+    flush = getattr(decompressor, 'flush', None)
+    if flush:
+        data = flush()
+        if data:
+            yield data
+
+
+async def decode_async_chunks(chunks: AsyncIterable[bytes], codec: Codec) -> AsyncIterator[bytes]:
+    decompressor = codec.decompressor()
+    async for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    flush = getattr(decompressor, 'flush', None)
+    if flush:
+        data = flush()
+        if data:
+            yield data
+
+
+def decode_bytes(data: bytes, codec: Codec) -> bytes:
+    return b''.join(decode_chunks([data], codec))
@@ -0,0 +1,345 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from .platforms import ItemNotFound, StorageAction
+
+# Directory of the download cache, the cache is disabled when unset
+DOWNLOAD_CACHE_DIR = os.getenv('DOWNLOAD_CACHE_DIR')
+DOWNLOAD_CACHE_MAX_BYTES = int(os.getenv('DOWNLOAD_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+# Larger objects are always streamed from the provider
+DOWNLOAD_CACHE_MAX_OBJECT = int(os.getenv('DOWNLOAD_CACHE_MAX_OBJECT', 64 * 1024 * 1024))
+# Seconds a revalidated copy is served without asking the provider again
+DOWNLOAD_CACHE_FRESHNESS = int(os.getenv('DOWNLOAD_CACHE_FRESHNESS', 0))
+# Internal nginx location aliased to DOWNLOAD_CACHE_DIR, cached files are then
+# sent by nginx through X-Accel-Redirect instead of the app server
+DOWNLOAD_CACHE_ACCEL_PREFIX = os.getenv('DOWNLOAD_CACHE_ACCEL_PREFIX')
+# Lock file of the directory, shared by the worker processes
+LOCK_FILE = '.lock'
+# Bytes cached in the directory, kept up to date by every process under the lock
+SIZE_FILE = '.size'
+# Leftovers of a fill older than this are removed on startup
+STALE_FILE_SECONDS = 3600
+
+
+class CachedBlob:
+    """Local copy of a blob"""
+    def __init__(
+        self,
+        path: str,
+        relative_path: str,
+        size: int,
+        etag: Optional[str],
+        last_modified: Optional[datetime],
+        content_type: Optional[str]
+    ) -> None:
+        self.path = path
+        self.relative_path = relative_path
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+        self.validated_at = time.monotonic()
+
+    def unchanged(self, props: Dict[str, Any]) -> bool:
+        # ETags are compared when both sides have one, Last-Modified otherwise
+        if self.etag and props.get('etag'):
+            return self.etag == props.get('etag')
+        return self.last_modified is not None and self.last_modified == props.get('last_modified')
+
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            'size': self.size,
+            'etag': self.etag,
+            'last_modified': self.last_modified.isoformat() if self.last_modified else None,
+            'content_type': self.content_type
+        }
+
+
+class DiskCache:
+    """
+    Read-through cache of downloaded blobs on local disk:
+    Files are keyed by a digest of (provider, credentials hash, bucket, filename),
+    revalidated against the provider's ETag/Last-Modified with a HEAD request
+    and evicted least recently used first above max_bytes.
+    The directory is shared by the worker processes: max_bytes caps the whole
+    directory. The processes keep a byte count of it in SIZE_FILE, and the
+    directory is only scanned, to evict, once the count goes over max_bytes.
+    An entry filled by another process is picked up from its sidecar file.
+    """
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = DOWNLOAD_CACHE_MAX_BYTES,
+        max_object: int = DOWNLOAD_CACHE_MAX_OBJECT,
+        freshness: float = DOWNLOAD_CACHE_FRESHNESS
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_object = max_object
+        self.freshness = freshness
+        self._entries: 'OrderedDict[str, CachedBlob]' = OrderedDict()
+        self._lock = threading.Lock()
+        # byte count of the directory when this process last updated it
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def cache_key(storage_provider: StorageAction, filename: str) -> str:
+        parts = (*storage_provider.credentials_key(), storage_provider.storage_location(), filename)
+        return hashlib.sha256('\x00'.join(parts).encode('utf-8')).hexdigest()
+
+    def _relative_path(self, key: str) -> str:
+        return os.path.join(key[:2], key)
+
+    @contextmanager
+    def _directory_lock(self) -> Iterator[None]:
+        # Serializes the scans and evictions of all the processes
+        with open(os.path.join(self.directory, LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self) -> None:
+        # Removes what a crashed run left behind, files of a fill still
+        # running in another process are younger than STALE_FILE_SECONDS
+        stale_before = time.time() - STALE_FILE_SECONDS
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if name in (LOCK_FILE, SIZE_FILE) or os.stat(path).st_mtime > stale_before:
+                        continue
+                    if name.startswith('.tmp-'):
+                        os.remove(path)
+                    elif name.endswith('.json'):
+                        if not os.path.exists(path[:-len('.json')]):
+                            os.remove(path)
+                    elif not os.path.exists(path + '.json'):
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+        # also sets the byte count right after a crash
+        self._evict()
+
+    def _read_entry(self, key: str) -> Optional[CachedBlob]:
+        # Entry left by a previous run or filled by another process
+        relative_path = self._relative_path(key)
+        path = os.path.join(self.directory, relative_path)
+        try:
+            with open(path + '.json') as sidecar:
+                meta = json.load(sidecar)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(path):
+            return None
+        last_modified = meta.get('last_modified')
+        entry = CachedBlob(
+            path,
+            relative_path,
+            meta.get('size'),
+            meta.get('etag'),
+            datetime.fromisoformat(last_modified) if last_modified else None,
+            meta.get('content_type'))
+        # always revalidated before first use
+        entry.validated_at = float('-inf')
+        return entry
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        # (last use, size, path) of every cached file, a hit touches its file
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name in (LOCK_FILE, SIZE_FILE) or name.startswith('.tmp-') or name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, path))
+        return found
+
+    @staticmethod
+    def _remove_files(path: str) -> Optional[int]:
+        # Size of the removed file, None when another process was first
+        try:
+            size: Optional[int] = os.stat(path).st_size
+            os.remove(path)
+        except FileNotFoundError:
+            size = None
+        try:
+            os.remove(path + '.json')
+        except FileNotFoundError:
+            pass
+        return size
+
+    @staticmethod
+    def _touch(entry: CachedBlob) -> None:
+        try:
+            os.utime(entry.path)
+        except OSError:
+            pass
+
+    def _write_size(self, total: int) -> None:
+        # Caller holds the directory lock
+        with open(os.path.join(self.directory, SIZE_FILE), 'w') as size_file:
+            size_file.write(str(total))
+        self.total_bytes = total
+
+    def _add_bytes(self, delta: int) -> bool:
+        # Updates the byte count, True once it is over max_bytes
+        with self._directory_lock():
+            try:
+                with open(os.path.join(self.directory, SIZE_FILE)) as size_file:
+                    total = int(size_file.read() or 0)
+            except (OSError, ValueError):
+                total = 0
+            self._write_size(max(0, total + delta))
+        return self.total_bytes > self.max_bytes
+
+    def _evict(self) -> None:
+        # Scans the directory, a stat per cached file, and removes the least
+        # recently used files down to max_bytes. The scan also corrects the
+        # byte count. Runs without self._lock, hits go on meanwhile.
+        with self._directory_lock():
+            found = sorted(self._scan())
+            total = sum(size for _, size, _ in found)
+            for _, size, path in found:
+                if total <= self.max_bytes:
+                    break
+                self._remove_files(path)
+                total -= size
+            self._write_size(total)
+        # forget the entries evicted here or by another process
+        with self._lock:
+            entries = list(self._entries.items())
+        gone = [(key, entry) for key, entry in entries if not os.path.exists(entry.path)]
+        with self._lock:
+            for key, entry in gone:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+
+    def _pop(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        path = entry.path if entry else os.path.join(self.directory, self._relative_path(key))
+        size = self._remove_files(path)
+        if size:
+            self._add_bytes(-size)
+
+    def discard(self, storage_provider: StorageAction, filename: str) -> None:
+        self._pop(self.cache_key(storage_provider, filename))
+
+    def _fill(
+        self,
+        key: str,
+        storage_provider: StorageAction,
+        filename: str,
+        props: Dict[str, Any]) -> Optional[CachedBlob]:
+        # None when the object turns out larger than max_object once decoded
+        relative_path = self._relative_path(key)
+        path = os.path.join(self.directory, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written aside and renamed, a partial file is never served
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path))
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                blob_stream = storage_provider.open_stream(filename)
+                try:
+                    for chunk in blob_stream:
+                        size += len(chunk)
+                        if size > self.max_object:
+                            break
+                        temp_file.write(chunk)
+                finally:
+                    blob_stream.close()
+            if size > self.max_object:
+                os.remove(temp_path)
+                return None
+            # readable by the nginx worker serving X-Accel-Redirect
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        entry = CachedBlob(
+            path,
+            relative_path,
+            size,
+            props.get('etag'),
+            props.get('last_modified'),
+            props.get('content_type'))
+        with open(path + '.json', 'w') as sidecar:
+            json.dump(entry.metadata(), sidecar)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+        if self._add_bytes(size):
+            self._evict()
+        return entry
+
+    def fetch(self, storage_provider: StorageAction, filename: str) -> Optional[CachedBlob]:
+        # Local copy of the blob, None when it is too large to be cached.
+        # Raises ItemNotFound like the providers do.
+        key = self.cache_key(storage_provider, filename)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                if time.monotonic() - entry.validated_at < self.freshness:
+                    self.hits += 1
+                    self._touch(entry)
+                    return entry
+        if not entry:
+            entry = self._read_entry(key)
+        try:
+            props = storage_provider.get_blob_properties(filename)
+        except ItemNotFound:
+            self._pop(key)
+            raise
+        if entry and entry.unchanged(props) and os.path.exists(entry.path):
+            entry.validated_at = time.monotonic()
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                self.hits += 1
+            self._touch(entry)
+            return entry
+        with self._lock:
+            self.misses += 1
+        if entry:
+            self._pop(key)
+        # the stored size of a compressed object says little about the
+        # decoded size, which _fill checks while writing
+        size = props.get('size')
+        if size is None or (not props.get('codec') and size > self.max_object):
+            return None
+        try:
+            return self._fill(key, storage_provider, filename, props)
+        except OSError as e:
+            # a full or read only disk only disables the cache for this call
+            logging.error('Download cache write failed: {}'.format(e))
+            return None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+download_cache = DiskCache(DOWNLOAD_CACHE_DIR) if DOWNLOAD_CACHE_DIR else None
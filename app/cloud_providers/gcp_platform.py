@@ -0,0 +1,129 @@
+import logging
+from uuid import uuid4
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from google.cloud import storage
+from .platforms import (
+    BlobStream,
+    CloudProviderType,
+    DeleteOperationError,
+    FileUploadError,
+    ItemNotFound,
+    RequriedParameterMissing,
+    StorageAction,
+    STREAM_CHUNK_SIZE)
+from .pool import hash_credentials
+
+
+class GCPStorageServiceProvider(StorageAction):
+    """GCP Storage Service Provider"""
+    account_key_json: Any
+    bucket_name: str
+    clt: storage.Client
+    cloud_type: str = CloudProviderType.GCP.value
+
+    def __init__(self, account_key_json: Any, bucket_name: str) -> None:
+        self.account_key_json = account_key_json
+        self.bucket_name = bucket_name
+
+    def create_service_client(self) -> None:
+        if not self.account_key_json:
+            raise RequriedParameterMissing(
+                'Required Connection String is Missing!'
+            )
+        self.clt = storage.Client.from_service_account_json(
+            self.account_key_json)
+
+    def credentials_key(self) -> Tuple[str, str]:
+        return (CloudProviderType.GCP.value, hash_credentials(str(self.account_key_json)))
+
+    def download_blob(self, name: str) -> Any:
+        self.check_bucket()
+        bucket = self.clt.get_bucket(self.bucket_name)
+        blob = bucket.get_blob(blob_name=name)
+        return blob.download_as_bytes()
+
+    def open_stream(
+        self,
+        name: str,
+        offset: int = 0,
+        length: Optional[int] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE) -> BlobStream:
+        self.check_bucket()
+        blob = self.clt.get_bucket(self.bucket_name).get_blob(blob_name=name)
+        if not blob:
+            raise ItemNotFound(f'Item: {name} does not found!')
+        reader = blob.open('rb', chunk_size=chunk_size)
+        reader.seek(offset)
+        remaining = blob.size - offset if length is None else min(length, blob.size - offset)
+
+        def chunks() -> Iterator[bytes]:
+            left = remaining
+            while left > 0:
+                chunk = reader.read(min(chunk_size, left))
+                if not chunk:
+                    break
+                left -= len(chunk)
+                yield chunk
+        return BlobStream(
+            chunks(),
+            content_length=remaining,
+            content_type=blob.content_type,
+            close=reader.close,
+            offset=offset,
+            total_length=blob.size
+        )
+
+    def get_blob_properties(self, name: str) -> Dict[str, Any]:
+        self.check_bucket()
+        blob = self.clt.get_bucket(self.bucket_name).get_blob(blob_name=name)
+        if not blob:
+            raise ItemNotFound(f'Item: {name} does not found!')
+        return {
+            'filename': name,
+            'bucket_name': self.bucket_name,
+            'size': blob.size,
+            'etag': blob.etag,
+            'content_type': blob.content_type,
+            'last_modified': blob.updated
+        }
+
+    def list_blob(self) -> List[str]:
+        self.check_bucket()
+        return list(self.clt.list_blobs(bucket_or_name=self.bucket_name))
+
+    def delete_blob(self, name: str) -> None:
+        self.check_bucket()
+        bucket = self.clt.get_bucket(self.bucket_name)
+        blob = bucket.get_blob(blob_name=name)
+        try:
+            blob.delete()
+        except DeleteOperationError as e:
+            logging.error(e)
+
+    def upload_blob(self, file_path: Any) -> None:
+        self.check_bucket()
+        bucket = self.clt.get_bucket(self.bucket_name)
+        filename = str(uuid4())+file_path.name.split('.')[-1]
+        blob = bucket.blob(filename)
+        try:
+            with open(file_path, 'rb') as data:
+                blob.upload_from_file(data)
+        except FileUploadError as e:
+            logging.error(e)
+
+    def check_bucket(self):
+        if not self.bucket_name:
+            raise RequriedParameterMissing(
+                    'Bucket Name missing!'
+            )
+
+
+def create_provider(user_cloud: Dict[str,Any]) -> None: pass
+    # account_key_json = user_cloud.account_key_json
+    # bucket_name = user_cloud.bucket_name
+    # with tempfile.NamedTemporaryFile(suffix='.json') as key_json:
+    #     key_json.write(account_key_json)
+    #     return GCPStorageServiceProvider(
+    #         account_key_json=key_json.name,
+    #         bucket_name=bucket_name
+    #         )
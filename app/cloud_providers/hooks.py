@@ -0,0 +1,75 @@
+import inspect
+import logging
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+from typing import Any, Callable, ContextManager, Iterable, Iterator, List
+
+# Factories called as hook(cloud_type, method) around every instrumented
+# provider call, the context managers they return wrap the call.
+# Registered once at startup, e.g. by the metrics and tracing modules.
+CallHook = Callable[[str, str], ContextManager]
+call_hooks: List[CallHook] = []
+
+# Factories called as hook(name) around the named phases of a request
+# which are not provider calls, e.g. resolving the pooled client
+PhaseHook = Callable[[str], ContextManager]
+phase_hooks: List[PhaseHook] = []
+
+
+def add_call_hook(hook: CallHook) -> None:
+    if hook not in call_hooks:
+        call_hooks.append(hook)
+
+
+def add_phase_hook(hook: PhaseHook) -> None:
+    if hook not in phase_hooks:
+        phase_hooks.append(hook)
+
+
+def _enter_hooks(stack: ExitStack, hooks: List[Callable[..., ContextManager]], *args: str) -> None:
+    for hook in hooks:
+        try:
+            stack.enter_context(hook(*args))
+        except Exception as e:
+            # a broken hook never fails the call itself
+            logging.error('Hook {} failed: {}'.format(args, e))
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    # Runs the phase hooks around the block
+    with ExitStack() as stack:
+        _enter_hooks(stack, phase_hooks, name)
+        yield
+
+
+def instrument(method: Callable, name: str) -> Callable:
+    # Wraps a provider method so call_hooks see every call, sync or async
+    if inspect.iscoroutinefunction(method):
+        @wraps(method)
+        async def async_call(self, *args: Any, **kwargs: Any) -> Any:
+            if not call_hooks:
+                return await method(self, *args, **kwargs)
+            with ExitStack() as stack:
+                _enter_hooks(stack, call_hooks, self.cloud_type, name)
+                return await method(self, *args, **kwargs)
+        async_call.__instrumented__ = True
+        return async_call
+
+    @wraps(method)
+    def call(self, *args: Any, **kwargs: Any) -> Any:
+        if not call_hooks:
+            return method(self, *args, **kwargs)
+        with ExitStack() as stack:
+            _enter_hooks(stack, call_hooks, self.cloud_type, name)
+            return method(self, *args, **kwargs)
+    call.__instrumented__ = True
+    return call
+
+
+def instrument_class(cls: type, methods: Iterable[str]) -> None:
+    # Only methods defined by cls itself, inherited ones are already wrapped
+    for name in methods:
+        method = cls.__dict__.get(name)
+        if callable(method) and not getattr(method, '__instrumented__', False):
+            setattr(cls, name, instrument(method, name))
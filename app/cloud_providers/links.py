@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+from cachetools import TLRUCache
+from .platforms import StorageAction
+
+# A cached link is only handed out while at least this many seconds of
+# validity remain, so clients never receive a link about to expire
+LINK_MIN_VALIDITY = int(os.getenv('LINK_MIN_VALIDITY', 60))
+# Filenames accepted by one batch link call
+LINK_BATCH_LIMIT = 1000
+
+
+class LinkCache:
+    """
+    Thread safe cache of signed read links:
+    Links are keyed by (provider, hash of credentials, bucket, filename)
+    and evicted LINK_MIN_VALIDITY seconds before their signature expires.
+    """
+    def __init__(self, maxsize: int = 10000, min_validity: float = LINK_MIN_VALIDITY) -> None:
+        self.min_validity = min_validity
+        self._links: TLRUCache = TLRUCache(
+            maxsize=maxsize,
+            ttu=self._usable_until,
+            timer=time.monotonic)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _usable_until(self, key: Tuple[str, ...], value: Tuple[str, float], now: float) -> float:
+        return value[1] - self.min_validity
+
+    @staticmethod
+    def key(storage_provider: Any, filename: str) -> Tuple[str, ...]:
+        # Also used with the async providers, which have the same key methods
+        return (*storage_provider.credentials_key(), storage_provider.storage_location(), filename)
+
+    def get(self, storage_provider: Any, filename: str) -> Optional[str]:
+        with self._lock:
+            entry = self._links.get(self.key(storage_provider, filename))
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def put(self, storage_provider: Any, filename: str, url: str, signed_at: float) -> None:
+        # signed_at is the time.monotonic() read taken before signing the link
+        expires_at = signed_at + storage_provider.link_expiry
+        with self._lock:
+            self._links[self.key(storage_provider, filename)] = (url, expires_at)
+
+    def get_or_create(self, storage_provider: StorageAction, filename: str) -> str:
+        url = self.get(storage_provider, filename)
+        if url is None:
+            signed_at = time.monotonic()
+            url = storage_provider.get_temp_blob_link(filename)
+            self.put(storage_provider, filename, url, signed_at)
+        return url
+
+    def get_many(self, storage_provider: StorageAction, filenames: Iterable[str]) -> Dict[str, str]:
+        # Signing is done locally by the SDKs, a batch costs no round trip
+        return {filename: self.get_or_create(storage_provider, filename) for filename in filenames}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._links)
+
+
+link_cache = LinkCache(maxsize=int(os.getenv('LINK_CACHE_SIZE', 10000)))
@@ -0,0 +1,244 @@
+"""
+Copies blobs from one StorageAction to another, e.g. an S3 bucket to an
+Azure container. Blobs are read in ranges and written as multipart parts /
+staged blocks, so memory stays around part size x part concurrency whatever
+the blob size. Many blobs are copied at once, and when both sides run on
+the same cloud the provider copies server side (see copy_blob_from).
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from .platforms import (
+    CloudProviderType,
+    DeleteOperationError,
+    FileDownloadError,
+    StorageAction)
+from .transfer import AWS_MAX_PARTS, AWS_MIN_PART_SIZE, AZ_MAX_BLOCKS, AZ_MAX_BLOCK_SIZE, part_size_for
+
+# Blobs copied at the same time by one copier
+COPY_OBJECT_CONCURRENCY = int(os.getenv('COPY_OBJECT_CONCURRENCY', 4))
+# Parts in flight per copier, each one holds a part in memory
+COPY_PART_CONCURRENCY = int(os.getenv('COPY_PART_CONCURRENCY', 8))
+# Seconds between two progress reports
+COPY_PROGRESS_INTERVAL = float(os.getenv('COPY_PROGRESS_INTERVAL', 2))
+# Failed blobs kept in the progress report
+COPY_MAX_FAILURES = 100
+# (min part size, max part size, max parts) of the destination cloud
+PART_LIMITS = {
+    CloudProviderType.AWS.value: (AWS_MIN_PART_SIZE, None, AWS_MAX_PARTS),
+    CloudProviderType.AZ.value: (1, AZ_MAX_BLOCK_SIZE, AZ_MAX_BLOCKS)
+}
+
+
+class CopyProgress:
+    """Thread safe counters of a copy, reported every interval seconds"""
+    def __init__(
+        self,
+        on_report: Optional[Callable[[Dict[str, Any]], None]] = None,
+        interval: float = COPY_PROGRESS_INTERVAL
+    ) -> None:
+        self.objects_total = 0
+        self.objects_copied = 0
+        self.objects_server_side = 0
+        self.objects_failed = 0
+        self.bytes_total = 0
+        self.bytes_copied = 0
+        self.failures: List[Dict[str, str]] = []
+        self.started = time.monotonic()
+        self._on_report = on_report
+        self._interval = interval
+        self._reported = self.started
+        self._lock = threading.Lock()
+        self._reporting = threading.Lock()
+
+    def add_object(self) -> None:
+        with self._lock:
+            self.objects_total += 1
+
+    def add_size(self, size: int) -> None:
+        with self._lock:
+            self.bytes_total += size
+
+    def add_bytes(self, copied: int) -> None:
+        with self._lock:
+            self.bytes_copied += copied
+        self._report()
+
+    def object_copied(self, server_side: bool) -> None:
+        with self._lock:
+            self.objects_copied += 1
+            if server_side:
+                self.objects_server_side += 1
+        self._report()
+
+    def object_failed(self, name: str, error: str) -> None:
+        with self._lock:
+            self.objects_failed += 1
+            if len(self.failures) < COPY_MAX_FAILURES:
+                self.failures.append({'filename': name, 'message': error})
+        self._report()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                'objects_total': self.objects_total,
+                'objects_copied': self.objects_copied,
+                'objects_server_side': self.objects_server_side,
+                'objects_failed': self.objects_failed,
+                'bytes_total': self.bytes_total,
+                'bytes_copied': self.bytes_copied,
+                'elapsed_seconds': round(elapsed, 3),
+                'bytes_per_second': int(self.bytes_copied / elapsed) if elapsed > 0 else 0,
+                'failures': list(self.failures)
+            }
+
+    def _report(self, force: bool = False) -> None:
+        if not self._on_report:
+            return
+        now = time.monotonic()
+        if not force and now - self._reported < self._interval:
+            return
+        # one report at a time, the others skip instead of queueing up
+        if not self._reporting.acquire(blocking=force):
+            return
+        try:
+            self._reported = now
+            self._on_report(self.snapshot())
+        except Exception as e:
+            logging.error('Copy progress report failed: {}'.format(e))
+        finally:
+            self._reporting.release()
+
+    def flush(self) -> None:
+        self._report(force=True)
+
+
+class BlobCopier:
+    """
+    Copies blobs from source to destination:
+        copy_blob copies one blob, its parts on the part threads,
+        copy_all copies many of them, object_concurrency at a time.
+    Used as a context manager, leaving it stops the part threads.
+    """
+    def __init__(
+        self,
+        source: StorageAction,
+        destination: StorageAction,
+        progress: Optional[CopyProgress] = None,
+        object_concurrency: int = COPY_OBJECT_CONCURRENCY,
+        part_concurrency: int = COPY_PART_CONCURRENCY
+    ) -> None:
+        self.source = source
+        self.destination = destination
+        self.progress = progress or CopyProgress()
+        self.object_concurrency = max(1, object_concurrency)
+        # separate from the object threads, which wait on the parts
+        self._parts = ThreadPoolExecutor(max_workers=max(1, part_concurrency), thread_name_prefix='copy-part')
+
+    def __enter__(self) -> 'BlobCopier':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._parts.shutdown(wait=True)
+
+    def part_size(self, size: int) -> int:
+        min_part_size, max_part_size, max_parts = PART_LIMITS.get(
+            self.destination.cloud_type, (1, None, AZ_MAX_BLOCKS))
+        part_size = self.destination.upload_config.part_size
+        if max_part_size:
+            part_size = min(part_size, max_part_size)
+        return part_size_for(size, part_size, max_parts, min_part_size)
+
+    def copy_blob(self, name: str, target_name: Optional[str] = None) -> Dict[str, Any]:
+        # Returns the destination blob info, with the source name and
+        # whether the provider copied it server side
+        target_name = target_name or name
+        props = self.source.get_blob_properties(name)
+        size = props.get('size') or 0
+        self.progress.add_size(size)
+        info = None
+        if self.source.cloud_type == self.destination.cloud_type:
+            info = self.destination.copy_blob_from(self.source, name, target_name, props)
+        server_side = info is not None
+        if server_side:
+            self.progress.add_bytes(size)
+        else:
+            info = self._stream_blob(name, target_name, props, size)
+        info.update({'size': size, 'source': name, 'server_side': server_side})
+        self.progress.object_copied(server_side)
+        return info
+
+    def _stream_blob(self, name: str, target_name: str, props: Dict[str, Any], size: int) -> Dict[str, Any]:
+        # Compressed blobs are copied as stored, the codec goes along in the metadata
+        content_type, codec = props.get('content_type'), props.get('codec')
+        part_size = self.part_size(size)
+        upload_id = self.destination.create_multipart_upload(target_name, content_type, codec)
+        futures: List[Future] = []
+        try:
+            for part_number, offset in enumerate(range(0, size, part_size), start=1):
+                futures.append(self._parts.submit(
+                    self._copy_part, name, target_name, upload_id,
+                    part_number, offset, min(part_size, size - offset), size))
+            parts = [future.result() for future in futures]
+            return self.destination.complete_multipart_upload(target_name, upload_id, parts, content_type, codec)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            try:
+                self.destination.abort_multipart_upload(target_name, upload_id)
+            except DeleteOperationError as e:
+                logging.error('Aborting the copy of {} failed: {}'.format(name, e))
+            raise
+
+    def _copy_part(
+        self,
+        name: str,
+        target_name: str,
+        upload_id: str,
+        part_number: int,
+        offset: int,
+        length: int,
+        size: int) -> Tuple[int, str]:
+        blob_stream = self.source.open_stream(name, offset, length)
+        data = b''.join(blob_stream)
+        if len(data) != length or blob_stream.total_length != size:
+            raise FileDownloadError(f'Item: {name} changed while being copied!')
+        tag = self.destination.upload_part(target_name, upload_id, part_number, data)
+        self.progress.add_bytes(length)
+        return part_number, tag
+
+    def _copy_one(
+        self,
+        name: str,
+        target_name: str,
+        on_copied: Optional[Callable[[Dict[str, Any]], None]]) -> None:
+        try:
+            info = self.copy_blob(name, target_name)
+            if on_copied:
+                on_copied(info)
+        except Exception as e:
+            logging.error('Copying {} failed: {}'.format(name, e))
+            self.progress.object_failed(name, str(e))
+
+    def copy_all(
+        self,
+        names: Iterable[Tuple[str, str]],
+        on_copied: Optional[Callable[[Dict[str, Any]], None]] = None) -> CopyProgress:
+        # Copies every (name, target name) pair, names may be a lazy listing.
+        # A failing blob is recorded in the progress and does not stop the others.
+        pending: Set[Future] = set()
+        with ThreadPoolExecutor(max_workers=self.object_concurrency, thread_name_prefix='copy-object') as objects:
+            for name, target_name in names:
+                self.progress.add_object()
+                pending.add(objects.submit(self._copy_one, name, target_name, on_copied))
+                if len(pending) >= 2 * self.object_concurrency:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+        self.progress.flush()
+        return self.progress
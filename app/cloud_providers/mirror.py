@@ -0,0 +1,212 @@
+"""
+Keeps a destination bucket/container a mirror of a source one. Both
+listings are walked side by side in name order and diffed by name, size
+and ETag, only new or changed blobs are copied (see migrate.BlobCopier)
+and blobs missing from the source can be deleted.
+
+ETags of two clouds are not comparable, so the ETags seen when a blob was
+copied are kept in a MirrorState: a later run skips the blob while neither
+side changed since. The state also holds a checkpoint, the last name
+handled, which an interrupted run resumes after.
+"""
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from .migrate import BlobCopier, CopyProgress, COPY_OBJECT_CONCURRENCY, COPY_PART_CONCURRENCY
+from .platforms import StorageAction, LIST_PAGE_SIZE
+
+# Names diffed per batch, the checkpoint moves once a whole batch is done
+MIRROR_BATCH_SIZE = int(os.getenv('MIRROR_BATCH_SIZE', LIST_PAGE_SIZE))
+
+# (source name, source item, destination item), one side is None when missing
+Pair = Tuple[str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+
+def normalize_etag(item: Optional[Dict[str, Any]]) -> Optional[str]:
+    # Providers return ETags with or without the quotes
+    etag = (item or {}).get('etag')
+    return etag.strip('"') if etag else None
+
+
+class MirrorState(ABC):
+    """
+    What a mirror remembers between runs:
+        entries: {source name: {size, source_etag, dest_etag}} of copied blobs,
+        checkpoint: last source name handled by the current run
+    """
+    @abstractmethod
+    def entries(self, names: List[str]) -> Dict[str, Dict[str, Any]]: pass
+
+    @abstractmethod
+    def record(self, entries: List[Dict[str, Any]]) -> None: pass
+
+    @abstractmethod
+    def forget(self, names: List[str]) -> None: pass
+
+    @abstractmethod
+    def checkpoint(self, name: str, progress: Dict[str, Any]) -> None: pass
+
+
+class MirrorProgress(CopyProgress):
+    """Copy counters plus the blobs scanned, found unchanged and deleted"""
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.objects_scanned = 0
+        self.objects_unchanged = 0
+        self.objects_deleted = 0
+        self.deletes_failed = 0
+
+    def scanned(self, count: int, unchanged: int) -> None:
+        with self._lock:
+            self.objects_scanned += count
+            self.objects_unchanged += unchanged
+        self._report()
+
+    def deleted(self, count: int, failed: int) -> None:
+        with self._lock:
+            self.objects_deleted += count
+            self.deletes_failed += failed
+        self._report()
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = super().snapshot()
+        with self._lock:
+            snapshot.update({
+                'objects_scanned': self.objects_scanned,
+                'objects_unchanged': self.objects_unchanged,
+                'objects_deleted': self.objects_deleted,
+                'deletes_failed': self.deletes_failed
+            })
+        return snapshot
+
+
+class BucketMirror:
+    """
+    One sync of source (under prefix) to destination (under target_prefix
+    + prefix). run() resumes after start_after, i.e. the stored checkpoint.
+    """
+    def __init__(
+        self,
+        source: StorageAction,
+        destination: StorageAction,
+        state: MirrorState,
+        prefix: Optional[str] = None,
+        target_prefix: str = '',
+        delete_extras: bool = False,
+        progress: Optional[MirrorProgress] = None,
+        batch_size: int = MIRROR_BATCH_SIZE,
+        object_concurrency: int = COPY_OBJECT_CONCURRENCY,
+        part_concurrency: int = COPY_PART_CONCURRENCY
+    ) -> None:
+        self.source = source
+        self.destination = destination
+        self.state = state
+        self.prefix = prefix or ''
+        self.target_prefix = target_prefix or ''
+        self.delete_extras = delete_extras
+        self.progress = progress or MirrorProgress()
+        self.batch_size = max(1, batch_size)
+        self.object_concurrency = object_concurrency
+        self.part_concurrency = part_concurrency
+
+    def pairs(self, start_after: Optional[str] = None) -> Iterator[Pair]:
+        # Merge of the two listings, both come in name (UTF-8 byte) order,
+        # destination names are matched without their target_prefix
+        sources = self.source.iter_blobs(self.prefix or None, start_after)
+        destinations = self.destination.iter_blobs(
+            self.target_prefix + self.prefix or None,
+            self.target_prefix + start_after if start_after else None)
+        source, destination = next(sources, None), next(destinations, None)
+        while source or destination:
+            source_name = source.get('filename') if source else None
+            dest_name = destination.get('filename')[len(self.target_prefix):] if destination else None
+            if destination is None or (source is not None and source_name < dest_name):
+                yield source_name, source, None
+                source = next(sources, None)
+            elif source is None or dest_name < source_name:
+                yield dest_name, None, destination
+                destination = next(destinations, None)
+            else:
+                yield source_name, source, destination
+                source, destination = next(sources, None), next(destinations, None)
+
+    def unchanged(
+        self,
+        source: Dict[str, Any],
+        destination: Optional[Dict[str, Any]],
+        entry: Optional[Dict[str, Any]]) -> bool:
+        if destination is None or source.get('size') != destination.get('size'):
+            return False
+        if entry:
+            # dest_etag is unknown after some server side copies
+            return (entry.get('source_etag') == normalize_etag(source)
+                    and entry.get('dest_etag') in (None, normalize_etag(destination)))
+        # never copied by this mirror: only ETags of one cloud can be compared
+        return (self.source.cloud_type == self.destination.cloud_type
+                and normalize_etag(source) is not None
+                and normalize_etag(source) == normalize_etag(destination))
+
+    def _entry(self, name: str, source: Dict[str, Any], dest_etag: Optional[str]) -> Dict[str, Any]:
+        return {
+            'filename': name,
+            'size': source.get('size'),
+            'source_etag': normalize_etag(source),
+            'dest_etag': dest_etag.strip('"') if dest_etag else None
+        }
+
+    def _sync_batch(self, copier: BlobCopier, batch: List[Pair]) -> None:
+        known = self.state.entries([name for name, source, _ in batch if source])
+        changed: Dict[str, Dict[str, Any]] = {}
+        entries: List[Dict[str, Any]] = []
+        extras: List[str] = []
+        unchanged = 0
+        for name, source, destination in batch:
+            if source is None:
+                if self.delete_extras:
+                    extras.append(destination.get('filename'))
+                continue
+            entry = known.get(name)
+            if self.unchanged(source, destination, entry):
+                unchanged += 1
+                if not entry:
+                    entries.append(self._entry(name, source, normalize_etag(destination)))
+                continue
+            changed[name] = source
+        self.progress.scanned(len(batch), unchanged)
+
+        def on_copied(info: Dict[str, Any]) -> None:
+            name = info.get('source')
+            entries.append(self._entry(name, changed[name], info.get('etag')))
+
+        if changed:
+            copier.copy_all(((name, self.target_prefix + name) for name in changed), on_copied=on_copied)
+        if entries:
+            self.state.record(entries)
+        if extras:
+            results = self.destination.delete_blobs(extras)
+            deleted = [name for name, ok in results.items() if ok]
+            self.state.forget([name[len(self.target_prefix):] for name in deleted])
+            self.progress.deleted(len(deleted), len(extras) - len(deleted))
+        self.state.checkpoint(batch[-1][0], self.progress.snapshot())
+
+    def run(self, start_after: Optional[str] = None) -> MirrorProgress:
+        # Blobs failing to copy are counted and left for the next run
+        if start_after:
+            logging.info('Resuming sync of {} after {}'.format(self.source.storage_location(), start_after))
+        with BlobCopier(
+                self.source,
+                self.destination,
+                self.progress,
+                object_concurrency=self.object_concurrency,
+                part_concurrency=self.part_concurrency) as copier:
+            batch: List[Pair] = []
+            for pair in self.pairs(start_after):
+                batch.append(pair)
+                if len(batch) >= self.batch_size:
+                    self._sync_batch(copier, batch)
+                    batch = []
+            if batch:
+                self._sync_batch(copier, batch)
+        self.progress.flush()
+        return self.progress
@@ -1,18 +1,16 @@
-import boto3
-import logging
-import tempfile
+import hashlib
+import os
 from uuid import uuid4
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 from abc import ABC, abstractmethod
 from enum import Enum
-from google.cloud import storage
-from botocore.exceptions import ClientError
-from datetime import datetime, timedelta
-from azure.storage.blob import (
-    BlobServiceClient,
-    ResourceTypes,
-    AccountSasPermissions,
-    generate_account_sas)
+from .codecs import (
+    Codec,
+    CompressingReader,
+    CODEC_METADATA_KEY,
+    get_codec,
+    upload_codec)
+from .hooks import instrument_class
 
 
 class AWSConnectionError(Exception):
@@ -43,6 +41,139 @@ class AzureConnectionError(Exception):
     pass
 
 
+# Size of the chunks handed out by StorageAction.open_stream
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 1024 * 1024))
+# Listing page size, S3 returns at most 1000 keys per call
+LIST_PAGE_SIZE = 1000
+# Keys per batch delete call: S3 delete_objects / Azure blob batch
+AWS_DELETE_BATCH_SIZE = 1000
+AZ_DELETE_BATCH_SIZE = 256
+# Seconds a signed read link stays valid
+AWS_LINK_EXPIRY = int(os.getenv('AWS_LINK_EXPIRY', 300))
+AZ_LINK_EXPIRY = int(os.getenv('AZ_LINK_EXPIRY', 600))
+# S3 compatible endpoint used instead of AWS, e.g. a local moto or MinIO server
+AWS_ENDPOINT_URL = os.getenv('AWS_ENDPOINT_URL')
+# Provider methods reported to the call hooks, see hooks.call_hooks
+INSTRUMENTED_METHODS = (
+    'create_service_client',
+    'download_blob',
+    'open_stream',
+    'get_blob_properties',
+    'list_blob',
+    'list_blob_page',
+    'delete_blob',
+    'delete_blobs',
+    'upload_blob',
+    'upload_blob_public',
+    'get_temp_blob_link',
+    'get_upload_link',
+    'create_multipart_upload',
+    'upload_part',
+    'complete_multipart_upload',
+    'abort_multipart_upload',
+    'copy_blob_from'
+)
+
+
+class BlobStream:
+    """Chunked reader over a stored object, holds one chunk in memory at a time"""
+    content_length: Optional[int]
+    content_type: Optional[str]
+    offset: int
+    total_length: Optional[int]
+
+    def __init__(
+        self,
+        chunks: Iterator[bytes],
+        content_length: Optional[int] = None,
+        content_type: Optional[str] = None,
+        close: Optional[Callable[[], None]] = None,
+        offset: int = 0,
+        total_length: Optional[int] = None
+    ) -> None:
+        self._chunks = chunks
+        # content_length is the size of the returned range,
+        # total_length the size of the whole object
+        self.content_length = content_length
+        self.content_type = content_type or 'application/octet-stream'
+        self._close = close
+        self.offset = offset
+        self.total_length = total_length if total_length is not None else content_length
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            for chunk in self._chunks:
+                if chunk:
+                    yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._close:
+            self._close()
+            self._close = None
+
+
+def generate_blob_name(filename: str) -> str:
+    # Random object name keeping the extension of the uploaded file
+    return str(uuid4())+'.'+filename.split('.')[-1]
+
+
+def content_digest(stream: Any, chunk_size: int = STREAM_CHUNK_SIZE) -> Optional[str]:
+    # sha256 of the bytes left in a seekable stream, which is rewound afterwards.
+    # None when the stream can not be read twice.
+    try:
+        position = stream.tell()
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            digest.update(chunk)
+        stream.seek(position)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return digest.hexdigest()
+
+
+def encode_stream(
+    stream: Any,
+    content_type: Optional[str],
+    codec: Optional[str]) -> Tuple[Any, Optional[Codec]]:
+    # Wraps an upload stream in the requested codec, unless its content
+    # type is already compressed. Returns (stream to send, codec used)
+    try:
+        encoder = upload_codec(codec, content_type)
+    except ValueError as e:
+        raise FileUploadError(str(e))
+    if not encoder:
+        return stream, None
+    return CompressingReader(stream, encoder), encoder
+
+
+def stored_codec(metadata: Optional[Dict[str, str]]) -> Optional[Codec]:
+    # Codec an object was stored with, recorded in its metadata
+    try:
+        return get_codec((metadata or {}).get(CODEC_METADATA_KEY))
+    except ValueError as e:
+        raise FileDownloadError(str(e))
+
+
+def range_total_length(content_range: Optional[str], size: Optional[int]) -> Optional[int]:
+    # Size of the whole object from a Content-Range like: bytes 0-99/1234,
+    # size when the whole object was read
+    total = (content_range or '').rpartition('/')[2]
+    return int(total) if total.isdigit() else size
+
+
+def stream_size(stream: Any) -> Optional[int]:
+    # Bytes left in a seekable stream, None when it can not be measured
+    try:
+        position = stream.tell()
+        size = stream.seek(0, os.SEEK_END) - position
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
 class CloudProviderType(Enum):
     """Cloud Providers"""
     GCP = 'gcp'
@@ -56,299 +187,124 @@ class StorageAction(ABC):
     This interface provides actions like:
         get client object,
         download files from blob,
-        list files in storage container/bucket,
-        delete files from bucket/container,
-        upload file to bucket/container
+        stream files (or a byte range of them) from blob in chunks,
+        read file properties (size, etag, content type),
+        list files in storage container/bucket, page by page,
+        delete files from bucket/container, one by one or in batches,
+        upload file to bucket/container,
+        upload file in parts (multipart upload / staged blocks),
+        copy a file server side from another bucket/container of the same cloud,
+        sign links for clients to upload straight to the bucket/container
     """
+    # Cloud type label of the provider calls, e.g. 'aws'
+    cloud_type: str
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        instrument_class(cls, INSTRUMENTED_METHODS)
+
     @abstractmethod
     def create_service_client(self) -> None: pass
 
+    @abstractmethod
+    def credentials_key(self) -> Tuple[str, str]: pass
+
+    @abstractmethod
+    def storage_location(self) -> str: pass
+
     @abstractmethod
     def download_blob(self, name: str) -> Any: pass
 
+    @abstractmethod
+    def open_stream(
+        self,
+        name: str,
+        offset: int = 0,
+        length: Optional[int] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE) -> BlobStream: pass
+
+    @abstractmethod
+    def get_blob_properties(self, name: str) -> Dict[str, Any]: pass
+
     @abstractmethod
     def list_blob(self) -> List[Dict[str,Any]]: pass
 
+    @abstractmethod
+    def list_blob_page(
+        self,
+        prefix: Optional[str] = None,
+        delimiter: Optional[str] = None,
+        page_size: int = LIST_PAGE_SIZE,
+        continuation_token: Optional[str] = None,
+        start_after: Optional[str] = None) -> Dict[str, Any]: pass
+
+    def iter_blobs(self, prefix: Optional[str] = None, start_after: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        # Walks the whole listing one page at a time, in name order,
+        # only names after start_after when it is set
+        continuation_token = None
+        while True:
+            page = self.list_blob_page(
+                prefix=prefix,
+                continuation_token=continuation_token,
+                start_after=start_after)
+            yield from page.get('items')
+            continuation_token = page.get('next_token')
+            if not continuation_token:
+                return
+
     @abstractmethod
     def delete_blob(self, name: str) -> None: pass
 
     @abstractmethod
-    def upload_blob(self, file_path: Any) -> None: pass
+    def delete_blobs(self, names: List[str]) -> Dict[str, bool]: pass
+
+    @abstractmethod
+    def upload_blob(self, file_path: Any, codec: Optional[str] = None) -> Dict[str, Any]: pass
 
     @abstractmethod
-    def upload_blob_public(self, file_path: Any) -> None: pass
+    def upload_blob_public(self, file_path: Any, codec: Optional[str] = None) -> Dict[str, Any]: pass
 
     @abstractmethod
     def get_temp_blob_link(self, filename: str) -> str: pass
 
+    @abstractmethod
+    def get_upload_link(
+        self,
+        name: str,
+        content_type: Optional[str] = None,
+        max_size: Optional[int] = None) -> Dict[str, Any]: pass
 
-class AzureStorageServiceProvider(StorageAction):
-    """Azure Blob Storage Service Provider"""
-    conn: str
-    container_name: str
-    clt: Any
+    @abstractmethod
+    def create_multipart_upload(
+        self,
+        name: str,
+        content_type: Optional[str] = None,
+        codec: Optional[str] = None) -> str: pass
 
-    def __init__(self, connection_string: str, container_name: str) -> None:
-        self.conn = connection_string
-        self.container_name = container_name
+    @abstractmethod
+    def upload_part(self, name: str, upload_id: str, part_number: int, data: bytes) -> str: pass
 
-    def create_service_client(self) -> None:
-        if not self.conn:
-            raise RequriedParameterMissing('Required Connection \
-                String Is Missing!')
-        try:
-            self.clt = BlobServiceClient.from_connection_string(
-                self.conn
-            )
-        except AzureConnectionError as ace:
-            logging.error(ace)
-            raise AzureConnectionError('Connection string invalid, please check again')
-
-    def get_container_client(self):
-        # Checks for container
-        # if not exists
-        # creates one and returns container client
-        return self.clt.get_container_client(self.container_name) \
-            if self.clt.get_container_client(self.container_name)\
-            else self.clt.create_container(self.container_name)
-
-    def download_blob(self, name: str) -> Any:
-        # Download the blob from storage
-        blob_client = self.clt.get_blob_client(
-            container=self.container_name,
-            blob=name
-        )
-        if blob_client.exists():
-            try:
-                return str(blob_client.download_blob().readall())
-            except Exception:
-                raise FileDownloadError(
-                    'Something went wrong while downloading!'
-                )
-        return f'Item: {name} does not found!'
-        
-    def parse_blob_list(self, blob_lists) -> List[Dict[str,Any]]:
-        return [{"filename":blob.name,"bucket_name":blob.container} for blob in blob_lists]
-
-    def list_blob(self) -> List[Dict[str,Any]]:
-        # returns the list of items in container
-        return self.parse_blob_list(self.get_container_client().list_blobs())
-
-    def delete_blob(self, name: str) -> None:
-        # Deletes the item from blob
-        blob_client = self.clt.get_blob_client(
-            container=self.container_name,
-            blob=name
-        )
-        if blob_client.exists():
-            blob_client.delete_blob()
-            return True
-        return False
-
-    def upload_blob(self, file_path: Any) -> None:
-        # Uploads a file to blob storage
-        if file_path:
-            filename = str(uuid4())+'.'+file_path.filename.split('.')[-1]
-            blob_client = self.clt.get_blob_client(
-                container=self.container_name,
-                blob=filename
-            )
-            try:
-                blob_client.upload_blob(file_path)
-            except FileUploadError as e:
-                logging.error(e)
-                raise FileUploadError('Something went wrong while file upload!')
-            logging.info('File: {} upload success'.format(filename))
-
-    def upload_blob_public(self, file_path: Any) -> None:
-        # Uploads a file to public blob storage
-        if file_path:
-            filename = str(uuid4())+'.'+file_path.filename.split('.')[-1]
-            blob_client = self.clt.get_blob_client(
-                container=self.container_name,
-                blob=filename
-            )
-            try:
-                blob_client.upload_blob(file_path)
-            except FileUploadError as e:
-                logging.error(e)
-                raise FileUploadError('Something went wrong while file upload!')
-            logging.info('File: {} upload success'.format(filename))
-
-    def get_temp_blob_link(self, filename: str) -> str:
-        sas_token = generate_account_sas(
-            self.clt.account_name,
-            account_key=self.clt.credential.account_key,
-            blob_name=filename,
-            resource_types=ResourceTypes(object=True),
-            permission=AccountSasPermissions(read=True),
-            expiry=datetime.utcnow() + timedelta(minutes=10)
-        )
-        print(self.container_name)
-        url = f'https://{self.clt.account_name}.blob.core.windows.net/{self.container_name}/{filename}?{sas_token}'
-        return url
-
-
-class GCPStorageServiceProvider(StorageAction):
-    """GCP Storage Service Provider"""
-    account_key_json: Any
-    bucket_name: str
-    clt: storage.Client
-
-    def __init__(self, account_key_json: Any, bucket_name: str) -> None:
-        self.account_key_json = account_key_json
-        self.bucket_name = bucket_name
-
-    def create_service_client(self) -> None:
-        if not self.account_key_json:
-            raise RequriedParameterMissing(
-                'Required Connection String is Missing!'
-            )
-        self.clt = storage.Client.from_service_account_json(
-            self.account_key_json)
-
-    def download_blob(self, name: str) -> Any:
-        self.check_bucket()
-        bucket = self.clt.get_bucket(self.bucket_name)
-        blob = bucket.get_blob(blob_name=name)
-        return blob.download_as_bytes()
-
-    def list_blob(self) -> List[str]:
-        self.check_bucket()
-        return list(self.clt.list_blobs(bucket_or_name=self.bucket_name))
-
-    def delete_blob(self, name: str) -> None:
-        self.check_bucket()
-        bucket = self.clt.get_bucket(self.bucket_name)
-        blob = bucket.get_blob(blob_name=name)
-        try:
-            blob.delete()
-        except DeleteOperationError as e:
-            logging.error(e)
-
-    def upload_blob(self, file_path: Any) -> None:
-        self.check_bucket()
-        bucket = self.clt.get_bucket(self.bucket_name)
-        filename = str(uuid4())+file_path.name.split('.')[-1]
-        blob = bucket.blob(filename)
-        try:
-            with open(file_path, 'rb') as data:
-                blob.upload_from_file(data)
-        except FileUploadError as e:
-            logging.error(e)
-
-    def check_bucket(self):
-        if not self.bucket_name:
-            raise RequriedParameterMissing(
-                    'Bucket Name missing!'
-            )
-
-
-class AWSStorageServiceProvider(StorageAction):
-    """AWS Storage Service Provider"""
-    access_key_id: str
-    secret_access_key: str
-    bucket_name: str
-    _public_bucket_name: str = 'public_bucket'
-    clt: Any
+    @abstractmethod
+    def complete_multipart_upload(
+        self,
+        name: str,
+        upload_id: str,
+        parts: List[Tuple[int, str]],
+        content_type: Optional[str] = None,
+        codec: Optional[str] = None) -> Dict[str, Any]: pass
 
-    def __init__(
+    @abstractmethod
+    def abort_multipart_upload(self, name: str, upload_id: str) -> None: pass
+
+    def copy_blob_from(
         self,
-        access_key: str,
-        secret_key: str,
-        bucket_name: str
-    ) -> None:
-        self.access_key = access_key
-        self.secret_key = secret_key
-        self.bucket_name = bucket_name
-
-    def create_service_client(self):
-        if not (
-            self.access_key and self.secret_key
-            ):
-            raise RequriedParameterMissing(
-                'Required Secret key or access key is Missing!'
-            )
-        try:
-            self.clt = boto3.client(
-                's3',
-                aws_access_key_id=self.access_key,
-                aws_secret_access_key=self.secret_key,
-            )
-        except AWSConnectionError as ace:
-            raise AWSConnectionError('Secrets not valid, please check again!')
-
-    def download_blob(self, name: str) -> Any:
-        try:
-            with tempfile.NamedTemporaryFile(suffix=name.split('.')[-1]) as data:
-                self.clt.download_fileobj(self.bucket_name, name, data)
-                data.seek(0)
-                file_as_string = data.read()
-                return str(file_as_string)
-        except Exception as e:
-            logging.error(e)
-            raise FileDownloadError('Something went wrong while downloading!')
-
-    def return_parsed_blob_list(self,blob_dict: Dict) -> Dict:
-        return [ {'filename': item.get('Key'), 'bucket_name': blob_dict.get('Name') } for item in blob_dict.get('Contents')]
-        
-
-    def list_blob(self) -> List[Dict[str,Any]]:
-        # Lists the existing buckets in AWS S3
-        return self.return_parsed_blob_list(self.clt.list_objects_v2(Bucket=self.bucket_name, Delimiter=','))
-
-    def delete_blob(self, name: str) -> bool:
-        if not (name in [item.get('filename') for item in self.list_blob()]):
-            return False
-        try:
-            self.clt.delete_object(Bucket=self.bucket_name, Key=name)
-        except ClientError as e:
-            logging.error(e)
-            return False
-        return True
-
-    def upload_blob(self, file_path: Any) -> None:
-        if file_path:
-            filename = str(uuid4())+'.'+file_path.filename.split('.')[-1]
-            try:
-                resp = self.clt.upload_fileobj(
-                        file_path,
-                        self.bucket_name,
-                        filename)
-            except ClientError as e:
-                logging.error(e)
-                raise FileUploadError(
-                    f'Something went wrong while file uploading to S3 Bucket: {self.bucket_name}'
-                    )
-            logging.info('File: {} upload success'.format(filename))
-
-    def upload_blob_public(self, file_path: Any) -> None:
-        if file_path:
-            filename = str(uuid4())+'.'+file_path.filename.split('.')[-1]
-            try:
-                resp = self.clt.upload_fileobj(
-                    file_path,
-                    self.bucket_name,
-                    filename)
-            except ClientError:
-                raise FileUploadError(
-                    f'Something went wrong while \
-                        file uploading to\
-                             S3 Bucket: {self._public_bucket_name}'
-                    )
-            logging.info('File: {} upload success'.format(filename))
-
-    def get_temp_blob_link(self, filename: str) -> str:
-        if filename:
-            url = self.clt.generate_presigned_url(
-                'get_object',
-                Params = {
-                    'Bucket': self.bucket_name,
-                    'Key': filename
-                },
-                HttpMethod="GET",
-                ExpiresIn=300)
-            return url
+        source: 'StorageAction',
+        name: str,
+        target_name: str,
+        props: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # Copies a blob of source without the bytes passing through this
+        # process. None when the provider can not, the caller then streams it.
+        return None
 
 
 class ServiceProvider:
@@ -0,0 +1,58 @@
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Optional, Tuple
+from cachetools import TTLCache
+
+
+def hash_credentials(*secrets: Optional[str]) -> str:
+    # Never keep raw secrets as cache keys, only a digest of them
+    digest = hashlib.sha256()
+    for secret in secrets:
+        digest.update((secret or '').encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class ClientPool:
+    """
+    Thread safe pool of cloud SDK clients:
+    Clients are keyed by (provider, hash of credentials) so warm HTTP
+    connection pools are reused across requests. Entries are evicted
+    least recently used first once the pool is full, and expire after ttl
+    seconds so rotated credentials are eventually picked up.
+    """
+    def __init__(self, maxsize: int = 128, ttl: float = 900) -> None:
+        self._clients: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(
+        self,
+        key: Tuple[str, str],
+        factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self.hits += 1
+                return client
+            self.misses += 1
+        # Client creation is slow, so it is done outside the lock.
+        # If two threads race, the first stored client wins.
+        client = factory()
+        with self._lock:
+            return self._clients.setdefault(key, client)
+
+    def invalidate(self, key: Tuple[str, str]) -> None:
+        with self._lock:
+            if self._clients.pop(key, None) is not None:
+                logging.info('Client for provider: {} evicted from pool'.format(key[0]))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clients.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clients)
@@ -0,0 +1,83 @@
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# Providers this deployment serves, the SDKs of the others are never imported
+ENABLED_PROVIDERS = [
+    name.strip() for name in os.getenv('ENABLED_PROVIDERS', 'aws,az').split(',') if name.strip()
+]
+# Imports the enabled providers at startup instead of on first use,
+# e.g. with gunicorn --preload so forked workers share the loaded SDKs
+PRELOAD_PROVIDERS = os.getenv('PRELOAD_PROVIDERS', 'false').lower() == 'true'
+
+
+class ProviderRegistry:
+    """
+    Storage provider factories by cloud type:
+    every provider lives in its own module exposing create_provider(user_cloud),
+    the module (and so its cloud SDK) is imported on first use.
+    """
+    def __init__(self, modules: Dict[str, str], enabled: Iterable[str] = ENABLED_PROVIDERS) -> None:
+        self._modules = modules
+        self.enabled = [name for name in enabled if name in modules]
+        self._factories: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._import_seconds: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, cloud_type: str) -> Optional[Callable[[Dict[str, Any]], Any]]:
+        with self._lock:
+            if cloud_type in self._factories or cloud_type in self._errors:
+                return self._factories.get(cloud_type)
+            started = time.perf_counter()
+            try:
+                module = importlib.import_module(self._modules[cloud_type], __package__)
+            except ImportError as e:
+                # a missing SDK disables its provider instead of failing every worker
+                logging.error('Storage provider {} could not be loaded: {}'.format(cloud_type, e))
+                self._errors[cloud_type] = str(e)
+                return None
+            self._import_seconds[cloud_type] = time.perf_counter() - started
+            self._factories[cloud_type] = module.create_provider
+            logging.info('Storage provider {} loaded in {:.3f}s'.format(
+                cloud_type, self._import_seconds[cloud_type]))
+            return module.create_provider
+
+    def get(self, cloud_type: str) -> Optional[Callable[[Dict[str, Any]], Any]]:
+        # Factory of an enabled provider, None when unknown, disabled or broken
+        if cloud_type not in self.enabled:
+            return None
+        return self._factories.get(cloud_type) or self._load(cloud_type)
+
+    def preload(self) -> None:
+        for cloud_type in self.enabled:
+            self.get(cloud_type)
+
+    def report(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                'provider': name,
+                'enabled': name in self.enabled,
+                'loaded': name in self._factories,
+                'import_seconds': round(self._import_seconds[name], 3) if name in self._import_seconds else None,
+                'error': self._errors.get(name)
+            } for name in self._modules
+        ]
+
+    def describe(self) -> str:
+        # One line summary for the startup log
+        states = []
+        for entry in self.report():
+            if not entry.get('enabled'):
+                state = 'disabled'
+            elif entry.get('error'):
+                state = 'unavailable'
+            elif entry.get('loaded'):
+                state = 'loaded in {}s'.format(entry.get('import_seconds'))
+            else:
+                state = 'loads on first use'
+            states.append('{} ({})'.format(entry.get('provider'), state))
+        return ', '.join(states)
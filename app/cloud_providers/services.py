@@ -1,39 +1,13 @@
-from typing import Any, Dict
-from database.db_handler import users
+import os
+from typing import Any, Dict, Optional
+from .hooks import phase
+from .pool import ClientPool
 from .platforms import (
     StorageAction,
     CloudProviderType,
-    AzureStorageServiceProvider,
-    AWSStorageServiceProvider,
-    GCPStorageServiceProvider,
+    RequriedParameterMissing,
     ServiceProvider)
-
-
-def az(user_cloud: Dict[str,Any]) -> StorageAction:
-    connection_string = user_cloud.get('connection_string')
-    container_name = user_cloud.get('bucket_name')
-    return AzureStorageServiceProvider(connection_string, container_name)
-
-
-def aws(user_cloud: Dict[str,Any]) -> StorageAction:
-    access_key_id = user_cloud.get('access_key')
-    secret_access_key = user_cloud.get('secret_access_key')
-    bucket_name = user_cloud.get('bucket_name')
-    return AWSStorageServiceProvider(
-        access_key_id,
-        secret_access_key,
-        bucket_name)
-
-
-def gcp(user_cloud: users) -> None: pass
-    # account_key_json = user_cloud.account_key_json
-    # bucket_name = user_cloud.bucket_name
-    # with tempfile.NamedTemporaryFile(suffix='.json') as key_json:
-    #     key_json.write(account_key_json)
-    #     return GCPStorageServiceProvider(
-    #         account_key_json=key_json.name,
-    #         bucket_name=bucket_name
-    #         )
+from .registry import ProviderRegistry
 
 
 map_cloud_providers = {
@@ -42,21 +16,46 @@ map_cloud_providers = {
     'az': CloudProviderType.AZ
 }
 
-providers = {
-    'gcp': gcp,
-    'aws': aws,
-    'az': az
-}
+# Provider modules, imported on first use, see ENABLED_PROVIDERS
+providers = ProviderRegistry({
+    'gcp': '.gcp_platform',
+    'aws': '.aws_platform',
+    'az': '.az_platform'
+})
+
+
+client_pool = ClientPool(
+    maxsize=int(os.getenv('CLIENT_POOL_SIZE', 128)),
+    ttl=float(os.getenv('CLIENT_POOL_TTL', 900))
+)
 
 
 def get_storage_provider(
     cloud_type: str,
-    user_cloud: Dict[str,Any]) -> StorageAction:
-    return providers.get(cloud_type)(user_cloud)
+    user_cloud: Dict[str,Any]) -> Optional[StorageAction]:
+    # None for an unknown or disabled provider
+    factory = providers.get(cloud_type)
+    return factory(user_cloud) if factory else None
 
 
 def get_service_provider_client(storage_provider: StorageAction)\
      -> ServiceProvider:
+    if storage_provider is None:
+        raise RequriedParameterMissing('Cloud provider is not supported or not enabled!')
     serviceProvider: ServiceProvider = ServiceProvider(storage_provider)
-    serviceProvider.create_client()
+
+    def build_client() -> Any:
+        serviceProvider.create_client()
+        return storage_provider.clt
+
+    # Reuse an already connected client for the same credentials
+    with phase('service_client'):
+        storage_provider.clt = client_pool.get_or_create(
+            storage_provider.credentials_key(),
+            build_client)
     return serviceProvider
+
+
+def invalidate_service_client(storage_provider: StorageAction) -> None:
+    # Drops the pooled client built from these credentials
+    client_pool.invalidate(storage_provider.credentials_key())
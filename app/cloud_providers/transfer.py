@@ -0,0 +1,47 @@
+import os
+
+MB = 1024 * 1024
+# S3 rejects multipart parts smaller than 5MB (except the last one)
+AWS_MIN_PART_SIZE = 5 * MB
+# Azure staged blocks can be at most 4000MB
+AZ_MAX_BLOCK_SIZE = 4000 * MB
+# Parts of one S3 multipart upload / committed blocks of one Azure blob
+AWS_MAX_PARTS = 10000
+AZ_MAX_BLOCKS = 50000
+
+
+def part_size_for(size: int, part_size: int, max_parts: int, min_part_size: int = 1) -> int:
+    # The configured part size, raised until size fits in max_parts parts
+    return max(part_size, min_part_size, -(-size // max_parts))
+
+
+class UploadConfig:
+    """
+    Upload engine settings of one cloud provider:
+        part_size: size of the multipart parts / staged blocks,
+            payloads up to this size go in a single request,
+        concurrency: parts uploaded in parallel for one file,
+        max_attempts: attempts per part request before the upload fails
+    """
+    part_size: int
+    concurrency: int
+    max_attempts: int
+
+    def __init__(
+        self,
+        part_size: int = 8 * MB,
+        concurrency: int = 8,
+        max_attempts: int = 5
+    ) -> None:
+        self.part_size = part_size
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max(1, max_attempts)
+
+    @classmethod
+    def from_env(cls, prefix: str) -> 'UploadConfig':
+        # e.g. AWS_UPLOAD_PART_SIZE, AZ_UPLOAD_CONCURRENCY, AZ_UPLOAD_MAX_ATTEMPTS
+        return cls(
+            part_size=int(os.getenv(f'{prefix}_UPLOAD_PART_SIZE', 8 * MB)),
+            concurrency=int(os.getenv(f'{prefix}_UPLOAD_CONCURRENCY', 8)),
+            max_attempts=int(os.getenv(f'{prefix}_UPLOAD_MAX_ATTEMPTS', 5))
+        )
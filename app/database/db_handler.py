@@ -1,10 +1,132 @@
-from pymongo import MongoClient
+import logging
+from typing import Any, Callable, Dict, List, Tuple
+from pymongo import MongoClient, ASCENDING, monitoring
+from pymongo.errors import PyMongoError
 import os
 
-if os.getenv('APP_ENV'):
+# Callables observing every MongoDB command as
+# observer(command_name, collection, seconds, failed)
+CommandObserver = Callable[[str, str, float, bool], None]
+command_observers: List[CommandObserver] = []
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Hands the duration of every MongoDB command to command_observers"""
+    def __init__(self) -> None:
+        # collection of the commands in flight, keyed like the driver events
+        self._collections: Dict[Tuple[Any, int], str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if command_observers:
+            collection = event.command.get(event.command_name)
+            self._collections[(event.connection_id, event.request_id)] = \
+                collection if isinstance(collection, str) else ''
+
+    def _notify(self, event: Any, failed: bool) -> None:
+        collection = self._collections.pop((event.connection_id, event.request_id), '')
+        for observer in command_observers:
+            try:
+                observer(event.command_name, collection, event.duration_micros / 1e6, failed)
+            except Exception as e:
+                logging.error('MongoDB command observer failed: {}'.format(e))
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._notify(event, False)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._notify(event, True)
+
+
+command_timer = CommandTimer()
+
+if os.getenv('MONGO_URI'):
+    # full connection string, e.g. a throwaway server for the benchmarks
+    MONGO_URI = os.environ['MONGO_URI']
+    client = MongoClient(MONGO_URI, event_listeners=[command_timer])
+elif os.getenv('APP_ENV'):
     MONGO_URI = 'mongodb://' + os.environ['MONGODB_USERNAME'] + ':' + os.environ['MONGODB_PASSWORD'] + '@' + os.environ['MONGODB_HOSTNAME'] + ':27017/' + os.environ['MONGODB_DATABASE']
-    client = MongoClient(MONGO_URI)
+    client = MongoClient(MONGO_URI, event_listeners=[command_timer])
 else:
-    client = MongoClient('localhost', 27017)
-db = client.cloud_users
-users = db.users
\ No newline at end of file
+    client = MongoClient('localhost', 27017, event_listeners=[command_timer])
+db = client[os.getenv('MONGO_DATABASE', 'cloud_users')]
+users = db.users
+upload_sessions = db.upload_sessions
+blob_catalog = db.blob_catalog
+blob_catalog_sync = db.blob_catalog_sync
+jobs = db.jobs
+sync_pairs = db.sync_pairs
+sync_manifest = db.sync_manifest
+
+
+# Fields of models.blob_catalog.catalog_scope
+CATALOG_SCOPE_KEYS = [('cloud_provider', ASCENDING), ('location', ASCENDING), ('credentials', ASCENDING)]
+
+
+def drop_indexes(collection: Any, *names: str) -> None:
+    existing = collection.index_information()
+    for name in names:
+        if name in existing:
+            collection.drop_index(name)
+
+
+def ensure_indexes() -> None:
+    # Creates the indexes used by login, signup and token lookups.
+    # create_index is a no-op when the index already exists.
+    try:
+        users.create_index(
+            [('public_id', ASCENDING)],
+            name='public_id_unique',
+            unique=True)
+        users.create_index(
+            [('email', ASCENDING), ('cloud_provider', ASCENDING)],
+            name='email_cloud_provider_unique',
+            unique=True)
+        upload_sessions.create_index(
+            [('session_id', ASCENDING)],
+            name='session_id_unique',
+            unique=True)
+        upload_sessions.create_index(
+            [('public_id', ASCENDING), ('status', ASCENDING)],
+            name='public_id_status')
+        # the catalog scope gained the credentials hash, the unique indexes
+        # without it would keep two keys from cataloguing the same bucket
+        drop_indexes(blob_catalog, 'location_filename_unique', 'location_last_modified', 'location_sha256')
+        drop_indexes(blob_catalog_sync, 'sync_location_unique')
+        # serves exact lookups, prefix queries (anchored regex) and paging by name
+        blob_catalog.create_index(
+            CATALOG_SCOPE_KEYS + [('filename', ASCENDING)],
+            name='scope_filename_unique',
+            unique=True)
+        blob_catalog.create_index(
+            CATALOG_SCOPE_KEYS + [('last_modified', ASCENDING)],
+            name='scope_last_modified')
+        # digest lookups of deduplicating uploads, only entries with a digest are indexed
+        blob_catalog.create_index(
+            CATALOG_SCOPE_KEYS + [('sha256', ASCENDING)],
+            name='scope_sha256',
+            partialFilterExpression={'sha256': {'$exists': True}})
+        blob_catalog_sync.create_index(
+            CATALOG_SCOPE_KEYS,
+            name='sync_scope_unique',
+            unique=True)
+        jobs.create_index(
+            [('job_id', ASCENDING)],
+            name='job_id_unique',
+            unique=True)
+        # serves the claims of the workers, oldest runnable job first
+        jobs.create_index(
+            [('status', ASCENDING), ('run_after', ASCENDING)],
+            name='status_run_after')
+        jobs.create_index(
+            [('public_id', ASCENDING), ('created_at', ASCENDING)],
+            name='jobs_public_id_created_at')
+        sync_pairs.create_index(
+            [('pair_id', ASCENDING)],
+            name='pair_id_unique',
+            unique=True)
+        sync_manifest.create_index(
+            [('pair_id', ASCENDING), ('filename', ASCENDING)],
+            name='pair_filename_unique',
+            unique=True)
+    except PyMongoError as e:
+        logging.error('Index creation failed: {}'.format(e))
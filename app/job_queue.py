@@ -0,0 +1,233 @@
+"""
+Background jobs:
+Long running storage operations (copies, syncs, large uploads, bulk
+deletes) are queued in the MongoDB jobs collection and answered with a
+job id, clients then poll GET /jobs/<job_id>. A pool of worker threads
+claims and runs them, in the app process and/or in separate worker
+processes (python tasks.py), all sharing the collection.
+
+Running jobs hold a lease the pool renews; jobs of a worker which died
+are queued again once their lease expired. Failed jobs are retried with a
+growing delay until they run out of attempts.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+from uuid import uuid4
+from models import jobs
+
+# Worker threads per process, 0 runs no jobs in this process
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+# false leaves the jobs to separate worker processes (python tasks.py)
+JOB_WORKERS_IN_APP = os.getenv('JOB_WORKERS_IN_APP', 'true').lower() == 'true'
+# Jobs running at once per user and per cloud provider, over all processes
+JOB_USER_CONCURRENCY = int(os.getenv('JOB_USER_CONCURRENCY', 2))
+JOB_PROVIDER_CONCURRENCY = int(os.getenv('JOB_PROVIDER_CONCURRENCY', 8))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+# Seconds before the first retry, doubled on every further one
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', 10))
+# Seconds a running job is held without its lease being renewed
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 60))
+# Seconds an idle worker waits before looking for jobs again
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 2))
+# Jobs pinned to this host, e.g. uploads spooled here, only run on its workers
+HOST = socket.gethostname()
+
+
+class JobError(Exception):
+    """A failure retrying can not fix, the job fails without further attempts"""
+    pass
+
+
+class JobContext:
+    """What a handler gets: the job's parameters and a way to report progress"""
+    def __init__(self, job: Dict[str, Any], worker: str) -> None:
+        self.job_id = job.get('job_id')
+        self.public_id = job.get('public_id')
+        self.params = job.get('params') or {}
+        self.secrets = job.get('secrets') or {}
+        self.attempt = job.get('attempts')
+        self.last_attempt = job.get('attempts') >= job.get('max_attempts')
+        self._worker = worker
+
+    def report(self, progress: Dict[str, Any]) -> None:
+        jobs.report_progress(self.job_id, self._worker, progress)
+
+
+# Job kind -> handler, the handler's return value becomes the job's result
+Handler = Callable[[JobContext], Optional[Dict[str, Any]]]
+handlers: Dict[str, Handler] = {}
+# Job kind -> cleanup of the job's params, for a job failed for good
+# while no handler ran, i.e. its worker died on the last attempt
+Cleanup = Callable[[Dict[str, Any]], None]
+cleanups: Dict[str, Cleanup] = {}
+
+
+def handler(kind: str, cleanup: Optional[Cleanup] = None) -> Callable[[Handler], Handler]:
+    # Registers the handler of a job kind, see tasks.py
+    def register(func: Handler) -> Handler:
+        handlers[kind] = func
+        if cleanup:
+            cleanups[kind] = cleanup
+        return func
+    return register
+
+
+def clean_up(job: Dict[str, Any]) -> None:
+    cleanup = cleanups.get(job.get('kind'))
+    if not cleanup:
+        return
+    try:
+        cleanup(job.get('params') or {})
+    except Exception as e:
+        logging.error('Cleaning up after job {} failed: {}'.format(job.get('job_id'), e))
+
+
+def retry_delay(attempt: int) -> float:
+    return JOB_RETRY_DELAY * 2 ** (attempt - 1)
+
+
+class WorkerPool:
+    """
+    Worker threads claiming jobs from MongoDB, one more thread renews the
+    leases of the running jobs and re-queues the jobs of dead workers.
+    """
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        user_limit: int = JOB_USER_CONCURRENCY,
+        provider_limit: int = JOB_PROVIDER_CONCURRENCY,
+        lease_seconds: int = JOB_LEASE_SECONDS,
+        poll_interval: float = JOB_POLL_INTERVAL
+    ) -> None:
+        self.worker_id = '{}:{}:{}'.format(HOST, os.getpid(), uuid4().hex[:8])
+        self.workers = workers
+        self.user_limit = max(1, user_limit)
+        self.provider_limit = max(1, provider_limit)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._running: Set[str] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for number in range(self.workers):
+            self._threads.append(threading.Thread(target=self._work, name=f'job-worker-{number}', daemon=True))
+        self._threads.append(threading.Thread(target=self._keep_leases, name='job-leases', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logging.info('Job worker {} started with {} threads'.format(self.worker_id, self.workers))
+
+    def serve_forever(self) -> None:
+        # Runs the pool in the foreground, for a separate worker process
+        self.start()
+        for thread in self._threads:
+            thread.join()
+
+    def wake(self) -> None:
+        # A job was just queued, idle workers look at once
+        self._wake.set()
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        # Threads of this process claim one at a time, so the limits hold
+        # exactly here and closely across processes
+        with self._lock:
+            per_user, per_provider = jobs.running_counts()
+            job = jobs.claim_next(
+                self.worker_id,
+                self.lease_seconds,
+                busy_users=[user for user, count in per_user.items() if count >= self.user_limit],
+                busy_providers=[provider for provider, count in per_provider.items() if count >= self.provider_limit],
+                kinds=list(handlers),
+                host=HOST)
+            if job:
+                self._running.add(job.get('job_id'))
+            return job
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        job_id = job.get('job_id')
+        context = JobContext(job, self.worker_id)
+        logging.info('Job {} ({}) started, attempt {}'.format(job_id, job.get('kind'), context.attempt))
+        try:
+            result = handlers[job.get('kind')](context)
+        except JobError as e:
+            logging.error('Job {} failed: {}'.format(job_id, e))
+            jobs.fail_job(job_id, self.worker_id, str(e))
+        except Exception as e:
+            retry_in = None if context.last_attempt else retry_delay(context.attempt)
+            logging.error('Job {} failed, {}: {}'.format(
+                job_id, 'retrying in {:.0f}s'.format(retry_in) if retry_in is not None else 'no attempts left', e))
+            jobs.fail_job(job_id, self.worker_id, str(e), retry_in)
+        else:
+            jobs.succeed_job(job_id, self.worker_id, result)
+            logging.info('Job {} succeeded'.format(job_id))
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+
+    def _work(self) -> None:
+        while True:
+            try:
+                job = self._claim()
+                if job:
+                    self._run(job)
+                    continue
+            except Exception as e:
+                # e.g. MongoDB unreachable, the job's lease runs out and it is retried
+                logging.error('Job worker error: {}'.format(e))
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _keep_leases(self) -> None:
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                with self._lock:
+                    running = list(self._running)
+                jobs.renew_leases(self.worker_id, running, self.lease_seconds)
+                requeued, failed = jobs.recover_expired()
+                if requeued:
+                    logging.info('{} jobs of stopped workers queued again'.format(requeued))
+                    self.wake()
+                for job in failed:
+                    clean_up(job)
+            except Exception as e:
+                logging.error('Job lease renewal failed: {}'.format(e))
+
+
+worker_pool: Optional[WorkerPool] = None
+
+
+def start_workers() -> Optional[WorkerPool]:
+    # Runs the jobs in this process as well
+    global worker_pool
+    if JOB_WORKERS <= 0:
+        return None
+    if worker_pool is None:
+        worker_pool = WorkerPool()
+        worker_pool.start()
+    return worker_pool
+
+
+def submit(
+    kind: str,
+    public_id: str,
+    providers: List[str],
+    params: Dict[str, Any],
+    secrets: Optional[Dict[str, Any]] = None,
+    max_attempts: int = JOB_MAX_ATTEMPTS,
+    host: Optional[str] = None) -> Dict[str, Any]:
+    # Queues a job, returns the stored job. host=job_queue.HOST keeps the job
+    # on the workers of this host.
+    if kind not in handlers:
+        raise ValueError(f'Unknown job kind: {kind}')
+    job = jobs.create_job(kind, public_id, sorted(set(providers)), params, max(1, max_attempts), secrets, host)
+    if worker_pool:
+        worker_pool.wake()
+    return job
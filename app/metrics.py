@@ -0,0 +1,154 @@
+"""
+Prometheus metrics of the API, scraped from /metrics:
+request latency per route and provider, request/response bytes, requests
+in flight, cloud SDK calls per StorageAction method, MongoDB command timings
+and the hit rates of the client pools and caches.
+
+With several gunicorn workers set PROMETHEUS_MULTIPROC_DIR to an empty
+directory, every worker then writes its samples there and a scrape reports
+the sum over all of them.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator, Optional, Tuple
+from prometheus_client import (
+    CollectorRegistry,
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest)
+from prometheus_client import multiprocess
+from cloud_providers.aio_services import async_client_pool
+from cloud_providers.disk_cache import download_cache
+from cloud_providers.hooks import add_call_hook
+from cloud_providers.links import link_cache
+from cloud_providers.services import client_pool, map_cloud_providers
+from database.db_handler import command_observers
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+# Cloud transfers run far longer than the default buckets
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, float('inf'))
+MONGO_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, float('inf'))
+# Label of requests without a (known) provider
+NO_PROVIDER = 'none'
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Time from the request start until the response body was sent',
+    ['route', 'method', 'provider', 'status'],
+    buckets=LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight',
+    'Requests being served',
+    ['route'],
+    multiprocess_mode='livesum')
+REQUEST_BYTES = Counter(
+    'http_request_body_bytes',
+    'Request body bytes received, the uploads',
+    ['route', 'provider'])
+RESPONSE_BYTES = Counter(
+    'http_response_body_bytes',
+    'Response body bytes sent, the downloads',
+    ['route', 'provider'])
+STORAGE_CALL_LATENCY = Histogram(
+    'storage_call_duration_seconds',
+    'Duration of the StorageAction calls, i.e. of the cloud SDK requests',
+    ['provider', 'method'],
+    buckets=LATENCY_BUCKETS)
+STORAGE_CALL_ERRORS = Counter(
+    'storage_call_errors',
+    'StorageAction calls which raised',
+    ['provider', 'method', 'error'])
+MONGO_COMMAND_LATENCY = Histogram(
+    'mongodb_command_duration_seconds',
+    'Duration of the MongoDB commands',
+    ['command', 'collection'],
+    buckets=MONGO_BUCKETS)
+MONGO_COMMAND_ERRORS = Counter(
+    'mongodb_command_errors',
+    'MongoDB commands which failed',
+    ['command', 'collection'])
+# Running totals of the process, copied from the pools and caches, see refresh_cache_stats
+CACHE_HITS = Gauge('cache_hits', 'Lookups answered by the cache', ['cache'], multiprocess_mode='livesum')
+CACHE_MISSES = Gauge('cache_misses', 'Lookups missing the cache', ['cache'], multiprocess_mode='livesum')
+CACHE_ENTRIES = Gauge('cache_entries', 'Entries held by the cache', ['cache'], multiprocess_mode='livesum')
+
+
+def provider_label(cloud_type: Optional[str]) -> str:
+    # Only known providers become labels, so request input can not add series
+    return cloud_type if cloud_type in map_cloud_providers else NO_PROVIDER
+
+
+@contextmanager
+def time_storage_call(cloud_type: str, method: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        STORAGE_CALL_ERRORS.labels(cloud_type, method, type(e).__name__).inc()
+        raise
+    finally:
+        STORAGE_CALL_LATENCY.labels(cloud_type, method).observe(time.perf_counter() - started)
+
+
+def observe_mongo_command(command: str, collection: str, seconds: float, failed: bool) -> None:
+    MONGO_COMMAND_LATENCY.labels(command, collection).observe(seconds)
+    if failed:
+        MONGO_COMMAND_ERRORS.labels(command, collection).inc()
+
+
+def _cache_stats() -> Iterable[Tuple[str, Any]]:
+    yield 'client_pool', client_pool
+    yield 'async_client_pool', async_client_pool
+    yield 'link_cache', link_cache
+    if download_cache:
+        yield 'download_cache', download_cache
+
+
+def refresh_cache_stats() -> None:
+    for name, cache in _cache_stats():
+        CACHE_HITS.labels(name).set(cache.hits)
+        CACHE_MISSES.labels(name).set(cache.misses)
+        CACHE_ENTRIES.labels(name).set(len(cache))
+
+
+def observe_request(
+    route: str,
+    method: str,
+    cloud_type: Optional[str],
+    status: int,
+    seconds: float,
+    request_bytes: Optional[int],
+    response_bytes: Optional[int]) -> None:
+    provider = provider_label(cloud_type)
+    REQUEST_LATENCY.labels(route, method, provider, str(status)).observe(seconds)
+    if request_bytes:
+        REQUEST_BYTES.labels(route, provider).inc(request_bytes)
+    if response_bytes:
+        RESPONSE_BYTES.labels(route, provider).inc(response_bytes)
+    if MULTIPROCESS:
+        # a scrape only reaches one worker, the others publish on every request
+        refresh_cache_stats()
+
+
+def render() -> Tuple[bytes, str]:
+    # Exposition of every metric, and its content type
+    refresh_cache_stats()
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def install() -> None:
+    # Starts recording the provider calls and MongoDB commands
+    if not METRICS_ENABLED:
+        return
+    add_call_hook(time_storage_call)
+    if observe_mongo_command not in command_observers:
+        command_observers.append(observe_mongo_command)
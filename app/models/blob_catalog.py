@@ -0,0 +1,240 @@
+import base64
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from cloud_providers.platforms import ItemNotFound, StorageAction, content_digest
+from cloud_providers.services import get_storage_provider, get_service_provider_client
+from database.db_handler import blob_catalog, blob_catalog_sync, users
+
+# Seconds between two background re-syncs of a bucket, 0 disables the job
+RECONCILE_INTERVAL = int(os.getenv('CATALOG_RECONCILE_INTERVAL', 3600))
+RECONCILE_BATCH_SIZE = 500
+ITEM_PROJECTION = {
+    '_id': 0,
+    'filename': 1,
+    'bucket_name': 1,
+    'size': 1,
+    'etag': 1,
+    'content_type': 1,
+    'last_modified': 1,
+    'sha256': 1
+}
+
+
+def catalog_scope(storage_provider: StorageAction) -> Dict[str, str]:
+    # Objects are catalogued per bucket/container and per credentials: a user
+    # only reads entries listed with the keys the user registered, anyone can
+    # name a bucket without being able to read it
+    cloud_provider, credentials = storage_provider.credentials_key()
+    return {
+        'cloud_provider': cloud_provider,
+        'location': storage_provider.storage_location(),
+        'credentials': credentials
+    }
+
+
+# Catalog continuation tokens are told apart from the providers' own tokens
+TOKEN_PREFIX = 'catalog.'
+
+
+def encode_token(filename: str) -> str:
+    return TOKEN_PREFIX + base64.urlsafe_b64encode(filename.encode('utf-8')).decode('ascii')
+
+
+def decode_token(token: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(token[len(TOKEN_PREFIX):].encode('ascii')).decode('utf-8')
+    except (ValueError, UnicodeError):
+        raise ValueError(f'continuation_token: {token} is invalid!')
+
+
+def is_catalog_token(token: Optional[str]) -> bool:
+    return bool(token) and token.startswith(TOKEN_PREFIX)
+
+
+def record_blob(
+    storage_provider: StorageAction,
+    info: Dict[str, Any],
+    public_id: Optional[str] = None) -> None:
+    # Upserts an uploaded object, a catalog failure never fails the upload
+    if not info:
+        return
+    now = datetime.utcnow()
+    fields = {key: value for key, value in info.items() if value is not None}
+    fields['synced_at'] = now
+    if public_id:
+        fields['public_id'] = public_id
+    fields.setdefault('last_modified', now)
+    try:
+        blob_catalog.update_one(
+            {**catalog_scope(storage_provider), 'filename': info.get('filename')},
+            {'$set': fields, '$setOnInsert': {'created_at': now}},
+            upsert=True)
+    except PyMongoError as e:
+        logging.error('Catalog update failed: {}'.format(e))
+
+
+def remove_blob(storage_provider: StorageAction, filename: str) -> None:
+    try:
+        blob_catalog.delete_one({**catalog_scope(storage_provider), 'filename': filename})
+    except PyMongoError as e:
+        logging.error('Catalog update failed: {}'.format(e))
+
+
+def remove_blobs(storage_provider: StorageAction, filenames: List[str]) -> None:
+    try:
+        blob_catalog.delete_many({**catalog_scope(storage_provider), 'filename': {'$in': filenames}})
+    except PyMongoError as e:
+        logging.error('Catalog update failed: {}'.format(e))
+
+
+def exists(storage_provider: StorageAction, filename: str) -> bool:
+    return blob_catalog.find_one(
+        {**catalog_scope(storage_provider), 'filename': filename},
+        {'_id': 1}) is not None
+
+
+def find_by_digest(storage_provider: StorageAction, digest: str) -> Optional[Dict[str, Any]]:
+    return blob_catalog.find_one(
+        {**catalog_scope(storage_provider), 'sha256': digest},
+        ITEM_PROJECTION)
+
+
+def upload_deduplicated(
+    storage_provider: StorageAction,
+    file: Any,
+    public_id: Optional[str] = None,
+    codec: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+    # Content addressed upload: when an object with the same sha256 is
+    # already in the bucket its entry is returned and nothing is transferred.
+    # Returns (object info, deduplicated)
+    digest = content_digest(getattr(file, 'stream', file))
+    if digest:
+        existing = find_by_digest(storage_provider, digest)
+        if existing:
+            try:
+                # the catalog may be behind a delete done outside of the app
+                storage_provider.get_blob_properties(existing.get('filename'))
+                return existing, True
+            except ItemNotFound:
+                remove_blob(storage_provider, existing.get('filename'))
+    info = storage_provider.upload_blob(file, codec)
+    if info and digest:
+        info['sha256'] = digest
+    record_blob(storage_provider, info, public_id)
+    return info, False
+
+
+def is_synced(storage_provider: StorageAction) -> bool:
+    # The catalog is only complete once the bucket was reconciled at least once
+    state = blob_catalog_sync.find_one(
+        {**catalog_scope(storage_provider), 'synced_at': {'$exists': True}},
+        {'_id': 1})
+    return state is not None
+
+
+def list_page(
+    storage_provider: StorageAction,
+    prefix: Optional[str] = None,
+    page_size: int = 1000,
+    continuation_token: Optional[str] = None,
+    modified_since: Optional[datetime] = None) -> Dict[str, Any]:
+    # Same page shape as StorageAction.list_blob_page, answered from MongoDB
+    query: Dict[str, Any] = catalog_scope(storage_provider)
+    name_range: Dict[str, str] = {}
+    if prefix:
+        # a range instead of a regex so the index bounds stay tight
+        name_range['$gte'] = prefix
+        name_range['$lt'] = prefix + '\U0010ffff'
+    if continuation_token:
+        name_range['$gt'] = decode_token(continuation_token)
+    if name_range:
+        query['filename'] = name_range
+    if modified_since:
+        query['last_modified'] = {'$gte': modified_since}
+    items = list(
+        blob_catalog.find(query, ITEM_PROJECTION)
+        .sort('filename', ASCENDING)
+        .limit(page_size + 1))
+    next_token = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_token = encode_token(items[-1]['filename'])
+    return {'items': items, 'prefixes': [], 'next_token': next_token}
+
+
+def reconcile(storage_provider: StorageAction) -> int:
+    # Re-syncs the catalog of a bucket from the provider listing,
+    # entries not seen during the walk were deleted on the provider side
+    scope = catalog_scope(storage_provider)
+    started = datetime.utcnow()
+    batch, count = [], 0
+    for item in storage_provider.iter_blobs():
+        fields = {key: value for key, value in item.items() if value is not None}
+        fields['synced_at'] = started
+        batch.append(UpdateOne(
+            {**scope, 'filename': item.get('filename')},
+            {'$set': fields, '$setOnInsert': {'created_at': started}},
+            upsert=True))
+        if len(batch) >= RECONCILE_BATCH_SIZE:
+            blob_catalog.bulk_write(batch, ordered=False)
+            count += len(batch)
+            batch = []
+    if batch:
+        blob_catalog.bulk_write(batch, ordered=False)
+        count += len(batch)
+    blob_catalog.delete_many({**scope, 'synced_at': {'$lt': started}})
+    blob_catalog_sync.update_one(
+        scope,
+        {'$set': {'synced_at': started, 'objects': count}},
+        upsert=True)
+    logging.info('Catalog of {} reconciled, {} objects'.format(scope.get('location'), count))
+    return count
+
+
+def claim_reconcile(storage_provider: StorageAction, lease_seconds: int) -> bool:
+    # Only one worker process re-syncs a given bucket per interval
+    now = datetime.utcnow()
+    try:
+        blob_catalog_sync.find_one_and_update(
+            {
+                **catalog_scope(storage_provider),
+                '$or': [{'lease_until': {'$exists': False}}, {'lease_until': {'$lt': now}}]
+            },
+            {'$set': {'lease_until': now + timedelta(seconds=lease_seconds)}},
+            upsert=True)
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+def reconcile_all(lease_seconds: int) -> None:
+    for user in users.find({'bucket_name': {'$exists': True, '$ne': None}}, {'password': 0}):
+        try:
+            storage_provider = get_storage_provider(user.get('cloud_provider'), user)
+            if not storage_provider:
+                continue
+            get_service_provider_client(storage_provider)
+            if claim_reconcile(storage_provider, lease_seconds):
+                reconcile(storage_provider)
+        except Exception as e:
+            logging.error('Catalog reconciliation failed for user {}: {}'.format(user.get('public_id'), e))
+
+
+def start_reconciler(interval: int = RECONCILE_INTERVAL) -> Optional[threading.Thread]:
+    # Background thread re-syncing every registered bucket every `interval` seconds
+    if interval <= 0:
+        return None
+
+    def run() -> None:
+        while True:
+            reconcile_all(interval)
+            time.sleep(interval)
+    thread = threading.Thread(target=run, name='catalog-reconciler', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,228 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from database.db_handler import jobs
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+# Fields never handed back to clients
+SUMMARY_PROJECTION = {'_id': 0, 'secrets': 0, 'host': 0, 'worker': 0, 'lease_until': 0}
+
+
+def create_job(
+    kind: str,
+    public_id: str,
+    providers: List[str],
+    params: Dict[str, Any],
+    max_attempts: int,
+    secrets: Optional[Dict[str, Any]] = None,
+    host: Optional[str] = None) -> Dict[str, Any]:
+    # providers are the cloud types the job talks to, for the concurrency limits.
+    # secrets, e.g. the credentials of a copy destination, are dropped once the job ends.
+    # host pins the job to the workers of one host, e.g. for a file spooled there.
+    now = datetime.utcnow()
+    job = {
+        "job_id": str(uuid4()),
+        "kind": kind,
+        "public_id": public_id,
+        "providers": providers,
+        "params": params,
+        "secrets": secrets or {},
+        "status": QUEUED,
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "progress": {},
+        "result": None,
+        "error": None,
+        "host": host,
+        "worker": None,
+        "lease_until": None,
+        "run_after": now,
+        "created_at": now,
+        "updated_at": now
+    }
+    jobs.insert_one(job)
+    return job
+
+
+def get_job(job_id: str, public_id: str) -> Optional[Dict[str, Any]]:
+    return jobs.find_one({"job_id": job_id, "public_id": public_id}, SUMMARY_PROJECTION)
+
+
+def list_jobs(public_id: str, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    query = {"public_id": public_id}
+    if status:
+        query['status'] = status
+    return list(jobs.find(query, SUMMARY_PROJECTION).sort('created_at', DESCENDING).limit(limit))
+
+
+def running_counts() -> Tuple[Dict[str, int], Dict[str, int]]:
+    # Running jobs per user and per provider, over every worker process
+    now = datetime.utcnow()
+    running = {'status': RUNNING, 'lease_until': {'$gte': now}}
+    per_user = {
+        doc['_id']: doc['count'] for doc in jobs.aggregate([
+            {'$match': running},
+            {'$group': {'_id': '$public_id', 'count': {'$sum': 1}}}
+        ])
+    }
+    per_provider = {
+        doc['_id']: doc['count'] for doc in jobs.aggregate([
+            {'$match': running},
+            {'$unwind': '$providers'},
+            {'$group': {'_id': '$providers', 'count': {'$sum': 1}}}
+        ])
+    }
+    return per_user, per_provider
+
+
+def claim_next(
+    worker: str,
+    lease_seconds: int,
+    busy_users: List[str],
+    busy_providers: List[str],
+    kinds: List[str],
+    host: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    # Atomically moves the oldest runnable job to running for this worker,
+    # skipping users and providers already at their limit and jobs pinned
+    # to another host (None matches the jobs without a host as well)
+    now = datetime.utcnow()
+    query: Dict[str, Any] = {
+        'status': QUEUED, 'run_after': {'$lte': now}, 'kind': {'$in': kinds}, 'host': {'$in': [None, host]}}
+    if busy_users:
+        query['public_id'] = {'$nin': busy_users}
+    if busy_providers:
+        query['providers'] = {'$nin': busy_providers}
+    return jobs.find_one_and_update(
+        query,
+        {
+            '$set': {
+                'status': RUNNING,
+                'worker': worker,
+                'lease_until': now + timedelta(seconds=lease_seconds),
+                'started_at': now,
+                'updated_at': now
+            },
+            '$inc': {'attempts': 1}
+        },
+        sort=[('run_after', ASCENDING)],
+        projection={'_id': 0},
+        return_document=ReturnDocument.AFTER)
+
+
+def renew_leases(worker: str, job_ids: List[str], lease_seconds: int) -> None:
+    if job_ids:
+        jobs.update_many(
+            {'job_id': {'$in': job_ids}, 'worker': worker, 'status': RUNNING},
+            {'$set': {'lease_until': datetime.utcnow() + timedelta(seconds=lease_seconds)}})
+
+
+def report_progress(job_id: str, worker: str, progress: Dict[str, Any]) -> None:
+    jobs.update_one(
+        {'job_id': job_id, 'worker': worker, 'status': RUNNING},
+        {'$set': {'progress': progress, 'updated_at': datetime.utcnow()}})
+
+
+def _running_filter(job_id: str, worker: str) -> Dict[str, Any]:
+    # Only the worker holding the job may end it, a job whose lease
+    # expired may already run elsewhere
+    return {'job_id': job_id, 'worker': worker, 'status': RUNNING}
+
+
+def succeed_job(job_id: str, worker: str, result: Optional[Dict[str, Any]]) -> None:
+    now = datetime.utcnow()
+    jobs.update_one(
+        _running_filter(job_id, worker),
+        {
+            '$set': {
+                'status': SUCCEEDED,
+                'result': result,
+                'error': None,
+                'lease_until': None,
+                'finished_at': now,
+                'updated_at': now
+            },
+            '$unset': {'secrets': ''}
+        })
+
+
+def fail_job(job_id: str, worker: str, error: str, retry_in: Optional[float] = None) -> None:
+    # Queues the job again after retry_in seconds, fails it for good without
+    now = datetime.utcnow()
+    if retry_in is not None:
+        update = {'$set': {
+            'status': QUEUED,
+            'error': error,
+            'worker': None,
+            'lease_until': None,
+            'run_after': now + timedelta(seconds=retry_in),
+            'updated_at': now
+        }}
+    else:
+        update = {
+            '$set': {
+                'status': FAILED,
+                'error': error,
+                'lease_until': None,
+                'finished_at': now,
+                'updated_at': now
+            },
+            '$unset': {'secrets': ''}
+        }
+    jobs.update_one(_running_filter(job_id, worker), update)
+
+
+def recover_expired() -> Tuple[int, List[Dict[str, Any]]]:
+    # Jobs of workers which stopped renewing their lease, e.g. a crashed
+    # process, are queued again while they have attempts left.
+    # Returns the count of jobs queued again and the jobs failed for good.
+    now = datetime.utcnow()
+    expired = {'status': RUNNING, 'lease_until': {'$lt': now}}
+    requeued = jobs.update_many(
+        {**expired, '$expr': {'$lt': ['$attempts', '$max_attempts']}},
+        {'$set': {
+            'status': QUEUED,
+            'error': 'The worker running the job stopped.',
+            'worker': None,
+            'lease_until': None,
+            'run_after': now,
+            'updated_at': now
+        }})
+    # one at a time, so that only the process failing a job cleans up after it
+    failed = []
+    for job in jobs.find(expired, {'_id': 0, 'job_id': 1, 'kind': 1, 'params': 1}):
+        result = jobs.update_one(
+            {**expired, 'job_id': job.get('job_id')},
+            {
+                '$set': {
+                    'status': FAILED,
+                    'error': 'The worker running the job stopped, no attempts left.',
+                    'lease_until': None,
+                    'finished_at': now,
+                    'updated_at': now
+                },
+                '$unset': {'secrets': ''}
+            })
+        if result.modified_count:
+            failed.append(job)
+    return requeued.modified_count, failed
+
+
+def job_summary(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'job_id': job.get('job_id'),
+        'kind': job.get('kind'),
+        'status': job.get('status'),
+        'attempts': job.get('attempts'),
+        'max_attempts': job.get('max_attempts'),
+        'params': job.get('params'),
+        'progress': job.get('progress'),
+        'result': job.get('result'),
+        'error': job.get('error'),
+        'created_at': job.get('created_at'),
+        'started_at': job.get('started_at'),
+        'finished_at': job.get('finished_at')
+    }
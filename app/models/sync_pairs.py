@@ -0,0 +1,169 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from cloud_providers.mirror import MirrorState
+from database.db_handler import sync_manifest, sync_pairs
+
+RUNNING = 'running'
+COMPLETED = 'completed'
+# the run ended, some blobs failed to copy or delete
+FAILED = 'failed'
+# the run stopped early, the next one resumes after the checkpoint
+INTERRUPTED = 'interrupted'
+# Seconds a running sync holds its pair without reporting progress,
+# after that it is taken to be dead and the pair can be claimed again
+SYNC_LEASE_SECONDS = int(os.getenv('SYNC_LEASE_SECONDS', 300))
+
+
+def make_pair_id(
+    public_id: str,
+    source: Dict[str, str],
+    destination: Dict[str, str],
+    prefix: str,
+    target_prefix: str) -> str:
+    # The same source, destination and prefixes always map to the same pair
+    key = '\n'.join([
+        public_id,
+        source.get('cloud_provider'), source.get('bucket_name'),
+        destination.get('cloud_provider'), destination.get('bucket_name'),
+        prefix, target_prefix])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+def claim_pair(
+    pair_id: str,
+    public_id: str,
+    definition: Dict[str, Any],
+    job_id: str) -> Optional[Dict[str, Any]]:
+    # Marks the pair running for the job, None while another run holds it.
+    # A job retried after its worker died takes its pair back at once.
+    # The returned pair still has the checkpoint of an interrupted run.
+    now = datetime.utcnow()
+    try:
+        return sync_pairs.find_one_and_update(
+            {
+                'pair_id': pair_id,
+                '$or': [
+                    {'status': {'$ne': RUNNING}},
+                    {'lease_until': {'$lt': now}},
+                    {'job_id': job_id}
+                ]
+            },
+            {
+                '$set': {
+                    **definition,
+                    'public_id': public_id,
+                    'job_id': job_id,
+                    'status': RUNNING,
+                    'message': None,
+                    'lease_until': now + timedelta(seconds=SYNC_LEASE_SECONDS),
+                    'started_at': now,
+                    'updated_at': now
+                },
+                '$setOnInsert': {'checkpoint': None, 'created_at': now}
+            },
+            projection={'_id': 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER)
+    except DuplicateKeyError:
+        return None
+
+
+def is_running(pair: Optional[Dict[str, Any]]) -> bool:
+    return bool(pair) and pair.get('status') == RUNNING and (pair.get('lease_until') or datetime.min) > datetime.utcnow()
+
+
+def get_pair(pair_id: str, public_id: str) -> Optional[Dict[str, Any]]:
+    return sync_pairs.find_one(
+        {"pair_id": pair_id, "public_id": public_id},
+        {'_id': 0})
+
+
+def report_progress(pair_id: str, progress: Dict[str, Any]) -> None:
+    # Every report also renews the lease of the run
+    now = datetime.utcnow()
+    sync_pairs.update_one(
+        {"pair_id": pair_id, "status": RUNNING},
+        {'$set': {
+            'progress': progress,
+            'lease_until': now + timedelta(seconds=SYNC_LEASE_SECONDS),
+            'updated_at': now
+        }})
+
+
+def finish_pair(pair_id: str, status: str, progress: Dict[str, Any], message: Optional[str] = None) -> None:
+    # Only an interrupted run keeps its checkpoint
+    now = datetime.utcnow()
+    fields = {
+        'status': status,
+        'progress': progress,
+        'message': message,
+        'lease_until': None,
+        'updated_at': now
+    }
+    if status != INTERRUPTED:
+        fields['checkpoint'] = None
+        fields['finished_at'] = now
+    sync_pairs.update_one({"pair_id": pair_id}, {'$set': fields})
+
+
+def pair_summary(pair: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'pair_id': pair.get('pair_id'),
+        'job_id': pair.get('job_id'),
+        'status': pair.get('status'),
+        'message': pair.get('message'),
+        'source': pair.get('source'),
+        'destination': pair.get('destination'),
+        'prefix': pair.get('prefix'),
+        'target_prefix': pair.get('target_prefix'),
+        'delete_extras': pair.get('delete_extras'),
+        'checkpoint': pair.get('checkpoint'),
+        'progress': pair.get('progress'),
+        'started_at': pair.get('started_at'),
+        'finished_at': pair.get('finished_at')
+    }
+
+
+class MongoMirrorState(MirrorState):
+    """Mirror state of a sync pair, its manifest in sync_manifest"""
+    def __init__(self, pair_id: str) -> None:
+        self.pair_id = pair_id
+
+    def entries(self, names: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not names:
+            return {}
+        return {
+            entry['filename']: entry
+            for entry in sync_manifest.find(
+                {'pair_id': self.pair_id, 'filename': {'$in': names}},
+                {'_id': 0, 'pair_id': 0})
+        }
+
+    def record(self, entries: List[Dict[str, Any]]) -> None:
+        now = datetime.utcnow()
+        sync_manifest.bulk_write([
+            UpdateOne(
+                {'pair_id': self.pair_id, 'filename': entry.get('filename')},
+                {'$set': {**entry, 'synced_at': now}},
+                upsert=True)
+            for entry in entries
+        ], ordered=False)
+
+    def forget(self, names: List[str]) -> None:
+        if names:
+            sync_manifest.delete_many({'pair_id': self.pair_id, 'filename': {'$in': names}})
+
+    def checkpoint(self, name: str, progress: Dict[str, Any]) -> None:
+        now = datetime.utcnow()
+        sync_pairs.update_one(
+            {'pair_id': self.pair_id, 'status': RUNNING},
+            {'$set': {
+                'checkpoint': name,
+                'progress': progress,
+                'lease_until': now + timedelta(seconds=SYNC_LEASE_SECONDS),
+                'updated_at': now
+            }})
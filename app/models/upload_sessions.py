@@ -0,0 +1,76 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+from database.db_handler import upload_sessions
+
+ACTIVE = 'active'
+COMPLETED = 'completed'
+ABORTED = 'aborted'
+
+
+def create_session(
+    public_id: str,
+    cloud_provider: str,
+    bucket_name: str,
+    blob_name: str,
+    upload_id: str,
+    content_type: Optional[str]) -> Dict[str, Any]:
+    now = datetime.utcnow()
+    session = {
+        "session_id": str(uuid4()),
+        "public_id": public_id,
+        "cloud_provider": cloud_provider,
+        "bucket_name": bucket_name,
+        "blob_name": blob_name,
+        "upload_id": upload_id,
+        "content_type": content_type,
+        "status": ACTIVE,
+        # parts are keyed by part number: {"1": {"tag": ..., "size": ...}}
+        "parts": {},
+        "created_at": now,
+        "updated_at": now
+    }
+    upload_sessions.insert_one(session)
+    return session
+
+
+def get_session(session_id: str, public_id: str) -> Optional[Dict[str, Any]]:
+    return upload_sessions.find_one(
+        {"session_id": session_id, "public_id": public_id},
+        {'_id': 0})
+
+
+def record_part(session_id: str, part_number: int, tag: str, size: int) -> None:
+    # Re-uploading a part simply overwrites its previous record
+    upload_sessions.update_one(
+        {"session_id": session_id, "status": ACTIVE},
+        {'$set': {
+            f'parts.{part_number}': {'tag': tag, 'size': size},
+            'updated_at': datetime.utcnow()
+        }})
+
+
+def set_session_status(session_id: str, status: str) -> None:
+    upload_sessions.update_one(
+        {"session_id": session_id},
+        {'$set': {'status': status, 'updated_at': datetime.utcnow()}})
+
+
+def session_parts(session: Dict[str, Any]) -> List[Tuple[int, str]]:
+    return sorted(
+        (int(part_number), part.get('tag'))
+        for part_number, part in session.get('parts', {}).items())
+
+
+def session_summary(session: Dict[str, Any]) -> Dict[str, Any]:
+    parts = session.get('parts', {})
+    return {
+        'session_id': session.get('session_id'),
+        'filename': session.get('blob_name'),
+        'status': session.get('status'),
+        'parts': [
+            {'part_number': part_number, 'size': parts[str(part_number)].get('size')}
+            for part_number in sorted(int(n) for n in parts)
+        ],
+        'uploaded_bytes': sum(part.get('size', 0) for part in parts.values())
+    }
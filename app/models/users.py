@@ -1,17 +1,70 @@
-from typing import Any, Dict
+import os
+import threading
+from typing import Any, Dict, Optional
+from cachetools import TTLCache
+from pymongo.errors import DuplicateKeyError
 from cloud_providers.platforms import CloudProviderType
 from database.db_handler import users
 
+# In process cache of user documents keyed by public_id.
+# Every worker keeps its own copy, the TTL bounds how stale one can get.
+_user_cache: TTLCache = TTLCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('USER_CACHE_TTL', 60))
+)
+_user_cache_lock = threading.Lock()
+
+# Projections, so the password hash is only read by login
+USER_PROJECTION = {'password': 0}
+LOGIN_PROJECTION = {'_id': 0, 'public_id': 1, 'password': 1}
+
+
+def get_user(public_id: str) -> Optional[Dict[str, Any]]:
+    # Returns the cached user document, hits MongoDB only on a miss
+    if not public_id:
+        return None
+    with _user_cache_lock:
+        user = _user_cache.get(public_id)
+    if user is not None:
+        return user
+    user = users.find_one({"public_id": public_id}, USER_PROJECTION)
+    if user:
+        with _user_cache_lock:
+            _user_cache[public_id] = user
+    return user
+
+
+def invalidate_user(public_id: str) -> None:
+    with _user_cache_lock:
+        _user_cache.pop(public_id, None)
+
+
+def get_login_user(email: str, cloud_provider: str) -> Optional[Dict[str, Any]]:
+    return users.find_one(
+        {"email": email, "cloud_provider": cloud_provider},
+        LOGIN_PROJECTION)
+
+
+def user_exists(email: str, cloud_provider: str) -> bool:
+    return users.find_one(
+        {"email": email, "cloud_provider": cloud_provider},
+        {'_id': 1}) is not None
+
+
 def create_user(public_id: str, name: str, email: str, password: str, cloud_provider: str):
-    user_id = users.insert_one(
-        {
-            "public_id": public_id,
-            "name": name,
-            "email": email,
-            "password": password,
-            "cloud_provider": cloud_provider
-        }
-    ).inserted_id
+    try:
+        user_id = users.insert_one(
+            {
+                "public_id": public_id,
+                "name": name,
+                "email": email,
+                "password": password,
+                "cloud_provider": cloud_provider
+            }
+        ).inserted_id
+    except DuplicateKeyError:
+        # A concurrent signup already created this user
+        return None
     return user_id
 
 
@@ -21,6 +74,7 @@ def set_azure_cloud_details(
     bucket_name: str
     ) -> Dict[str, Any]:
     cloud_info = users.update_one(filter={"public_id": public_id,'cloud_provider':'az'}, update={'$set': {'connection_string':az_connection_string,'bucket_name':bucket_name}})
+    invalidate_user(public_id)
     return cloud_info.raw_result
 
 
@@ -30,4 +84,13 @@ def set_aws_cloud_details(
     secret_access_key: str,
     bucket_name: str) -> Dict[str,Any]:
     cloud_info = users.update_one(filter={"public_id": public_id,'cloud_provider':'aws'}, update={'$set': {'access_key':access_key_id,'secret_access_key':secret_access_key, 'bucket_name':bucket_name}})
+    invalidate_user(public_id)
     return cloud_info.raw_result
+
+
+def set_upload_codec(public_id: str, codec: Optional[str]) -> Dict[str, Any]:
+    # Codec the user's uploads are compressed with, None goes back to the default
+    update = {'$set': {'upload_codec': codec}} if codec else {'$unset': {'upload_codec': ''}}
+    result = users.update_one({"public_id": public_id}, update)
+    invalidate_user(public_id)
+    return result.raw_result
@@ -0,0 +1,197 @@
+"""
+Handlers of the background jobs, see job_queue. Started as a script it
+runs a worker process on its own, next to (or instead of) the workers
+of the app processes:
+
+    JOB_WORKERS_IN_APP=false gunicorn wsgi:app ... & python tasks.py
+"""
+import logging
+import os
+import shutil
+from typing import Any, BinaryIO, Dict, Iterable, Optional, Tuple
+from uuid import uuid4
+from werkzeug.datastructures import FileStorage
+from cloud_providers.disk_cache import download_cache
+from cloud_providers.migrate import BlobCopier, CopyProgress
+from cloud_providers.mirror import BucketMirror, MirrorProgress
+from cloud_providers.platforms import (
+    AWSConnectionError,
+    AzureConnectionError,
+    RequriedParameterMissing,
+    StorageAction)
+from cloud_providers.services import get_storage_provider, get_service_provider_client
+from database.db_handler import ensure_indexes
+from job_queue import JobContext, JobError, WorkerPool, handler
+from models import blob_catalog, sync_pairs
+from models.users import get_user
+
+# Uploads are written here by the app and read back by the upload job,
+# separate worker processes need the same directory
+JOB_SPOOL_DIR = os.getenv('JOB_SPOOL_DIR', '/tmp/job-spool')
+# Names per delete call and progress report of a delete job
+DELETE_JOB_BATCH_SIZE = 1000
+# Form fields describing a copy or sync destination, as for /upload-public
+DESTINATION_FIELDS = ('provider', 'access_key', 'secret_access_key', 'connection_string', 'bucket_name')
+
+
+def destination_details(form: Any) -> Dict[str, str]:
+    return {key: form.get(key) for key in DESTINATION_FIELDS if form.get(key)}
+
+
+def connect(cloud_type: Optional[str], user_cloud: Dict[str, Any]) -> StorageAction:
+    try:
+        return get_service_provider_client(get_storage_provider(cloud_type, user_cloud)).provider
+    except (RequriedParameterMissing, AzureConnectionError, AWSConnectionError) as e:
+        raise JobError(str(e))
+
+
+def user_provider(public_id: str) -> StorageAction:
+    # Storage of the job's user, with the credentials stored now
+    user = get_user(public_id)
+    if not user or not user.get('cloud_provider'):
+        raise JobError('Cloud provider is not registered!')
+    return connect(user.get('cloud_provider'), user)
+
+
+def destination_provider(context: JobContext) -> StorageAction:
+    destination = context.secrets.get('destination') or {}
+    return connect(destination.get('provider'), destination)
+
+
+def spool_upload(stream: BinaryIO) -> str:
+    # Saves the stream of an uploaded file for the upload job, returns its path
+    os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(JOB_SPOOL_DIR, uuid4().hex)
+    with open(path, 'wb') as spool:
+        shutil.copyfileobj(stream, spool)
+    return path
+
+
+def discard_spool(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError as e:
+        logging.error('Removing spooled upload {} failed: {}'.format(path, e))
+
+
+def discard_upload_spool(params: Dict[str, Any]) -> None:
+    # The worker which died may have run on another host
+    path = params.get('spool_path')
+    if path and os.path.exists(path):
+        discard_spool(path)
+
+
+@handler('upload', cleanup=discard_upload_spool)
+def upload_file(context: JobContext) -> Dict[str, Any]:
+    params = context.params
+    path = params.get('spool_path')
+    if not os.path.exists(path):
+        raise JobError('The uploaded file is gone, was the job run on another host?')
+    try:
+        provider = user_provider(context.public_id)
+        with open(path, 'rb') as stream:
+            file = FileStorage(stream=stream, filename=params.get('filename'), content_type=params.get('content_type'))
+            if params.get('dedup'):
+                info, deduplicated = blob_catalog.upload_deduplicated(
+                    provider, file, context.public_id, params.get('codec'))
+            else:
+                info, deduplicated = provider.upload_blob(file, params.get('codec')), False
+                blob_catalog.record_blob(provider, info, context.public_id)
+    except Exception as e:
+        # the file is kept for the next attempt
+        if isinstance(e, JobError) or context.last_attempt:
+            discard_spool(path)
+        raise
+    discard_spool(path)
+    return {'filename': info.get('filename'), 'size': info.get('size'), 'deduplicated': deduplicated}
+
+
+@handler('delete_blobs')
+def delete_blobs(context: JobContext) -> Dict[str, Any]:
+    provider = user_provider(context.public_id)
+    filenames = context.params.get('filenames') or []
+    deleted, failed = [], []
+    for start in range(0, len(filenames), DELETE_JOB_BATCH_SIZE):
+        results = provider.delete_blobs(filenames[start:start + DELETE_JOB_BATCH_SIZE])
+        done = [name for name, ok in results.items() if ok]
+        blob_catalog.remove_blobs(provider, done)
+        if download_cache:
+            for name in done:
+                download_cache.discard(provider, name)
+        deleted.extend(done)
+        failed.extend(name for name, ok in results.items() if not ok)
+        context.report({'total': len(filenames), 'deleted': len(deleted), 'failed': len(failed)})
+    return {'deleted': deleted, 'failed': failed}
+
+
+@handler('copy')
+def copy_blobs(context: JobContext) -> Dict[str, Any]:
+    # A retry copies every blob again, the destination names stay the same
+    params = context.params
+    source = user_provider(context.public_id)
+    destination = destination_provider(context)
+    target_prefix = params.get('target_prefix') or ''
+    if params.get('filenames'):
+        names: Iterable[Tuple[str, str]] = [(name, target_prefix + name) for name in params.get('filenames')]
+    else:
+        # listed lazily, a large bucket is never held in memory
+        names = (
+            (item.get('filename'), target_prefix + item.get('filename'))
+            for item in source.iter_blobs(params.get('prefix') or None))
+
+    def record_copy(info: Dict[str, Any]) -> None:
+        blob_catalog.record_blob(
+            destination,
+            {key: value for key, value in info.items() if key not in ('source', 'server_side')},
+            context.public_id)
+
+    progress = CopyProgress(on_report=context.report)
+    with BlobCopier(source, destination, progress) as copier:
+        copier.copy_all(names, on_copied=record_copy)
+    summary = progress.snapshot()
+    if summary.get('objects_failed'):
+        raise JobError(f"{summary.get('objects_failed')} of {summary.get('objects_total')} copies failed!")
+    return summary
+
+
+@handler('sync')
+def sync_bucket(context: JobContext) -> Dict[str, Any]:
+    # A retry resumes after the checkpoint of the interrupted run
+    params = context.params
+    pair_id = params.get('pair_id')
+    source = user_provider(context.public_id)
+    destination = destination_provider(context)
+    pair = sync_pairs.claim_pair(pair_id, context.public_id, params.get('definition'), context.job_id)
+    if not pair:
+        raise JobError('This sync is already running!')
+
+    def report(snapshot: Dict[str, Any]) -> None:
+        sync_pairs.report_progress(pair_id, snapshot)
+        context.report(snapshot)
+
+    mirror = BucketMirror(
+        source,
+        destination,
+        sync_pairs.MongoMirrorState(pair_id),
+        prefix=pair.get('prefix'),
+        target_prefix=pair.get('target_prefix'),
+        delete_extras=pair.get('delete_extras'),
+        progress=MirrorProgress(on_report=report))
+    try:
+        mirror.run(pair.get('checkpoint'))
+    except Exception as e:
+        sync_pairs.finish_pair(pair_id, sync_pairs.INTERRUPTED, mirror.progress.snapshot(), str(e))
+        raise
+    summary = mirror.progress.snapshot()
+    failed = summary.get('objects_failed') + summary.get('deletes_failed')
+    if failed:
+        sync_pairs.finish_pair(pair_id, sync_pairs.FAILED, summary, f'{failed} blobs failed to sync!')
+        raise JobError(f'{failed} blobs failed to sync!')
+    sync_pairs.finish_pair(pair_id, sync_pairs.COMPLETED, summary)
+    return summary
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+    ensure_indexes()
+    WorkerPool().serve_forever()
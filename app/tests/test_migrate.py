@@ -0,0 +1,121 @@
+"""
+BlobCopier streaming an Azure source in several parts. The Azure client is
+replaced by a stand-in answering ranged downloads the way the SDK does:
+properties.size is the size of the range, content_range carries the size
+of the whole blob. Run from app/: python -m pytest tests
+"""
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+import pytest
+
+pytest.importorskip('azure.storage.blob')
+pytest.importorskip('cachetools')
+
+from cloud_providers.az_platform import AzureStorageServiceProvider
+from cloud_providers.migrate import BlobCopier
+from cloud_providers.platforms import FileDownloadError
+from cloud_providers.transfer import UploadConfig
+
+
+class FakeDownloader:
+    def __init__(self, data: bytes, offset: Optional[int], length: Optional[int]) -> None:
+        start = offset or 0
+        end = len(data) if length is None else min(start + length, len(data))
+        self.data = data[start:end]
+        self.size = len(self.data)
+        self.properties = SimpleNamespace(
+            size=len(self.data),
+            content_range=f'bytes {start}-{end - 1}/{len(data)}',
+            metadata={},
+            content_settings=SimpleNamespace(content_type='text/plain'))
+
+    def chunks(self):
+        yield self.data
+
+
+class FakeBlobClient:
+    def __init__(self, blobs: Dict[str, bytes], name: str) -> None:
+        self.blobs = blobs
+        self.name = name
+
+    def download_blob(self, offset: Optional[int] = None, length: Optional[int] = None) -> FakeDownloader:
+        return FakeDownloader(self.blobs[self.name], offset, length)
+
+    def get_blob_properties(self) -> Any:
+        return SimpleNamespace(
+            size=len(self.blobs[self.name]),
+            etag='"etag"',
+            content_settings=SimpleNamespace(content_type='text/plain'),
+            last_modified=None,
+            metadata={})
+
+
+class FakeServiceClient:
+    def __init__(self, blobs: Dict[str, bytes]) -> None:
+        self.blobs = blobs
+
+    def get_blob_client(self, container: str, blob: str) -> FakeBlobClient:
+        return FakeBlobClient(self.blobs, blob)
+
+
+class MemoryDestination:
+    """Multipart uploads kept in memory, parts of part_size bytes"""
+    cloud_type = 'memory'
+
+    def __init__(self, part_size: int) -> None:
+        self.upload_config = UploadConfig(part_size=part_size)
+        self.uploads: Dict[str, Dict[int, bytes]] = {}
+        self.blobs: Dict[str, bytes] = {}
+
+    def create_multipart_upload(self, name: str, content_type=None, codec=None) -> str:
+        self.uploads[name] = {}
+        return name
+
+    def upload_part(self, name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        self.uploads[upload_id][part_number] = data
+        return str(part_number)
+
+    def complete_multipart_upload(self, name: str, upload_id: str, parts, content_type=None, codec=None):
+        uploaded = self.uploads.pop(upload_id)
+        self.blobs[name] = b''.join(uploaded[part_number] for part_number, _ in sorted(parts))
+        return {'filename': name, 'parts': len(parts)}
+
+    def abort_multipart_upload(self, name: str, upload_id: str) -> None:
+        self.uploads.pop(upload_id, None)
+
+
+def azure_source(blobs: Dict[str, bytes]) -> AzureStorageServiceProvider:
+    source = AzureStorageServiceProvider('connection string', 'source')
+    source.clt = FakeServiceClient(blobs)
+    return source
+
+
+def test_copies_a_multi_part_azure_source():
+    data = bytes(range(256)) * 40
+    destination = MemoryDestination(part_size=1000)
+    with BlobCopier(azure_source({'blob': data}), destination) as copier:
+        info = copier.copy_blob('blob', 'copy')
+    assert info['parts'] == 11
+    assert info['server_side'] is False
+    assert destination.blobs['copy'] == data
+    assert copier.progress.bytes_copied == len(data)
+
+
+def test_ranged_azure_stream_reports_the_blob_size():
+    source = azure_source({'blob': b'x' * 2500})
+    blob_stream = source.open_stream('blob', 1000, 1000)
+    assert blob_stream.content_length == 1000
+    assert blob_stream.total_length == 2500
+
+
+def test_blob_growing_during_the_copy_fails():
+    blobs = {'blob': b'x' * 2500}
+    source = azure_source(blobs)
+    destination = MemoryDestination(part_size=1000)
+    props = source.get_blob_properties('blob')
+    blobs['blob'] += b'y'
+    with BlobCopier(source, destination) as copier:
+        with pytest.raises(FileDownloadError):
+            copier._stream_blob('blob', 'copy', props, props['size'])
+    assert destination.uploads == {}
+    assert 'copy' not in destination.blobs
@@ -0,0 +1,156 @@
+"""
+BucketMirror between two in-memory buckets of different clouds, so their
+ETags never match and unchanged blobs are only found through the state.
+Run from app/: python -m pytest tests
+"""
+import hashlib
+from typing import Any, Dict, List, Optional
+import pytest
+
+from cloud_providers.mirror import BucketMirror, MirrorState
+from cloud_providers.platforms import BlobStream
+from cloud_providers.transfer import UploadConfig
+
+
+class MemoryBucket:
+    """Listing, ranged reads, multipart writes and deletes over a dict"""
+    def __init__(self, cloud_type: str, blobs: Optional[Dict[str, bytes]] = None) -> None:
+        self.cloud_type = cloud_type
+        self.blobs = dict(blobs or {})
+        self.upload_config = UploadConfig(part_size=4)
+        self.uploads: Dict[str, Dict[int, bytes]] = {}
+        self.listed_after: List[Optional[str]] = []
+
+    def storage_location(self) -> str:
+        return self.cloud_type
+
+    def item(self, name: str) -> Dict[str, Any]:
+        digest = hashlib.md5(self.blobs[name]).hexdigest()
+        return {'filename': name, 'size': len(self.blobs[name]), 'etag': f'"{self.cloud_type}-{digest}"'}
+
+    def iter_blobs(self, prefix: Optional[str] = None, start_after: Optional[str] = None):
+        self.listed_after.append(start_after)
+        for name in sorted(self.blobs):
+            if name.startswith(prefix or '') and (start_after is None or name > start_after):
+                yield self.item(name)
+
+    def get_blob_properties(self, name: str) -> Dict[str, Any]:
+        return {**self.item(name), 'content_type': None, 'codec': None}
+
+    def open_stream(self, name: str, offset: int = 0, length: Optional[int] = None) -> BlobStream:
+        data = self.blobs[name]
+        part = data[offset:] if length is None else data[offset:offset + length]
+        return BlobStream(iter([part]), content_length=len(part), offset=offset, total_length=len(data))
+
+    def copy_blob_from(self, source: Any, name: str, target_name: str, props: Dict[str, Any]) -> None:
+        return None
+
+    def create_multipart_upload(self, name: str, content_type=None, codec=None) -> str:
+        self.uploads[name] = {}
+        return name
+
+    def upload_part(self, name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        self.uploads[upload_id][part_number] = data
+        return str(part_number)
+
+    def complete_multipart_upload(self, name: str, upload_id: str, parts, content_type=None, codec=None):
+        uploaded = self.uploads.pop(upload_id)
+        self.blobs[name] = b''.join(uploaded[part_number] for part_number, _ in sorted(parts))
+        return {'filename': name, 'etag': self.item(name).get('etag')}
+
+    def abort_multipart_upload(self, name: str, upload_id: str) -> None:
+        self.uploads.pop(upload_id, None)
+
+    def delete_blobs(self, names: List[str]) -> Dict[str, bool]:
+        for name in names:
+            del self.blobs[name]
+        return {name: True for name in names}
+
+
+class MemoryState(MirrorState):
+    def __init__(self) -> None:
+        self.manifest: Dict[str, Dict[str, Any]] = {}
+        self.checkpoints: List[str] = []
+
+    def entries(self, names: List[str]) -> Dict[str, Dict[str, Any]]:
+        return {name: self.manifest[name] for name in names if name in self.manifest}
+
+    def record(self, entries: List[Dict[str, Any]]) -> None:
+        self.manifest.update({entry['filename']: entry for entry in entries})
+
+    def forget(self, names: List[str]) -> None:
+        for name in names:
+            self.manifest.pop(name, None)
+
+    def checkpoint(self, name: str, progress: Dict[str, Any]) -> None:
+        self.checkpoints.append(name)
+
+
+def mirror(source: MemoryBucket, destination: MemoryBucket, state: MemoryState, **kwargs: Any) -> Dict[str, Any]:
+    start_after = kwargs.pop('start_after', None)
+    kwargs.setdefault('target_prefix', 'm/')
+    return BucketMirror(source, destination, state, **kwargs).run(start_after).snapshot()
+
+
+def mirrored(destination: MemoryBucket, target_prefix: str = 'm/') -> Dict[str, bytes]:
+    return {name[len(target_prefix):]: data for name, data in destination.blobs.items()}
+
+
+def test_copies_new_and_resized_blobs():
+    source = MemoryBucket('aws', {'a': b'new blob', 'b': b'resized'})
+    destination = MemoryBucket('az', {'m/b': b'old'})
+    state = MemoryState()
+    progress = mirror(source, destination, state)
+    assert mirrored(destination) == source.blobs
+    assert progress['objects_copied'] == 2
+    assert progress['objects_unchanged'] == 0
+    assert set(state.manifest) == {'a', 'b'}
+
+
+def test_skips_blobs_unchanged_since_they_were_copied():
+    source = MemoryBucket('aws', {'a': b'aaaa', 'b': b'bbbb'})
+    destination = MemoryBucket('az')
+    state = MemoryState()
+    mirror(source, destination, state)
+    progress = mirror(source, destination, state)
+    assert progress['objects_copied'] == 0
+    assert progress['objects_unchanged'] == 2
+    # same size, other content: the source ETag no longer matches the state
+    source.blobs['a'] = b'AAAA'
+    progress = mirror(source, destination, state)
+    assert progress['objects_copied'] == 1
+    assert mirrored(destination) == source.blobs
+
+
+def test_recopies_a_blob_resized_on_the_destination():
+    source = MemoryBucket('aws', {'a': b'aaaa'})
+    destination = MemoryBucket('az')
+    state = MemoryState()
+    mirror(source, destination, state)
+    destination.blobs['m/a'] = b'tampered'
+    progress = mirror(source, destination, state)
+    assert progress['objects_copied'] == 1
+    assert destination.blobs['m/a'] == b'aaaa'
+
+
+@pytest.mark.parametrize('delete_extras', [False, True])
+def test_destination_only_blobs_are_deleted_on_request(delete_extras):
+    source = MemoryBucket('aws', {'a': b'aaaa'})
+    destination = MemoryBucket('az', {'m/extra': b'only here'})
+    state = MemoryState()
+    progress = mirror(source, destination, state, delete_extras=delete_extras)
+    assert ('m/extra' in destination.blobs) is not delete_extras
+    assert progress['objects_deleted'] == (1 if delete_extras else 0)
+    assert progress['objects_scanned'] == 2
+
+
+def test_resumes_after_the_checkpoint():
+    source = MemoryBucket('aws', {name: name.encode() * 3 for name in 'abcde'})
+    destination = MemoryBucket('az', {'m/z': b'extra'})
+    state = MemoryState()
+    progress = mirror(source, destination, state, batch_size=2, start_after='b', delete_extras=True)
+    assert source.listed_after == ['b']
+    assert destination.listed_after == ['m/b']
+    assert sorted(destination.blobs) == ['m/c', 'm/d', 'm/e']
+    assert progress['objects_scanned'] == 4
+    assert state.checkpoints == ['d', 'z']
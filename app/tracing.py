@@ -0,0 +1,308 @@
+"""
+Request tracing:
+Spans time the phases of a request, i.e. the token check, MongoDB commands,
+the client pool and every StorageAction call. Every response carries a
+Server-Timing header summing them up, a sampled fraction of the traces is
+exported as Zipkin v2 JSON and an opt-in sampling profiler records the
+folded stacks (flame graph input) of a fraction of the requests.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import requests
+from cloud_providers.hooks import add_call_hook, add_phase_hook
+from database.db_handler import command_observers
+
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+# Fraction of the traces exported to TRACE_EXPORT_FILE and/or TRACE_EXPORT_URL
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+# JSON lines file, one Zipkin v2 span list per request
+TRACE_EXPORT_FILE = os.getenv('TRACE_EXPORT_FILE')
+# Zipkin compatible collector, e.g. http://zipkin:9411/api/v2/spans
+TRACE_EXPORT_URL = os.getenv('TRACE_EXPORT_URL')
+TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'cloud-agnostic-api')
+# Spans kept per trace for the export, Server-Timing still sums all of them
+TRACE_MAX_SPANS = 1000
+# Fraction of the requests profiled, 0 turns the profiler off
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/profiles')
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+# Server-Timing metric names are HTTP tokens
+SERVER_TIMING_UNSAFE = re.compile(r"[^!#$%&'*+\-.^_`|~0-9A-Za-z]")
+
+
+class Span:
+    """One timed phase of a request"""
+    __slots__ = ('name', 'span_id', 'parent_id', 'started', 'duration', 'tags')
+
+    def __init__(self, name: str, parent_id: Optional[str], started: float, tags: Dict[str, Any]) -> None:
+        self.name = name
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.started = started
+        self.duration = 0.0
+        self.tags = tags
+
+
+class Trace:
+    """Spans of one request, the root span covers the whole request"""
+    def __init__(self, name: str, sampled: bool, profiled: bool) -> None:
+        self.trace_id = '%032x' % random.getrandbits(128)
+        self.wall_started = time.time()
+        self.root = Span(name, None, time.perf_counter(), {})
+        self.spans: List[Span] = []
+        # name -> [seconds, calls], for Server-Timing
+        self.timings: Dict[str, List[float]] = {}
+        self.sampled = sampled
+        self.profiled = profiled
+        self.thread_id: Optional[int] = None
+        self.finished = False
+
+    def add(self, span: Span) -> None:
+        timing = self.timings.setdefault(span.name, [0.0, 0])
+        timing[0] += span.duration
+        timing[1] += 1
+        if self.sampled and len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append(span)
+
+    def server_timing(self) -> str:
+        # Sum per phase plus the time spent so far, in milliseconds
+        entries = []
+        for name, (seconds, calls) in self.timings.items():
+            entry = '{};dur={:.1f}'.format(SERVER_TIMING_UNSAFE.sub('_', name), seconds * 1000)
+            if calls > 1:
+                entry += ';desc="{} calls"'.format(int(calls))
+            entries.append(entry)
+        entries.append('total;dur={:.1f}'.format((time.perf_counter() - self.root.started) * 1000))
+        return ', '.join(entries)
+
+    def zipkin_spans(self) -> List[Dict[str, Any]]:
+        def encode(span: Span, kind: Optional[str] = None) -> Dict[str, Any]:
+            encoded = {
+                'traceId': self.trace_id,
+                'id': span.span_id,
+                'name': span.name,
+                'timestamp': int((self.wall_started + span.started - self.root.started) * 1e6),
+                'duration': max(int(span.duration * 1e6), 1),
+                'localEndpoint': {'serviceName': TRACE_SERVICE_NAME},
+                'tags': {key: str(value) for key, value in span.tags.items()}
+            }
+            if span.parent_id:
+                encoded['parentId'] = span.parent_id
+            if kind:
+                encoded['kind'] = kind
+            return encoded
+        return [encode(self.root, 'SERVER')] + [encode(span) for span in self.spans]
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+
+@contextmanager
+def span(name: str, **tags: Any) -> Iterator[Optional[Span]]:
+    # Times the block as a child of the current span, a no-op outside of a trace
+    trace = _current_trace.get()
+    if trace is None or trace.finished:
+        yield None
+        return
+    parent = _current_span.get() or trace.root
+    current = Span(name, parent.span_id, time.perf_counter(), tags)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.tags['error'] = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.started
+        _current_span.reset(token)
+        trace.add(current)
+
+
+def record_span(name: str, seconds: float, **tags: Any) -> None:
+    # Adds a phase which already ended, e.g. reported by the MongoDB driver
+    trace = _current_trace.get()
+    if trace is None or trace.finished:
+        return
+    parent = _current_span.get() or trace.root
+    finished = Span(name, parent.span_id, time.perf_counter() - seconds, tags)
+    finished.duration = seconds
+    trace.add(finished)
+
+
+class TraceExporter:
+    """Background thread writing the sampled traces, drops them when it falls behind"""
+    def __init__(self, path: Optional[str], url: Optional[str], maxsize: int = 1000) -> None:
+        self.path = path
+        self.url = url
+        self._queue: 'queue.Queue[List[Dict[str, Any]]]' = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, trace: Trace) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(trace.zipkin_spans())
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self) -> List[List[Dict[str, Any]]]:
+        batch = [self._queue.get()]
+        while len(batch) < 100:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._drain()
+            try:
+                if self.path:
+                    with open(self.path, 'a') as export_file:
+                        export_file.writelines(json.dumps(spans) + '\n' for spans in batch)
+                if self.url:
+                    requests.post(self.url, json=[encoded for spans in batch for encoded in spans], timeout=5)
+            except (OSError, requests.RequestException) as e:
+                logging.error('Trace export failed: {}'.format(e))
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the profiled request threads every interval seconds
+    and keeps them folded ("outer;inner count"), the input of flamegraph.pl
+    and speedscope. One shared thread samples all the profiled requests.
+    """
+    def __init__(self, interval: float = PROFILE_INTERVAL) -> None:
+        self.interval = interval
+        self._stacks: Dict[int, Counter] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, thread_id: int) -> None:
+        with self._lock:
+            self._stacks[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id: int) -> Counter:
+        with self._lock:
+            return self._stacks.pop(thread_id, Counter())
+
+    @staticmethod
+    def _fold(frame: Any) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._stacks:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks in self._stacks.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[self._fold(frame)] += 1
+
+
+exporter = TraceExporter(TRACE_EXPORT_FILE, TRACE_EXPORT_URL) if TRACE_EXPORT_FILE or TRACE_EXPORT_URL else None
+profiler = SamplingProfiler() if PROFILE_SAMPLE_RATE > 0 else None
+
+
+def start_trace(name: str, profile: bool = False) -> Optional[Trace]:
+    # Starts the trace of the request served by the calling thread or task.
+    # profile=True lets the thread be picked by the sampling profiler.
+    if not TRACING_ENABLED:
+        return None
+    trace = Trace(
+        name,
+        sampled=exporter is not None and random.random() < TRACE_SAMPLE_RATE,
+        profiled=profile and profiler is not None and random.random() < PROFILE_SAMPLE_RATE)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    if trace.profiled:
+        trace.thread_id = threading.get_ident()
+        profiler.start(trace.thread_id)
+    return trace
+
+
+def _write_profile(trace: Trace, stacks: Counter) -> None:
+    if not stacks:
+        return
+    route = re.sub(r'[^0-9A-Za-z]+', '_', trace.root.name).strip('_')
+    path = os.path.join(
+        PROFILE_DIR,
+        '{}-{}-{}.folded'.format(datetime.utcnow().strftime('%Y%m%dT%H%M%S'), route, trace.trace_id))
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(path, 'w') as profile_file:
+            profile_file.writelines('{} {}\n'.format(stack, count) for stack, count in stacks.items())
+    except OSError as e:
+        logging.error('Writing profile {} failed: {}'.format(path, e))
+
+
+def finish_trace(trace: Optional[Trace], **tags: Any) -> None:
+    # Ends the request's trace, exports it when sampled
+    if trace is None or trace.finished:
+        return
+    trace.finished = True
+    trace.root.duration = time.perf_counter() - trace.root.started
+    trace.root.tags.update({key: value for key, value in tags.items() if value is not None})
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+        _current_span.set(None)
+    if trace.profiled:
+        _write_profile(trace, profiler.stop(trace.thread_id))
+    if trace.sampled:
+        exporter.submit(trace)
+
+
+def trace_headers(trace: Optional[Trace]) -> List[Tuple[str, str]]:
+    if trace is None:
+        return []
+    return [('Server-Timing', trace.server_timing()), ('X-Trace-Id', trace.trace_id)]
+
+
+def _trace_mongo_command(command: str, collection: str, seconds: float, failed: bool) -> None:
+    if failed:
+        record_span('mongo.' + command, seconds, collection=collection, error='failed')
+    else:
+        record_span('mongo.' + command, seconds, collection=collection)
+
+
+def _trace_provider_call(cloud_type: str, method: str) -> Any:
+    return span('{}.{}'.format(cloud_type, method))
+
+
+def install() -> None:
+    # Traces the provider calls, the request phases and MongoDB commands
+    if not TRACING_ENABLED:
+        return
+    add_call_hook(_trace_provider_call)
+    add_phase_hook(span)
+    if _trace_mongo_command not in command_observers:
+        command_observers.append(_trace_mongo_command)
@@ -0,0 +1,95 @@
+"""
+Compares two bench/run.py result files, rounds are matched on
+(provider, operation, size, concurrency):
+
+    python bench/compare.py bench/results/<baseline>.json bench/results/<candidate>.json
+
+Exits with 1 when throughput dropped, or p95 latency or peak RSS grew,
+by more than --threshold percent in any round.
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+Key = Tuple[str, str, int, int]
+
+
+def load(path: str) -> Tuple[Dict[str, Any], Dict[Key, Dict[str, Any]]]:
+    with open(path) as results_file:
+        report = json.load(results_file)
+    rounds = {
+        (result['provider'], result['operation'], result['size'], result['concurrency']): result
+        for result in report.get('results', [])
+    }
+    return report.get('meta', {}), rounds
+
+
+def change(before: Optional[float], after: Optional[float]) -> Optional[float]:
+    # Relative change in percent, None when either side is missing
+    if not before or after is None:
+        return None
+    return (after - before) / before * 100
+
+
+def metrics(result: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    return {
+        'throughput_rps': result.get('throughput_rps'),
+        'p95_ms': result.get('latency_ms', {}).get('p95'),
+        'peak_rss_bytes': result.get('peak_rss_bytes')
+    }
+
+
+def compare(
+    baseline: Dict[Key, Dict[str, Any]],
+    candidate: Dict[Key, Dict[str, Any]],
+    threshold: float) -> Tuple[List[str], List[str]]:
+    lines, regressions = [], []
+    for key in sorted(baseline.keys() & candidate.keys()):
+        before, after = metrics(baseline[key]), metrics(candidate[key])
+        changes = {name: change(before[name], after[name]) for name in before}
+        provider, operation, size, concurrency = key
+        label = f'{provider:4} {operation:12} {size:>10} c={concurrency:<3}'
+
+        def fmt(name: str) -> str:
+            value = changes[name]
+            return f'{value:+7.1f}%' if value is not None else '       -'
+        line = f"{label} throughput {fmt('throughput_rps')}  p95 {fmt('p95_ms')}  rss {fmt('peak_rss_bytes')}"
+        regressed = [
+            name for name, value in changes.items()
+            if value is not None and (value < -threshold if name == 'throughput_rps' else value > threshold)
+        ]
+        if regressed:
+            line += '  REGRESSION: ' + ', '.join(regressed)
+            regressions.append(line)
+        lines.append(line)
+        if candidate[key].get('errors'):
+            lines.append(f"{label} {candidate[key]['errors']} failed requests")
+    for key in sorted(baseline.keys() - candidate.keys()):
+        lines.append(f'{key} missing from the candidate run')
+    return lines, regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed change in percent')
+    args = parser.parse_args(argv)
+    baseline_meta, baseline = load(args.baseline)
+    candidate_meta, candidate = load(args.candidate)
+    print(f"baseline  {baseline_meta.get('commit')} {baseline_meta.get('label') or ''}")
+    print(f"candidate {candidate_meta.get('commit')} {candidate_meta.get('label') or ''}")
+    for field in ('platform', 'cpu_count', 'server', 'workers', 'threads', 'requests'):
+        if baseline_meta.get(field) != candidate_meta.get(field):
+            print(f'warning: {field} differs: {baseline_meta.get(field)} != {candidate_meta.get(field)}')
+    lines, regressions = compare(baseline, candidate, args.threshold)
+    print('\n'.join(lines))
+    if regressions:
+        print(f'{len(regressions)} rounds regressed by more than {args.threshold}%')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
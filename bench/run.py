@@ -0,0 +1,484 @@
+"""
+Benchmarks the API against local stand-ins for S3 (moto), Azure Blob Storage
+(Azurite) and MongoDB, started with bench/docker-compose.yml:
+
+    docker-compose -f bench/docker-compose.yml up -d
+    python bench/run.py --providers aws,az --sizes 4K,1M,16M --concurrency 1,8,32
+
+Every (provider, file size, concurrency) round drives /login, /upload, /all,
+/download, /view-public and /delete and records throughput, p50/p95/p99
+latency and the peak RSS of the server processes. Results are written to
+bench/results/<timestamp>-<commit>.json, compare two runs with bench/compare.py.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'app')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+# Stand-in endpoints, as published by bench/docker-compose.yml
+S3_ENDPOINT_URL = 'http://127.0.0.1:5001'
+MONGO_URI = 'mongodb://127.0.0.1:27018'
+# Azurite's fixed development account, documented by Microsoft
+AZURITE_CONNECTION_STRING = (
+    'DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;'
+    'AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;'
+    'BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;')
+BENCH_BUCKET = 'bench'
+BENCH_PASSWORD = 'bench-password'
+SIZE_UNITS = {'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+
+
+def parse_size(value: str) -> int:
+    # 512, 4K, 1M, 16MB, ...
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+def format_size(size: int) -> str:
+    for unit in ('G', 'M', 'K'):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f'{size // SIZE_UNITS[unit]}{unit}'
+    return str(size)
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    # Nearest rank percentile
+    if not sorted_values:
+        return None
+    return sorted_values[max(math.ceil(q / 100 * len(sorted_values)) - 1, 0)]
+
+
+def process_tree(pid: int) -> List[int]:
+    # pid and all of its descendants, e.g. the gunicorn master and workers
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                # the command name may contain spaces, fields follow the last ')'
+                ppid = int(stat.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def rss_bytes(pid: int) -> int:
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler:
+    """Samples the summed RSS of a process tree, keeps the peak per phase and overall"""
+    def __init__(self, pid: Optional[int], interval: float = 0.1) -> None:
+        self.pid = pid
+        self.interval = interval
+        self.enabled = pid is not None and os.path.isdir('/proc')
+        self.phase_peak = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+
+    def start(self) -> None:
+        if self.enabled:
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def sample(self) -> None:
+        rss = sum(rss_bytes(pid) for pid in process_tree(self.pid))
+        with self._lock:
+            self.phase_peak = max(self.phase_peak, rss)
+            self.peak = max(self.peak, rss)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def reset_phase(self) -> Optional[int]:
+        # Peak since the previous call, None when RSS is not measured
+        if not self.enabled:
+            return None
+        self.sample()
+        with self._lock:
+            peak, self.phase_peak = self.phase_peak, 0
+        return peak
+
+
+class Server:
+    """The app under test: gunicorn serving wsgi:app or uvicorn serving asgi:app"""
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.url = f'http://127.0.0.1:{args.port}'
+        self.process: Optional[subprocess.Popen] = None
+
+    def command(self) -> List[str]:
+        bind = f'127.0.0.1:{self.args.port}'
+        if self.args.server == 'uvicorn':
+            return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1',
+                    '--port', str(self.args.port), '--workers', str(self.args.workers),
+                    '--log-level', 'warning']
+        return [sys.executable, '-m', 'gunicorn', '--bind', bind, '--workers', str(self.args.workers),
+                '--threads', str(self.args.threads), '--worker-class', 'gthread', 'wsgi:app']
+
+    def start(self) -> None:
+        env = dict(
+            os.environ,
+            MONGO_URI=self.args.mongo_uri,
+            MONGO_DATABASE=self.args.database,
+            AWS_ENDPOINT_URL=self.args.s3_url,
+            CATALOG_RECONCILE_INTERVAL='0',
+            LOG_LEVEL='WARNING')
+        self.process = subprocess.Popen(self.command(), cwd=APP_DIR, env=env)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Server exited with code {self.process.returncode}')
+            try:
+                if requests.get(self.url + '/', timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError('Server did not come up within 60 seconds')
+
+    def stop(self) -> None:
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def create_buckets(providers: List[str], s3_url: str) -> None:
+    # The stand-ins start empty, the app expects the bucket to exist
+    if 'aws' in providers:
+        import boto3
+        s3 = boto3.client(
+            's3',
+            endpoint_url=s3_url,
+            aws_access_key_id='bench',
+            aws_secret_access_key='bench',
+            region_name='us-east-1')
+        try:
+            s3.create_bucket(Bucket=BENCH_BUCKET)
+        except s3.exceptions.BucketAlreadyOwnedByYou:
+            pass
+    if 'az' in providers:
+        from azure.core.exceptions import ResourceExistsError
+        from azure.storage.blob import BlobServiceClient
+        try:
+            BlobServiceClient.from_connection_string(AZURITE_CONNECTION_STRING).create_container(BENCH_BUCKET)
+        except ResourceExistsError:
+            pass
+
+
+def provider_credentials(provider: str) -> Dict[str, str]:
+    # Form fields of /add and /view-public
+    if provider == 'aws':
+        return {'access_key': 'bench', 'secret_access_key': 'bench', 'bucket_name': BENCH_BUCKET}
+    return {'connection_string': AZURITE_CONNECTION_STRING, 'bucket_name': BENCH_BUCKET}
+
+
+class Client:
+    """One requests session per worker thread, so connections are kept alive"""
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def post(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.session.post(self.url + path, timeout=300, **kwargs)
+
+    def get(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.session.get(self.url + path, timeout=300, **kwargs)
+
+
+def succeeded(response: requests.Response) -> bool:
+    # Some routes report errors in the JSON body with a 200 response
+    if response.status_code >= 400:
+        return False
+    if response.headers.get('Content-Type', '').startswith('application/json'):
+        try:
+            body = response.json()
+        except ValueError:
+            return False
+        if isinstance(body, dict) and isinstance(body.get('status'), int) and body['status'] >= 400:
+            return False
+    return True
+
+
+def run_phase(
+    calls: List[Callable[[], requests.Response]],
+    concurrency: int,
+    sampler: RssSampler,
+    bytes_per_call: int = 0,
+    check: Callable[[requests.Response], bool] = succeeded) -> Dict[str, Any]:
+    sampler.reset_phase()
+
+    def timed(call: Callable[[], requests.Response]) -> Optional[float]:
+        started = time.perf_counter()
+        try:
+            response = call()
+            ok = check(response)
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        return elapsed if ok else None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, calls))
+    seconds = time.perf_counter() - started
+    latencies = sorted(round(elapsed * 1000, 3) for elapsed in outcomes if elapsed is not None)
+    completed = len(latencies)
+    return {
+        'requests': len(calls),
+        'errors': len(calls) - completed,
+        'seconds': round(seconds, 4),
+        'throughput_rps': round(completed / seconds, 2) if seconds else None,
+        'throughput_mib_s': round(completed * bytes_per_call / seconds / (1024 * 1024), 2)
+        if bytes_per_call and seconds else None,
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'mean': round(sum(latencies) / completed, 3) if completed else None,
+            'max': latencies[-1] if latencies else None
+        },
+        'peak_rss_bytes': sampler.reset_phase()
+    }
+
+
+def register_user(client: Client, provider: str) -> Dict[str, str]:
+    # Signs up (once per database), logs in and registers the stand-in credentials
+    account = {'email': f'bench-{provider}@example.com', 'password': BENCH_PASSWORD, 'provider': provider}
+    client.post('/signup', data=dict(account, name=f'bench {provider}'))
+    response = client.post('/login', data=account)
+    response.raise_for_status()
+    token = response.json()['token']
+    response = client.post(
+        '/add',
+        data=dict(provider_credentials(provider), provider=provider),
+        headers={'x-access-token': token})
+    if not succeeded(response):
+        raise RuntimeError(f'Registering {provider} credentials failed: {response.text}')
+    return account
+
+
+def login(client: Client, account: Dict[str, str]) -> str:
+    response = client.post('/login', data=account)
+    response.raise_for_status()
+    return response.json()['token']
+
+
+def list_names(client: Client, token: str, extension: str) -> List[str]:
+    # Names of the objects uploaded in this round, found by their extension
+    names, next_token = [], None
+    while True:
+        data = {'source': 'cloud'}
+        if next_token:
+            data['continuation_token'] = next_token
+        body = client.post('/all', data=data, headers={'x-access-token': token}).json()
+        names.extend(
+            item.get('filename') for item in body.get('data') or []
+            if (item.get('filename') or '').endswith('.' + extension))
+        next_token = body.get('next_token')
+        if not next_token:
+            return names
+
+
+def run_round(
+    client: Client,
+    provider: str,
+    account: Dict[str, str],
+    size: int,
+    concurrency: int,
+    count: int,
+    sampler: RssSampler) -> List[Dict[str, Any]]:
+    results = []
+
+    def record(operation: str, result: Dict[str, Any]) -> None:
+        result.update(provider=provider, operation=operation, size=size, concurrency=concurrency)
+        results.append(result)
+        print_result(result)
+
+    record('login', run_phase([lambda: client.post('/login', data=account)] * count, concurrency, sampler))
+    token = login(client, account)
+    headers = {'x-access-token': token}
+    # a fresh extension per round tells this round's objects apart
+    extension = 'bench' + uuid4().hex[:8]
+    payload = os.urandom(size)
+
+    def upload() -> requests.Response:
+        return client.post('/upload', files={'file': (f'payload.{extension}', payload)}, headers=headers)
+    record('upload', run_phase([upload] * count, concurrency, sampler, bytes_per_call=size))
+    record('all', run_phase(
+        [lambda: client.post('/all', data={'source': 'cloud'}, headers=headers)] * count, concurrency, sampler))
+
+    names = list_names(client, token, extension)
+    if not names:
+        print(f'{provider}: no uploaded objects found, skipping download, view-public and delete', file=sys.stderr)
+        return results
+    targets = [names[i % len(names)] for i in range(count)]
+
+    def download(name: str) -> Callable[[], requests.Response]:
+        return lambda: client.get('/download', params={'filename': name}, headers=headers)
+    record('download', run_phase(
+        [download(name) for name in targets],
+        concurrency,
+        sampler,
+        bytes_per_call=size,
+        check=lambda response: succeeded(response) and len(response.content) == size))
+
+    credentials = dict(provider_credentials(provider), provider=provider)
+
+    def view_public(name: str) -> Callable[[], requests.Response]:
+        return lambda: client.post('/view-public', data=dict(credentials, filename=name))
+    record('view-public', run_phase([view_public(name) for name in targets], concurrency, sampler))
+
+    def delete(name: str) -> Callable[[], requests.Response]:
+        return lambda: client.post('/delete', data={'filename': name}, headers=headers)
+    record('delete', run_phase([delete(name) for name in names], concurrency, sampler))
+    return results
+
+
+def print_result(result: Dict[str, Any]) -> None:
+    latency = result['latency_ms']
+
+    def ms(value: Optional[float]) -> str:
+        return f'{value:9.1f}' if value is not None else '        -'
+    rss = result['peak_rss_bytes']
+    print(
+        f"{result['provider']:4} {result['operation']:12} {format_size(result['size']):>5} "
+        f"c={result['concurrency']:<3} {result['throughput_rps'] or 0:9.1f} req/s "
+        f"p50{ms(latency['p50'])} p95{ms(latency['p95'])} p99{ms(latency['p99'])} ms "
+        f"rss {rss / (1024 * 1024) if rss else 0:7.1f} MiB errors {result['errors']}",
+        flush=True)
+
+
+def git_revision() -> Dict[str, Any]:
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ['git', *args], cwd=BENCH_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    try:
+        return {'commit': git('rev-parse', '--short', 'HEAD'), 'dirty': bool(git('status', '--porcelain'))}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': 'unknown', 'dirty': None}
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--providers', default='aws,az', help='comma separated: aws, az')
+    parser.add_argument('--sizes', default='4K,1M,16M', help='file sizes, e.g. 4K,1M,16M')
+    parser.add_argument('--concurrency', default='1,8,32', help='concurrent clients per round')
+    parser.add_argument('--requests', type=int, default=100, help='requests per operation and round')
+    parser.add_argument('--server', choices=('gunicorn', 'uvicorn'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--url', help='benchmark an already running server instead of starting one')
+    parser.add_argument('--server-pid', type=int, help='with --url, the server pid used to measure RSS')
+    parser.add_argument('--s3-url', default=S3_ENDPOINT_URL)
+    parser.add_argument('--mongo-uri', default=MONGO_URI)
+    parser.add_argument('--database', default='cloud_users_bench')
+    parser.add_argument('--label', help='free text stored with the results, e.g. the change measured')
+    parser.add_argument('--output', help='results file, defaults to bench/results/<timestamp>-<commit>.json')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    providers = [name.strip() for name in args.providers.split(',') if name.strip()]
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    levels = [int(level) for level in args.concurrency.split(',')]
+    create_buckets(providers, args.s3_url)
+
+    server = None
+    if args.url:
+        url, pid = args.url.rstrip('/'), args.server_pid
+    else:
+        server = Server(args)
+        server.start()
+        url, pid = server.url, server.process.pid
+    sampler = RssSampler(pid)
+    sampler.start()
+    started_at = datetime.now(timezone.utc)
+    results: List[Dict[str, Any]] = []
+    try:
+        client = Client(url)
+        for provider in providers:
+            account = register_user(client, provider)
+            for size in sizes:
+                for concurrency in levels:
+                    results.extend(run_round(client, provider, account, size, concurrency, args.requests, sampler))
+    finally:
+        sampler.stop()
+        if server:
+            server.stop()
+
+    revision = git_revision()
+    report = {
+        'meta': {
+            **revision,
+            'label': args.label,
+            'started_at': started_at.isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'server': 'external' if args.url else args.server,
+            'workers': None if args.url else args.workers,
+            'threads': None if args.url or args.server != 'gunicorn' else args.threads,
+            'requests': args.requests,
+            'peak_rss_bytes': sampler.peak if sampler.enabled else None
+        },
+        'results': results
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{started_at.strftime('%Y%m%dT%H%M%SZ')}-{revision['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as results_file:
+        json.dump(report, results_file, indent=2)
+    print(f'Results written to {output}')
+    return 1 if any(result['errors'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())